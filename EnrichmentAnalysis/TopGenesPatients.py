@@ -1,6 +1,13 @@
 import os
-import pandas as pd
+import sys
+import argparse
 import csv
+from functools import partial
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from NetworkStore import network_files, network_stem
+from DegreeCache import network_degrees, degree_memory, top_k
+from MemoryScheduler import MemoryScheduler
 
 
 def expand_path(path):
@@ -8,48 +15,75 @@ def expand_path(path):
     return os.path.expanduser(path)
 
 
-def process_networks(cell_dirs, output_dir):
+def output_name(k, top):
+    """top_connected_genes.csv for the first cutoff, read by the enrichment scripts; top_connected_genes_{k}.csv for the others."""
+    return 'top_connected_genes.csv' if k == top[0] else f'top_connected_genes_{k}.csv'
+
+
+def process_networks(cell_dirs, output_dir, top=(2500,), ties='first', cache_dir=None, max_workers=None):
     """
     Process multiple cell type directories and save results to specified output
 
     Args:
         cell_dirs (list): List of paths to cell type directories
         output_dir (str): Destination directory for output file
+        top (list): Numbers of top genes per patient; one output file per number, in one pass over the networks
+        ties (str): 'first' cuts genes tied at the cutoff in gene order, 'all' keeps all of them
+        cache_dir (str): Degree cache directory (default: DegreeCache.py default)
+        max_workers (int): Maximum number of networks processed at once
     """
     # Expand and create output directory if needed
     output_dir = expand_path(output_dir)
     os.makedirs(output_dir, exist_ok=True)
-    output_file = os.path.join(output_dir, 'top_connected_genes.csv')
-
-    with open(output_file, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['CellType', 'PatientID', 'TopGenes'])
-
-        for cell_dir in cell_dirs:
-            # Expand cell directory path
-            cell_dir = expand_path(cell_dir)
-            cell_type = os.path.basename(os.path.normpath(cell_dir))
 
-            for file in os.listdir(cell_dir):
-                if file.endswith('_consensus_network.csv'):
-                    patient_id = file.split('_consensus_network')[0]
-
-                    file_path = os.path.join(cell_dir, file)
-                    adj_matrix = pd.read_csv(file_path, header=0, index_col=None)
-                    adj_matrix.index = adj_matrix.columns
-
-                    connectivity = adj_matrix.sum(axis=1)
-                    top_genes = connectivity.nlargest(2500).index.tolist()
-
-                    writer.writerow([
-                        cell_type,
-                        patient_id,
-                        ','.join(top_genes)
-                    ])
+    # Every consensus network as (cell type, patient, file)
+    networks = []
+    for cell_dir in cell_dirs:
+        # Expand cell directory path
+        cell_dir = expand_path(cell_dir)
+        cell_type = os.path.basename(os.path.normpath(cell_dir))
+
+        for file_path in network_files(cell_dir, '_consensus_network'):
+            patient_id = network_stem(file_path).split('_consensus_network')[0]
+            networks.append((cell_type, patient_id, file_path))
+
+    # Degree vectors of all networks in parallel, read from the degree cache when a network is unchanged
+    paths = [file_path for _, _, file_path in networks]
+    degrees = {}
+    scheduler = MemoryScheduler(max_workers=max_workers)
+    scheduler.map(partial(network_degrees, cache_dir=cache_dir), paths, [degree_memory(path) for path in paths],
+                  callback=degrees.__setitem__)
+    print(scheduler.report())
+
+    for k in top:
+        output_file = os.path.join(output_dir, output_name(k, top))
+        with open(output_file, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['CellType', 'PatientID', 'TopGenes'])
+
+            for cell_type, patient_id, file_path in networks:
+                genes, connectivity = degrees[file_path]
+                top_genes = [genes[position] for position in top_k(connectivity, k, ties)]
+
+                writer.writerow([
+                    cell_type,
+                    patient_id,
+                    ','.join(top_genes)
+                ])
+        print(f"Top {k} genes per patient saved to {output_file}")
 
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description="Identify the most connected genes of every patient's consensus network.")
+    parser.add_argument("--top", type=int, nargs="+", default=[2500],
+                        help="Numbers of top genes; the first is written to top_connected_genes.csv, others to top_connected_genes_{k}.csv")
+    parser.add_argument("--ties", type=str, choices=["first", "all"], default="first",
+                        help="Cut genes tied at the cutoff in gene order, or keep all of them")
+    parser.add_argument("--degree_cache", type=str, help="Degree cache directory (default: $DEGREE_CACHE_DIR or ~/.cache/network_degrees)")
+    parser.add_argument("--workers", type=int, help="Maximum number of networks processed at once")
+    args = parser.parse_args()
+
     print('Top Genes...')
 
     CELL_TYPE_DIRS = [
@@ -62,5 +96,9 @@ if __name__ == '__main__':
 
     process_networks(
         cell_dirs=CELL_TYPE_DIRS,
-        output_dir=OUTPUT_DIR
+        output_dir=OUTPUT_DIR,
+        top=args.top,
+        ties=args.ties,
+        cache_dir=args.degree_cache,
+        max_workers=args.workers
     )
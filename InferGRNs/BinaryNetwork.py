@@ -1,83 +1,142 @@
 import pandas as pd
 import numpy as np
 import os
-import re
 import argparse
-
-def get_network_IDs(path):
-    files = os.listdir(path)
-
-    IDs = []
-    for file in files:
-        AML_match = re.search(r"AML[^_]+_", file)
-        BM_match = re.search(r"BM[^_]+_", file)
-        if AML_match:
-            IDs.append(AML_match.group(0).strip("_"))
-        if BM_match:
-            IDs.append(BM_match.group(0).strip("_"))
-
-    return files, list(set(IDs))
-
-def network_focus(path):
-    files, IDs = get_network_IDs(path)
-    focus = []
-
-    for ID in IDs:
-        matching_files = [file for file in files if ID in file]
-        # Drop files that contain 'matrix.csv'
-        matching_files = [file for file in matching_files if 'matrix.csv' not in file]
-        matching_files = [file for file in matching_files if '.csv' in file]
-        matching_files.append(ID)
-
-        focus.append(matching_files)
-    return focus
+from contextlib import ExitStack
+from NetworkCache import load_weighted_network
+from NetworkCatalog import NetworkCatalog
+from NetworkStore import PACKED_EXTENSION, SPARSE_EXTENSION, PackedNetworkWriter, SparseNetworkWriter, save_packed_network
+from ThresholdCalibration import load_thresholds
 
 def read_network(file_path):
-    """Read network data from a CSV file."""
-    df = pd.read_csv(file_path, header=0, index_col=False)
-    df.index = df.columns  # Ensure index and columns are aligned with the gene names
-    return df
+    """Read network data from a CSV file, through its memory-mapped float32 cache."""
+    matrix, genes = load_weighted_network(file_path)
+    return pd.DataFrame(matrix, index=genes, columns=genes, copy=False)
 
 def apply_threshold(network, threshold):
     """Apply threshold to create a binary network."""
     return (network > threshold).astype(int)
 
 def save_binary_network(network, output_path):
-    """Save the binary network to a CSV file."""
-    network.to_csv(output_path, index=False)
-
-def process_networks(input_dir, output_dir, thresholds):
+    """Save the binary network as a packed network or a CSV file, depending on the extension."""
+    if output_path.endswith(PACKED_EXTENSION):
+        save_packed_network(network, output_path)
+    else:
+        network.to_csv(output_path, index=False)
+
+def binarize_file(input_file, output_file, threshold):
+    """Threshold a single weighted network and save it as a binary network."""
+    network = read_network(input_file)
+    save_binary_network(apply_threshold(network, threshold), output_file)
+
+def process_networks(input_dir, output_dir, thresholds, output_format='bnet', catalog=None):
     """Process all networks, apply thresholds, and save binary networks."""
-    #methods = ['ARACNE.', 'CLR.', 'MRNET.', 'GENIE.']
-    #methods = ['ARACNE.', 'CLR.', 'MRNET.', 'GENIE_SYM.']
-    methods = ['GENIE_SYM.']
-
-    focus_list = network_focus(input_dir)
-
-    for focus in focus_list:
-        ID = focus[-1]  # The last element is the ID
-        for file in focus[:-1]:  # Exclude the last element (ID) when processing files
-            for method in methods:
-                if method in file:
-                    input_file = os.path.join(input_dir, file)
-                    output_file = os.path.join(output_dir, f"{ID}_{method.strip('.')}_binary.csv")
-
-                    # Read the network
-                    network = read_network(input_file)
-
-                    # Apply threshold
-                    binary_network = apply_threshold(network, thresholds[method.strip('.')])
-
-                    # Save binary network
-                    save_binary_network(binary_network, output_file)
-
-                    print(f"Processed {ID} {method.strip('.')} network")
+    #methods = ['ARACNE', 'CLR', 'MRNET', 'GENIE']
+    #methods = ['ARACNE', 'CLR', 'MRNET', 'GENIE_SYM']
+    methods = ['GENIE_SYM']
+
+    # Look the weighted networks up in the catalog instead of matching IDs in file names
+    catalog = catalog or NetworkCatalog()
+    catalog.scan(input_dir)
+    networks = catalog.by_patient(catalog.find(stage='weighted', directory=input_dir))
+
+    for ID, method_files in networks.items():
+        for method in methods:
+            if method in method_files:
+                input_file = method_files[method]
+                output_file = os.path.join(output_dir, f"{ID}_{method}_binary.{output_format}")
+
+                # Read the network, apply the threshold and save the binary network
+                binarize_file(input_file, output_file, thresholds[method])
+                catalog.register(output_file)
+
+                print(f"Processed {ID} {method} network")
+
+def read_network_blocks(matrix, block_size):
+    """Iterate over a (memory-mapped) network matrix in blocks of rows."""
+    for start in range(0, matrix.shape[0], block_size):
+        yield matrix[start:start + block_size]
+
+def process_consensus(input_dir, output_dir, thresholds, write_binaries=False, block_size=500, catalog=None,
+                      write_sparse=True):
+    """
+    Threshold the ARACNE, CLR, MRNET and GENIE_SYM networks of every patient and save only their union.
+
+    The four weighted networks are streamed together one block of rows at a time from their
+    memory-mapped caches, so at most one block per method is in memory. All four networks are
+    symmetric, so only the upper triangle of each block is kept. The consensus is also written as a
+    sparse .npz edge list unless write_sparse is unset, and per-method binary networks are written as
+    well when write_binaries is set.
+    """
+    methods = ['ARACNE', 'CLR', 'MRNET', 'GENIE_SYM']
+
+    catalog = catalog or NetworkCatalog()
+    catalog.scan(input_dir)
+    networks = catalog.by_patient(catalog.find(stage='weighted', directory=input_dir))
+
+    for ID, patient_files in networks.items():
+        missing = [method for method in methods if method not in patient_files]
+        if missing:
+            print(f"Skipping {ID}: no {', '.join(missing)} network found")
+            continue
+        method_files = {method: patient_files[method] for method in methods}
+
+        # All networks of a patient must share the same gene order
+        matrices = {}
+        genes = None
+        for method, file in method_files.items():
+            matrices[method], method_genes = load_weighted_network(file)
+            if genes is None:
+                genes = method_genes
+            elif method_genes != genes:
+                raise ValueError(f"Genes of {file} do not match the ARACNE network of {ID}")
+
+        with ExitStack() as stack:
+            consensus_file = os.path.join(output_dir, f"{ID}_consensus_network{PACKED_EXTENSION}")
+            consensus_writers = [stack.enter_context(PackedNetworkWriter(consensus_file, genes))]
+            if write_sparse:
+                sparse_file = os.path.join(output_dir, f"{ID}_consensus_network{SPARSE_EXTENSION}")
+                consensus_writers.append(stack.enter_context(SparseNetworkWriter(sparse_file, genes)))
+            binary_writers = {}
+            if write_binaries:
+                for method in method_files:
+                    output_file = os.path.join(output_dir, f"{ID}_{method}_binary{PACKED_EXTENSION}")
+                    binary_writers[method] = stack.enter_context(PackedNetworkWriter(output_file, genes))
+
+            readers = [read_network_blocks(matrices[method], block_size) for method in method_files]
+            for blocks in zip(*readers):
+                consensus_block = None
+                for method, block in zip(method_files, blocks):
+                    binary_block = np.asarray(block) > thresholds[method]
+                    if method in binary_writers:
+                        binary_writers[method].write_rows(binary_block)
+                    consensus_block = binary_block if consensus_block is None else consensus_block | binary_block
+                for writer in consensus_writers:
+                    writer.write_rows(consensus_block)
+
+        for writer in consensus_writers:
+            catalog.register(writer.path)
+        for writer in binary_writers.values():
+            catalog.register(writer.path)
+        print(f"Processed {ID} consensus network")
 
 # Main execution
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate binary networks for specific IDs.")
     parser.add_argument("--input_dir", type=str, help="Input directory containing network files")
     parser.add_argument("--output_dir", type=str, help="Output directory for binary networks")
+    parser.add_argument("--output_format", type=str, choices=["bnet", "csv"], default="bnet",
+                        help="Write packed networks (bnet) or dense CSV matrices (csv)")
+    parser.add_argument("--thresholds", type=str,
+                        help="Thresholds file from ThresholdCalibration.py, overrides the default thresholds")
+    parser.add_argument("--consensus", action="store_true",
+                        help="Threshold all four methods in one pass and write only the packed consensus networks")
+    parser.add_argument("--write_binaries", action="store_true",
+                        help="With --consensus, also write the packed binary network of every method")
+    parser.add_argument("--no_sparse", action="store_true",
+                        help="With --consensus, do not also write the consensus networks as sparse .npz edge lists")
+    parser.add_argument("--block_size", type=int, default=500,
+                        help="Number of rows read at once with --consensus")
     args = parser.parse_args()
 
     input_directory = os.path.expanduser(args.input_dir)
@@ -90,11 +149,18 @@ if __name__ == "__main__":
         'MRNET': 0.00306545740959235,
         'GENIE_SYM': 0.000288810502691997
     }
+    if args.thresholds:
+        thresholds.update(load_thresholds(os.path.expanduser(args.thresholds)))
+    print(f"Thresholds: {thresholds}")
 
     # Ensure output directory exists
     #os.makedirs(output_directory, exist_ok=True)
 
     # Process networks
-    process_networks(input_directory, output_directory, thresholds)
-
-    print("All networks processed and binary networks saved.")
\ No newline at end of file
+    if args.consensus:
+        process_consensus(input_directory, output_directory, thresholds, args.write_binaries, args.block_size,
+                          write_sparse=not args.no_sparse)
+        print("All networks processed and consensus networks saved.")
+    else:
+        process_networks(input_directory, output_directory, thresholds, args.output_format)
+        print("All networks processed and binary networks saved.")
\ No newline at end of file
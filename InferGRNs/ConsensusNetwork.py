@@ -1,74 +1,73 @@
 import numpy as np
 import pandas as pd
 import os
-import re
 import argparse
-
-def get_network_IDs(path):
-    files = os.listdir(path)
-
-    IDs = []
-    for file in files:
-        AML_match = re.search(r"AML[^_]+_", file)
-        BM_match = re.search(r"BM[^_]+_", file)
-        if AML_match:
-            IDs.append(AML_match.group(0).strip("_"))
-        if BM_match:
-            IDs.append(BM_match.group(0).strip("_"))
-
-    return files, list(set(IDs))
-
-def network_focus(path):
-    files, IDs = get_network_IDs(path)
-    focus = []
-
-    for ID in IDs:
-        matching_files = [file for file in files if ID in file]
-        # Drop files that contain 'matrix.csv'
-        matching_files = [file for file in matching_files if 'binary.csv' in file]
-        matching_files.append(ID)
-
-        focus.append(matching_files)
-    return focus
-
-def get_consensus(path):
-    focus = network_focus(path)
-
-    for networks in focus:
-        # Load the networks
-        net1 = pd.read_csv(f'{path}/{networks[0]}', header=0, index_col=None)
-        net1.index = net1.columns
-        net2 = pd.read_csv(f'{path}/{networks[1]}', header=0, index_col=None)
-        net2.index = net2.columns
-        net3 = pd.read_csv(f'{path}/{networks[2]}', header=0, index_col=None)
-        net3.index = net3.columns
-        net4 = pd.read_csv(f'{path}/{networks[3]}', header=0, index_col=None)
-        net4.index = net4.columns
-        ID = networks[-1]
-
-        # Extract the gene names
-        genes = net1.index
-
-        # Convert to numpy arrays
-        matrix1 = net1.to_numpy(dtype=bool)
-        matrix2 = net2.to_numpy(dtype=bool)
-        matrix3 = net3.to_numpy(dtype=bool)
-        matrix4 = net4.to_numpy(dtype=bool)
-
-        # Create the consensus network (union of all edges)
-        consensus_matrix = np.logical_or.reduce([matrix1, matrix2, matrix3, matrix4])
-
-        # Convert the consensus network back to a DataFrame
+from NetworkCatalog import NetworkCatalog
+from NetworkStore import SPARSE_EXTENSION, open_network, save_packed_network, save_sparse_network
+
+def save_consensus(network_files, output_file, sparse_file=None):
+    """
+    Save the union of the ARACNE, CLR, MRNET and GENIE_SYM binary networks of one patient,
+    and also as a sparse .npz edge list when sparse_file is given.
+    """
+    # Load the networks
+    net1 = open_network(network_files[0])
+    net2 = open_network(network_files[1])
+    net3 = open_network(network_files[2])
+    net4 = open_network(network_files[3])
+
+    # Extract the gene names
+    genes = net1.genes
+
+    # Convert to numpy arrays
+    matrix1 = net1.to_dense(dtype=bool)
+    matrix2 = net2.to_dense(dtype=bool)
+    matrix3 = net3.to_dense(dtype=bool)
+    matrix4 = net4.to_dense(dtype=bool)
+
+    # Create the consensus network (union of all edges)
+    consensus_matrix = np.logical_or.reduce([matrix1, matrix2, matrix3, matrix4])
+
+    # Save the consensus network
+    if output_file.endswith('.csv'):
         consensus_df = pd.DataFrame(consensus_matrix.astype(int), columns=genes, index=genes)
-
-        # Save the consensus network
-        consensus_df.to_csv(f"{path}/{ID}_consensus_network.csv", index = False)
-        print(f'{ID}_consensus_network.csv created')
+        consensus_df.to_csv(output_file, index=False)
+    else:
+        save_packed_network(consensus_matrix, output_file, genes=genes)
+    if sparse_file:
+        save_sparse_network(consensus_matrix, sparse_file, genes=genes)
+
+def get_consensus(path, output_format='bnet', catalog=None, write_sparse=True):
+    methods = ['ARACNE', 'CLR', 'MRNET', 'GENIE_SYM']
+
+    # Look the binary networks up in the catalog, by patient and method
+    catalog = catalog or NetworkCatalog()
+    catalog.scan(path)
+    focus = catalog.by_patient(catalog.find(stage='binary', directory=path))
+
+    for ID, networks in focus.items():
+        missing = [method for method in methods if method not in networks]
+        if missing:
+            print(f"Skipping {ID}: no {', '.join(missing)} binary network found")
+            continue
+
+        # Create and save the consensus network
+        output_file = f"{path}/{ID}_consensus_network.{output_format}"
+        sparse_file = f"{path}/{ID}_consensus_network{SPARSE_EXTENSION}" if write_sparse else None
+        save_consensus([networks[method] for method in methods], output_file, sparse_file)
+        catalog.register(output_file)
+        if sparse_file:
+            catalog.register(sparse_file)
+        print(f'{os.path.basename(output_file)} created')
 
 def main():
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Generate consensus networks from input files.")
     parser.add_argument("path", type=str, help="Path to the directory containing network files.")
+    parser.add_argument("--output_format", type=str, choices=["bnet", "csv"], default="bnet",
+                        help="Write packed networks (bnet) or dense CSV matrices (csv).")
+    parser.add_argument("--no_sparse", action="store_true",
+                        help="Do not also write the consensus networks as sparse .npz edge lists.")
     args = parser.parse_args()
 
     # Validate path
@@ -78,7 +77,7 @@ def main():
 
     # Run the consensus network generation
     print(f"Processing networks in directory: {args.path}")
-    get_consensus(args.path)
+    get_consensus(args.path, args.output_format, write_sparse=not args.no_sparse)
 
 if __name__ == "__main__":
     main()
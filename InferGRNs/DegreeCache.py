@@ -0,0 +1,89 @@
+import os
+import numpy as np
+from NetworkStore import open_network, PackedNetwork, PACKED_EXTENSION, SPARSE_EXTENSION
+from NetworkCatalog import network_hash
+from MemoryScheduler import network_memory
+
+# Degree vectors of binary networks, cached by content hash. The degree of a packed or sparse network
+# comes from its edges without a dense matrix, and is then saved as a small .npz file (genes and
+# degrees), so rankings with another cutoff or cell type only read these files. Cohort connectivity
+# is one aligned sum over a networks x genes degree matrix, and the top genes come from argpartition.
+CACHE_DIR_VARIABLE = 'DEGREE_CACHE_DIR'
+DEFAULT_CACHE_DIR = '~/.cache/network_degrees'
+
+
+def network_degrees(path, cache_dir=None):
+    """Genes and degree vector of a network, from the degree cache when the network is unchanged."""
+    cache_dir = os.path.expanduser(cache_dir or os.environ.get(CACHE_DIR_VARIABLE, DEFAULT_CACHE_DIR))
+    cache_path = os.path.join(cache_dir, f"{network_hash(path)}.npz")
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            return data['genes'].tolist(), data['degrees']
+
+    network = open_network(path)
+    genes, degrees = list(network.genes), np.asarray(network.degree(), dtype=np.int64)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, genes=np.array(genes, dtype=str), degrees=degrees)
+    os.replace(tmp_path, cache_path)
+    return genes, degrees
+
+
+def degree_memory(path, chunk_bytes=1 << 22):
+    """
+    Memory of computing the degree vector of a network, without a dense matrix for packed and sparse files:
+    a packed network is unpacked chunk_bytes at a time into int64 edge positions, rows and columns, a
+    sparse network holds its CSR index arrays (the uncompressed .npz file) and a CSV network is parsed whole.
+    """
+    if path.endswith(PACKED_EXTENSION):
+        network = PackedNetwork(path)
+        return 8 * chunk_bytes + 3 * 8 * network.n_edges + 3 * 8 * network.n
+    if path.endswith(SPARSE_EXTENSION):
+        return 2 * os.path.getsize(path)
+    return network_memory(path)
+
+
+def degree_matrix(paths, cache_dir=None):
+    """
+    Degrees of several networks aligned on the union of their genes (in order of first appearance),
+    as (genes, networks x genes matrix); genes missing from a network have degree 0. Networks that
+    cannot be read are skipped with a message.
+    """
+    index = {}
+    networks = []
+    for path in paths:
+        try:
+            genes, degrees = network_degrees(path, cache_dir)
+        except Exception as e:
+            print(f"Error reading {path}: {e}")
+            continue
+        positions = np.array([index.setdefault(gene, len(index)) for gene in genes], dtype=np.int64)
+        networks.append((positions, degrees))
+
+    matrix = np.zeros((len(networks), len(index)), dtype=np.int64)
+    for row, (positions, degrees) in enumerate(networks):
+        matrix[row, positions] = degrees
+    return list(index), matrix
+
+
+def top_k(scores, k, ties='first'):
+    """
+    Positions of the k largest scores, largest first, with ties in the order of their positions (like
+    a stable sort). Scores tied with the k-th score are cut at k with ties='first' and all kept with
+    ties='all' (as keep='first' and keep='all' of pandas nlargest).
+    """
+    if ties not in ('first', 'all'):
+        raise ValueError(f"Unknown ties {ties}, expected 'first' or 'all'")
+    scores = np.asarray(scores)
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    threshold = scores[candidates].min()
+    above = np.flatnonzero(scores > threshold)
+    tied = np.flatnonzero(scores == threshold)
+    if ties == 'first':
+        tied = tied[:k - len(above)]
+    chosen = np.concatenate([above, tied])
+    return chosen[np.lexsort((chosen, -scores[chosen]))]
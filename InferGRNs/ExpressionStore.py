@@ -0,0 +1,96 @@
+import os
+import numpy as np
+import pandas as pd
+from NetworkCache import read_meta, write_meta
+
+# Columnar storage of imputed expression matrices (cells x genes). The matrix is saved as a
+# column-major (Fortran order) .npy file, so every gene is one contiguous run of the file and a
+# memory map reads only the genes that are asked for. The gene names are kept in a .json file next
+# to it, like the weighted networks of NetworkCache.py. CSV files of NetworkImputation&Inference.R
+# are read through the same functions, with only the requested columns parsed.
+EXPRESSION_EXTENSIONS = ('.npy', '.csv')
+
+
+def save_expression(output_path, matrix, genes, dtype=np.float64):
+    """Save a cells x genes matrix as a column-major .npy file with its gene names."""
+    if not output_path.endswith('.npy'):
+        raise ValueError(f"Expression matrices are saved as .npy files, got {output_path}")
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.asfortranarray(matrix, dtype=dtype))
+    os.replace(tmp_path, output_path)
+    write_meta(output_path[:-len('.npy')] + '.json', {'genes': [str(gene) for gene in genes]})
+
+
+def expression_genes(path):
+    """Gene names of an expression matrix, without reading the values."""
+    if path.endswith('.npy'):
+        meta = read_meta(path[:-len('.npy')] + '.json')
+        if meta is None:
+            raise ValueError(f"No gene names found for {path}")
+        return meta['genes']
+    return list(pd.read_csv(path, header=0, nrows=0).columns)
+
+
+def expression_rows(path, chunk_bytes=1 << 24):
+    """Number of cells of an expression matrix, from the .npy header or the line count of a CSV."""
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r').shape[0]
+    lines, last = 0, b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    # A last line without newline still counts; the header line does not
+    return lines + (last != b'\n') - 1
+
+
+def read_expression_columns(path, genes=None, rows=None):
+    """
+    Read the given genes (all when None) of an expression matrix as a DataFrame, in the order asked for.
+    Only those columns are read from disk, for both the .npy and the CSV format. rows selects cells by
+    position (in the order given, without repeats); the other lines of a CSV are skipped unparsed.
+    """
+    all_genes = expression_genes(path)
+    if genes is None:
+        genes = all_genes
+    genes = list(genes)
+    if rows is not None:
+        rows = np.asarray(rows, dtype=np.int64)
+
+    if path.endswith('.npy'):
+        positions = {gene: i for i, gene in enumerate(all_genes)}
+        missing = [gene for gene in genes if gene not in positions]
+        if missing:
+            raise KeyError(f"{len(missing)} genes not found in {path}, e.g. {missing[:5]}")
+        matrix = np.load(path, mmap_mode='r')
+        columns = np.array([positions[gene] for gene in genes], dtype=np.int64)
+        # Column-major storage: each selected gene is copied from one contiguous block
+        selected = np.take(matrix, columns, axis=1) if rows is None else matrix[np.ix_(rows, columns)]
+        return pd.DataFrame(selected, columns=genes)
+
+    if rows is None:
+        return pd.read_csv(path, header=0, usecols=genes)[genes]
+    # Line 0 is the header; cells are read in file order and then put in the order asked for
+    keep = set((rows + 1).tolist())
+    df = pd.read_csv(path, header=0, usecols=genes, skiprows=lambda line: line > 0 and line not in keep)[genes]
+    order = np.argsort(np.argsort(rows))
+    return df.iloc[order].reset_index(drop=True)
+
+
+def expression_files(directory, suffix='_imputed'):
+    """
+    List the expression matrices in a directory whose name ends with suffix + an expression extension.
+    When a matrix exists both as .npy and as CSV, only the .npy file is returned.
+    """
+    found = {}
+    for file in sorted(os.listdir(directory)):
+        for rank, extension in enumerate(EXPRESSION_EXTENSIONS):
+            if file.endswith(suffix + extension):
+                stem = file[:-len(extension)]
+                if stem not in found or rank < found[stem][0]:
+                    found[stem] = (rank, os.path.join(directory, file))
+    return [found[stem][1] for stem in sorted(found)]
@@ -0,0 +1,142 @@
+import os
+import csv
+import json
+import numpy as np
+import pandas as pd
+
+# Persistent feature matrix (networks x features) for UMAP, PCA and the classifiers, e.g. the upper
+# triangles of all consensus networks. A store is a directory with
+#   features.dat  : one fixed size row per network, bit-packed (encoding 'bits') or a NumPy dtype
+#   features.json : number of features, encoding and free attributes (e.g. the gene vocabulary)
+#   rows.csv      : metadata of every row (file name, cell type, patient, ...)
+# Rows are appended one at a time: the data is written first and the row only counts once its
+# metadata line is written, so a crash leaves at most some unused bytes at the end of features.dat.
+# The matrix is read through a memory map, without a pandas copy.
+BITS = 'bits'
+
+
+class FeatureStore:
+    """
+    Appendable, memory-mapped matrix of network features with row metadata.
+
+    Args:
+        path (str): Directory of the store, created when it does not exist yet
+        n_features (int): Features per row, required to create a store
+        columns (list): Metadata columns of every row, required to create a store
+        encoding (str): 'bits' for binary features packed 8 per byte, or a NumPy dtype name
+        attrs (dict): Attributes saved with the store; an existing store must have the same ones
+    """
+
+    def __init__(self, path, n_features=None, columns=None, encoding=BITS, attrs=None):
+        self.path = os.path.expanduser(path)
+        self.data_path = os.path.join(self.path, 'features.dat')
+        self.meta_path = os.path.join(self.path, 'features.json')
+        self.rows_path = os.path.join(self.path, 'rows.csv')
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if n_features is not None and (meta['n_features'], meta['encoding']) != (n_features, encoding):
+                raise ValueError(f"{self.path} holds {meta['n_features']} features encoded as {meta['encoding']}, "
+                                 f"not {n_features} as {encoding}: use a new store")
+            if attrs is not None and meta['attrs'] != attrs:
+                raise ValueError(f"{self.path} was created with other attributes (e.g. genes), use a new store")
+        else:
+            if n_features is None or columns is None:
+                raise ValueError(f"No feature store at {self.path}: n_features and columns are needed to create one")
+            meta = {'n_features': int(n_features), 'encoding': encoding, 'columns': list(columns),
+                    'attrs': attrs or {}}
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.rows_path, 'w', newline='') as f:
+                csv.writer(f).writerow(meta['columns'])
+            open(self.data_path, 'wb').close()
+            tmp_path = f"{self.meta_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self.meta_path)
+
+        self.n_features = meta['n_features']
+        self.encoding = meta['encoding']
+        self.columns = meta['columns']
+        self.attrs = meta['attrs']
+        if self.encoding == BITS:
+            self.dtype = np.dtype(np.uint8)
+            self.row_bytes = (self.n_features + 7) // 8
+        else:
+            self.dtype = np.dtype(self.encoding)
+            self.row_bytes = self.n_features * self.dtype.itemsize
+        self._rows = pd.read_csv(self.rows_path, dtype=str, keep_default_na=False)
+
+    @property
+    def n_rows(self):
+        return len(self._rows)
+
+    def rows(self):
+        """Metadata of all rows, in the order of the matrix."""
+        return self._rows.copy()
+
+    def find(self, **values):
+        """Positions of the rows with the given metadata values."""
+        mask = np.ones(self.n_rows, dtype=bool)
+        for column, value in values.items():
+            mask &= (self._rows[column] == str(value)).to_numpy()
+        return np.flatnonzero(mask)
+
+    def latest(self, *columns):
+        """
+        Positions of the last row of every distinct value of the given metadata columns, in the order of the
+        matrix: a network appended again (e.g. after its file changed) supersedes its earlier rows.
+        """
+        return np.flatnonzero(~self._rows.duplicated(subset=list(columns), keep='last').to_numpy())
+
+    def encode(self, features):
+        """Bytes of one row as stored, bit-packed for the 'bits' encoding."""
+        features = np.asarray(features).ravel()
+        if features.size != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {features.size}")
+        if self.encoding == BITS:
+            return np.packbits(features != 0)
+        return features.astype(self.dtype, copy=False)
+
+    def append(self, features, packed=False, **metadata):
+        """Append one row: features (or its bit-packed bytes with packed) and a value for every metadata column."""
+        if set(metadata) != set(self.columns):
+            raise ValueError(f"Expected metadata columns {self.columns}, got {sorted(metadata)}")
+        row = np.asarray(features, dtype=np.uint8) if packed else self.encode(features)
+        if row.nbytes != self.row_bytes:
+            raise ValueError(f"Expected {self.row_bytes} bytes per row, got {row.nbytes}")
+
+        with open(self.data_path, 'r+b') as f:
+            # Drop what a crashed append may have left after the last complete row
+            f.truncate(self.n_rows * self.row_bytes)
+            f.seek(self.n_rows * self.row_bytes)
+            f.write(row.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.rows_path, 'a', newline='') as f:
+            csv.writer(f).writerow([metadata[column] for column in self.columns])
+        self._rows.loc[self.n_rows] = [str(metadata[column]) for column in self.columns]
+
+    def stored(self):
+        """Memory map of the stored rows (packed bytes for the 'bits' encoding)."""
+        shape = (self.n_rows, self.row_bytes if self.encoding == BITS else self.n_features)
+        if self.n_rows == 0:
+            return np.zeros(shape, dtype=self.dtype)
+        return np.memmap(self.data_path, dtype=self.dtype, mode='r', shape=shape)
+
+    def matrix(self, rows=None, dtype=None):
+        """
+        Feature matrix of the given rows (all by default). Bits are unpacked to uint8 (or dtype);
+        other encodings are returned as a memory map when no rows or dtype are given.
+        """
+        stored = self.stored()
+        if rows is not None:
+            stored = stored[np.asarray(rows)]
+        if self.encoding == BITS:
+            return np.unpackbits(stored, axis=1, count=self.n_features).astype(dtype or np.uint8, copy=False)
+        return stored if dtype is None else stored.astype(dtype)
+
+    def blocks(self, block_rows=64, dtype=None):
+        """Iterate over the matrix block_rows rows at a time as (first row, block), e.g. for IncrementalPCA."""
+        for start in range(0, self.n_rows, block_rows):
+            yield start, self.matrix(np.arange(start, min(start + block_rows, self.n_rows)), dtype)
@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import resource
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from NetworkStore import PACKED_EXTENSION, SPARSE_EXTENSION, PackedNetwork, SparseNetwork
+from NetworkCache import load_weighted_genes
+
+# Process pool that admits tasks under a memory budget instead of a fixed number of workers.
+# Every task comes with an estimate of the memory it needs (mostly dense gene x gene matrices, so
+# shape x dtype x copies). Tasks start while their estimates fit in the budget, which is taken from
+# MemAvailable and the cgroup limit of the job. The peak RSS of every task is measured in the worker
+# and used to scale the estimates of the tasks still waiting.
+
+CGROUP_FILES = [
+    ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),  # cgroup v2
+    ('/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes'),  # cgroup v1
+]
+# Tasks smaller than this are dominated by allocator and interpreter overhead, they don't rescale estimates
+MIN_CALIBRATION_BYTES = 256 * 1024 ** 2
+
+
+def read_meminfo(field):
+    """Value of a /proc/meminfo field in bytes, or None when unavailable."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                if name == field:
+                    return int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def cgroup_available():
+    """Memory left under the cgroup limit in bytes, or None without a limit."""
+    for limit_file, usage_file in CGROUP_FILES:
+        try:
+            with open(limit_file) as f:
+                limit = f.read().strip()
+            with open(usage_file) as f:
+                usage = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        # cgroup v2 reports "max", v1 a huge number when there is no limit
+        if limit == 'max' or int(limit) >= 1 << 60:
+            return None
+        return max(int(limit) - usage, 0)
+    return None
+
+
+def available_memory():
+    """Memory that can still be allocated, the smaller of MemAvailable and the cgroup headroom."""
+    candidates = [value for value in (read_meminfo('MemAvailable'), cgroup_available()) if value is not None]
+    if not candidates:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    return min(candidates)
+
+
+def matrix_bytes(shape, dtype=np.float64, copies=1):
+    """Memory of copies of a dense array of the given shape and dtype."""
+    return int(np.prod(shape, dtype=np.float64) * np.dtype(dtype).itemsize * copies)
+
+
+def network_size(path):
+    """Number of genes of a network file (sparse, packed, .npy or CSV) without reading the matrix."""
+    if path.endswith(PACKED_EXTENSION):
+        return PackedNetwork(path).n
+    if path.endswith(SPARSE_EXTENSION):
+        return SparseNetwork(path).n
+    return len(load_weighted_genes(path))
+
+
+def network_memory(path, dtype=np.float64, copies=1):
+    """Memory of copies of a network held as a dense gene x gene matrix."""
+    n = network_size(path)
+    return matrix_bytes((n, n), dtype, copies)
+
+
+def networks_memory(paths, dtype=np.float64, retained=0.5):
+    """
+    Memory of loading several networks one after another while keeping a part of each
+    (retained=0.5 for the upper triangle): the largest dense matrix plus everything retained.
+    """
+    sizes = [network_memory(path, dtype) for path in paths]
+    return int(max(sizes, default=0) + retained * sum(sizes))
+
+
+def reset_peak_rss():
+    """Reset the peak RSS (VmHWM) of this process to its current RSS, if the kernel allows it."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def current_rss():
+    """Current and peak RSS of this process in bytes."""
+    status = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                if name in ('VmRSS', 'VmHWM'):
+                    status[name] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and never resets
+    peak = status.get('VmHWM', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+    return status.get('VmRSS', peak), peak
+
+
+def run_measured(function, task):
+    """Run a task in a worker and measure how much memory it needed on top of the worker itself."""
+    reset = reset_peak_rss()
+    start_rss, start_peak = current_rss()
+    start_time = time.time()
+    result = function(task)
+    _, peak = current_rss()
+    baseline = start_rss if reset else start_peak
+    return result, {'peak_rss': peak, 'task_rss': max(peak - baseline, 0), 'seconds': time.time() - start_time}
+
+
+class MemoryScheduler:
+    """
+    Process pool that admits tasks while their estimated memory fits in a budget.
+
+    Args:
+        max_workers (int): Maximum number of concurrent tasks, defaults to the number of CPUs
+        memory_budget (int): Bytes the tasks may use together, defaults to memory_fraction of the available memory
+        memory_fraction (float): Fraction of the available memory used when no budget is given
+    """
+
+    def __init__(self, max_workers=None, memory_budget=None, memory_fraction=0.8):
+        self.max_workers = max_workers or os.cpu_count()
+        self.memory_budget = memory_budget or int(available_memory() * memory_fraction)
+        self.scale = 1.0
+        self.task_stats = []
+
+    def map(self, function, tasks, estimates, callback=None):
+        """
+        Run function on every task, like Pool.map, with at most memory_budget of estimated memory in use.
+
+        Tasks are started in order whenever they fit; a task larger than the whole budget runs alone.
+        After every task the estimates of the waiting tasks are scaled by the largest observed ratio
+        of peak RSS to estimate. callback(task, result) is called in this process as soon as a task
+        finishes, e.g. to save its result before the others are done.
+        """
+        tasks = list(tasks)
+        estimates = [max(int(estimate), 1) for estimate in estimates]
+        if len(estimates) != len(tasks):
+            raise ValueError("Every task needs a memory estimate")
+
+        results = [None] * len(tasks)
+        pending = list(range(len(tasks)))
+        running = {}
+        reserved = 0
+        self.task_stats = []
+
+        errors = []
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, max(len(tasks), 1))) as executor:
+            # After a failure no more tasks are started, but the running ones still finish and reach callback
+            while (pending and not errors) or running:
+                # First fit: start every waiting task whose scaled estimate still fits in the budget
+                for index in ([] if errors else list(pending)):
+                    if len(running) >= self.max_workers:
+                        break
+                    needed = int(estimates[index] * self.scale)
+                    if running and reserved + needed > self.memory_budget:
+                        continue
+                    running[executor.submit(run_measured, function, tasks[index])] = (index, needed)
+                    reserved += needed
+                    pending.remove(index)
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, needed = running.pop(future)
+                    reserved -= needed
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+                        continue
+                    results[index], stats = future.result()
+                    stats.update(task=index, estimate=estimates[index], reserved=needed)
+                    self.task_stats.append(stats)
+                    if callback is not None:
+                        callback(tasks[index], results[index])
+                    if estimates[index] >= MIN_CALIBRATION_BYTES:
+                        self.scale = max(self.scale, stats['task_rss'] / estimates[index])
+
+        if errors:
+            raise errors[0]
+        return results
+
+    def report(self):
+        """Summary of the measured memory of all tasks of the last map, to check the estimates."""
+        if not self.task_stats:
+            return "No tasks run"
+        ratios = [stats['task_rss'] / stats['estimate'] for stats in self.task_stats]
+        return json.dumps({
+            'tasks': len(self.task_stats),
+            'memory_budget_gb': round(self.memory_budget / 1e9, 2),
+            'max_peak_rss_gb': round(max(stats['peak_rss'] for stats in self.task_stats) / 1e9, 2),
+            'max_task_rss_gb': round(max(stats['task_rss'] for stats in self.task_stats) / 1e9, 2),
+            'rss_to_estimate': [round(min(ratios), 2), round(float(np.median(ratios)), 2), round(max(ratios), 2)],
+        })
@@ -0,0 +1,136 @@
+import os
+import glob
+import json
+import pickle
+import hashlib
+import numpy as np
+
+# Persisted nearest neighbour graphs for UMAP. Building the kNN graph of high dimensional network
+# vectors is the expensive part of a UMAP fit, and it does not depend on min_dist, the number of
+# components or the plotting. The pynndescent index and its kNN graph are saved per metric and data
+# digest (knn_{metric}_{digest}.pkl), with a digest of every raw data row in a .json file next to it:
+# a fit on the same data loads the graph, and data that only gained rows at the end inserts the new
+# rows into the saved index instead of building a new one, which then replaces the saved one. Standardization is part of the cache: the
+# scaler is fitted when the index is built and saved with it, so appended rows are scaled like the
+# rows already indexed and the digests of the raw rows keep matching.
+
+
+def row_digests(matrix, block_rows=256):
+    """BLAKE2b digest of every row of a matrix (array or memory map)."""
+    digests = []
+    for start in range(0, matrix.shape[0], block_rows):
+        block = np.ascontiguousarray(matrix[start:start + block_rows])
+        digests.extend(hashlib.blake2b(row.tobytes(), digest_size=16).hexdigest() for row in block)
+    return digests
+
+
+def data_digest(digests):
+    """Digest of a matrix from the digests of its rows."""
+    return hashlib.blake2b(''.join(digests).encode(), digest_size=16).hexdigest()
+
+
+class NeighborCache:
+    """
+    kNN graphs of feature matrices saved in a directory, one file per metric and data digest.
+
+    Args:
+        cache_dir (str): Directory of the saved graphs, one per data set (e.g. per cell type)
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def cache_path(self, key, digest):
+        return os.path.join(self.cache_dir, f"knn_{key}_{digest}.pkl")
+
+    def candidates(self, key):
+        """Row digests and n_neighbors of all saved graphs of a key, by data digest."""
+        found = {}
+        for path in glob.glob(os.path.join(glob.escape(self.cache_dir), f"knn_{key}_*.json")):
+            digest = os.path.basename(path)[len(f"knn_{key}_"):-len('.json')]
+            # Files of longer keys (e.g. knn_euclidean_scaled_* for knn_euclidean) have an _ left
+            if '_' not in digest and os.path.exists(self.cache_path(key, digest)):
+                with open(path) as f:
+                    found[digest] = json.load(f)
+        return found
+
+    def load(self, key, digest):
+        with open(self.cache_path(key, digest), 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, key, digests, n_neighbors, entry):
+        """Save an index (with its scaler) under the digest of its rows; the .json file is written last."""
+        digest = data_digest(digests)
+        path = self.cache_path(key, digest)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        meta_path = path[:-len('.pkl')] + '.json'
+        with open(f"{meta_path}.{os.getpid()}.tmp", 'w') as f:
+            json.dump({'digests': digests, 'n_neighbors': n_neighbors}, f)
+        os.replace(f"{meta_path}.{os.getpid()}.tmp", meta_path)
+
+    def remove(self, key, digest):
+        """Delete a saved graph, its .json file first so that it is no longer a candidate."""
+        path = self.cache_path(key, digest)
+        for file in (path[:-len('.pkl')] + '.json', path):
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+    def neighbors(self, matrix, metric='euclidean', n_neighbors=15, random_state=42, n_jobs=-1, scale=False):
+        """
+        kNN graph of the rows of matrix as ((indices, distances, index), data): the precomputed_knn of
+        umap.UMAP and the matrix the graph was computed on, standardized with the saved scaler when scale is set.
+
+        Rows are matched by the digests of the raw matrix. A saved graph of the same rows with at least
+        n_neighbors neighbours is used as is; one of the first rows gets the appended rows inserted.
+        """
+        from pynndescent import NNDescent
+        from sklearn.preprocessing import StandardScaler
+
+        key = f"{metric}_scaled" if scale else metric
+        digests = row_digests(matrix)
+        saved = {digest: meta for digest, meta in self.candidates(key).items() if meta['n_neighbors'] >= n_neighbors}
+
+        digest = data_digest(digests)
+        if digest in saved:
+            print(f"Using the saved {metric} kNN graph of {len(digests)} rows")
+            entry = self.load(key, digest)
+            return self.graph(entry['index'], n_neighbors), self.transform(entry, matrix)
+
+        # The saved graph of the most rows that are the first rows of the matrix
+        prefixes = [(len(meta['digests']), digest) for digest, meta in saved.items()
+                    if len(meta['digests']) < len(digests) and meta['digests'] == digests[:len(meta['digests'])]]
+        if prefixes:
+            known, digest = max(prefixes)
+            print(f"Adding {len(digests) - known} rows to the saved {metric} kNN graph")
+            entry = self.load(key, digest)
+            entry['index'].update(self.transform(entry, matrix[known:]))
+            self.save(key, digests, saved[digest]['n_neighbors'], entry)
+            # The updated index supersedes the saved one, which is removed once the new one is written
+            self.remove(key, digest)
+            return self.graph(entry['index'], n_neighbors), self.transform(entry, matrix)
+
+        print(f"Building the {metric} kNN graph of {len(digests)} rows")
+        entry = {'scaler': StandardScaler().fit(matrix) if scale else None}
+        data = self.transform(entry, matrix)
+        entry['index'] = NNDescent(data, metric=metric, n_neighbors=n_neighbors, random_state=random_state,
+                                   n_jobs=n_jobs, low_memory=True, compressed=False)
+        self.save(key, digests, n_neighbors, entry)
+        return self.graph(entry['index'], n_neighbors), data
+
+    @staticmethod
+    def transform(entry, matrix):
+        """Rows of matrix as indexed: standardized with the saved scaler, if any."""
+        matrix = np.asarray(matrix)
+        return entry['scaler'].transform(matrix) if entry['scaler'] is not None else matrix
+
+    @staticmethod
+    def graph(index, n_neighbors):
+        """The first n_neighbors neighbours of every row of an index's kNN graph."""
+        indices, distances = index.neighbor_graph
+        return indices[:, :n_neighbors], distances[:, :n_neighbors], index
@@ -0,0 +1,182 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Weighted networks (ARACNE, CLR, MRNET, GENIE, GENIE_SYM) are cached as float32 .npy files next to
+# the CSV they were converted from (or in NETWORK_CACHE_DIR when set). A small JSON file next to the
+# array keeps the gene names and the size, modification time and optionally the hash of the source CSV.
+# Whenever the source CSV changes the cache is rebuilt on the next access.
+ARRAY_SUFFIX = '.f32.npy'
+META_SUFFIX = '.f32.json'
+CACHE_DIR_VARIABLE = 'NETWORK_CACHE_DIR'
+
+
+def file_digest(path, chunk_size=1 << 24):
+    """BLAKE2b hash of a file's content."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_paths(csv_path, cache_dir=None):
+    """Location of the cached array and its metadata for a network CSV."""
+    cache_dir = cache_dir or os.environ.get(CACHE_DIR_VARIABLE)
+    csv_path = os.path.abspath(csv_path)
+    base = os.path.splitext(csv_path)[0]
+    if cache_dir:
+        # Prefix with a hash of the full path, so equally named files of different cell types don't collide
+        key = hashlib.blake2b(csv_path.encode('utf-8'), digest_size=8).hexdigest()
+        base = os.path.join(os.path.expanduser(cache_dir), f"{key}_{os.path.basename(base)}")
+    return base + ARRAY_SUFFIX, base + META_SUFFIX
+
+
+def read_meta(meta_path):
+    """Read the metadata of a cached or saved weighted network, or None when missing."""
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(meta_path, meta):
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def source_key(csv_path):
+    stat = os.stat(csv_path)
+    return {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def is_cache_valid(csv_path, array_path, meta, use_hash=False):
+    """Check whether a cached array still matches its source CSV."""
+    if meta is None or not os.path.exists(array_path):
+        return False
+    key = source_key(csv_path)
+    if all(meta.get(name) == value for name, value in key.items()):
+        return True
+    # The file was touched or copied; it is still valid if the content is unchanged
+    return use_hash and meta.get('source_size') == key['source_size'] and \
+        meta.get('source_hash') == file_digest(csv_path)
+
+
+def convert_to_cache(csv_path, array_path, meta_path, use_hash=False, block_size=500):
+    """Convert a square network CSV to a float32 .npy file, a block of rows at a time."""
+    key = source_key(csv_path)
+    genes = list(pd.read_csv(csv_path, header=0, index_col=False, nrows=0).columns)
+    n = len(genes)
+
+    os.makedirs(os.path.dirname(array_path), exist_ok=True)
+    tmp_path = f"{array_path}.{os.getpid()}.tmp"
+    array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(n, n))
+    row = 0
+    try:
+        for block in pd.read_csv(csv_path, header=0, index_col=False, chunksize=block_size):
+            if row + len(block) > n:
+                raise ValueError(f"{csv_path} has more rows than columns")
+            array[row:row + len(block)] = block.to_numpy(dtype=np.float32)
+            row += len(block)
+        if row != n:
+            raise ValueError(f"{csv_path} has {row} rows but {n} columns")
+        array.flush()
+        del array
+    except Exception:
+        del array
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, array_path)
+
+    meta = dict(key, genes=genes)
+    if use_hash:
+        meta['source_hash'] = file_digest(csv_path)
+    write_meta(meta_path, meta)
+    return meta
+
+
+def save_weighted_network(output_path, matrix, genes, upper_triangle=False):
+    """
+    Save a weighted network directly as a float32 .npy file with its gene names. Symmetric networks
+    can be saved as their upper triangle only (diagonal excluded), in half the space.
+    """
+    if not output_path.endswith('.npy'):
+        raise ValueError(f"Weighted networks are saved as .npy files, got {output_path}")
+    matrix = np.asarray(matrix, dtype=np.float32)
+    meta = {'genes': [str(gene) for gene in genes]}
+    if upper_triangle:
+        matrix = matrix[np.triu_indices(matrix.shape[0], k=1)]
+        meta['layout'] = 'upper_triangle'
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, matrix)
+    os.replace(tmp_path, output_path)
+    write_meta(output_path[:-len('.npy')] + '.json', meta)
+
+
+def expand_upper_triangle(triangle, n, block_size=1024):
+    """Square symmetric float32 matrix (zero diagonal) from its upper triangle, a block of rows at a time."""
+    matrix = np.zeros((n, n), dtype=np.float32)
+    start = 0
+    for row in range(n - 1):
+        length = n - row - 1
+        matrix[row, row + 1:] = triangle[start:start + length]
+        start += length
+    for i in range(0, n, block_size):
+        rows = slice(i, min(i + block_size, n))
+        matrix[rows, :i] = matrix[:i, rows].T
+        diagonal_block = matrix[rows, rows]
+        matrix[rows, rows] = diagonal_block + diagonal_block.T
+    return matrix
+
+
+def load_weighted_network(path, cache_dir=None, use_hash=False):
+    """
+    Memory-map a weighted network as a read-only float32 array (networks saved as an upper
+    triangle are expanded in memory instead).
+
+    Args:
+        path (str): Network CSV, or a .npy file written by save_weighted_network
+        cache_dir (str): Directory for converted CSVs, defaults to NETWORK_CACHE_DIR or next to the CSV
+        use_hash (bool): Also accept a cache whose source was touched but has the same content
+
+    Returns:
+        (np.memmap, list): Network matrix and gene names
+    """
+    if path.endswith('.npy'):
+        meta = read_meta(path[:-len('.npy')] + '.json')
+        if meta is None:
+            raise ValueError(f"No gene names found for {path}")
+        if meta.get('layout') == 'upper_triangle':
+            return expand_upper_triangle(np.load(path, mmap_mode='r'), len(meta['genes'])), meta['genes']
+        return np.load(path, mmap_mode='r'), meta['genes']
+
+    array_path, meta_path = cache_paths(path, cache_dir)
+    meta = read_meta(meta_path)
+    if not is_cache_valid(path, array_path, meta, use_hash):
+        print(f"Converting {path} to {array_path}")
+        meta = convert_to_cache(path, array_path, meta_path, use_hash)
+    elif use_hash and meta.get('source_mtime_ns') != os.stat(path).st_mtime_ns:
+        write_meta(meta_path, dict(meta, **source_key(path)))
+
+    return np.load(array_path, mmap_mode='r'), meta['genes']
+
+
+def load_weighted_genes(path, cache_dir=None):
+    """Gene names of a weighted network, without reading the matrix itself."""
+    if path.endswith('.npy'):
+        meta = read_meta(path[:-len('.npy')] + '.json')
+    else:
+        array_path, meta_path = cache_paths(path, cache_dir)
+        meta = read_meta(meta_path)
+        if not is_cache_valid(path, array_path, meta):
+            return list(pd.read_csv(path, header=0, index_col=False, nrows=0).columns)
+    if meta is None:
+        raise ValueError(f"No gene names found for {path}")
+    return meta['genes']
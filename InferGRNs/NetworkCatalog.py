@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+from NetworkCache import file_digest, read_meta
+from NetworkStore import PackedNetwork
+
+# Persistent catalog of the pipeline's files (imputed data, MIMs, weighted, binary and consensus networks).
+# Every file is recorded once with its patient, cell type, method, stage, shape, dtype and content hash,
+# so scripts can look networks up ("all GENIE_SYM networks of Monocyte") instead of listing directories
+# and matching IDs as substrings, which lets AML1 pick up the files of AML12.
+CATALOG_VARIABLE = 'NETWORK_CATALOG'
+DEFAULT_CATALOG = '~/network_catalog.sqlite'
+
+CELL_TYPES = ['Dendritic', 'Monocyte', 'Progenitor']
+METHODS = ['ARACNE', 'CLR', 'MRNET', 'GENIE_SYM', 'GENIE3', 'GENIE']
+
+# The patient ID is a whole underscore separated token, e.g. 10000_Genes_AML556_ARACNE.csv
+PATIENT_PATTERN = re.compile(r'(?:^|_)((?:AML|BM)[^_.]+)_(.+)$')
+STAGE_PATTERNS = [
+    ('imputed', None, re.compile(r'^imputed\.(csv|npy)$')),
+    ('mim', None, re.compile(r'^matrix\.(csv|npy)$')),
+    ('filtered', None, re.compile(r'^filtered\.csv$')),
+    ('consensus', 'CONSENSUS', re.compile(r'^consensus_network\.(csv|bnet|npz)$')),
+    ('binary', None, re.compile(rf'^({"|".join(METHODS)})_binary\.(csv|bnet)$')),
+    ('weighted', None, re.compile(rf'^({"|".join(METHODS)})\.(csv|npy)$')),
+]
+SKIPPED_SUFFIXES = ('.f32.npy', '.f32.json', '.tmp')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    patient TEXT NOT NULL,
+    cell_type TEXT,
+    method TEXT,
+    stage TEXT NOT NULL,
+    format TEXT NOT NULL,
+    rows INTEGER,
+    cols INTEGER,
+    dtype TEXT,
+    content_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_lookup ON artifacts (cell_type, method, stage);
+CREATE INDEX IF NOT EXISTS artifacts_patient ON artifacts (patient, stage);
+CREATE INDEX IF NOT EXISTS artifacts_directory ON artifacts (directory, stage);
+"""
+COLUMNS = ['path', 'directory', 'patient', 'cell_type', 'method', 'stage', 'format', 'rows', 'cols',
+           'dtype', 'content_hash', 'size', 'mtime_ns', 'recorded']
+
+
+def parse_artifact(path):
+    """Patient, cell type, method, stage and format of a pipeline file, or None for other files."""
+    file = os.path.basename(path)
+    if file.endswith(SKIPPED_SUFFIXES):
+        return None
+    match = PATIENT_PATTERN.search(file)
+    if not match:
+        return None
+
+    patient, rest = match.groups()
+    for stage, method, pattern in STAGE_PATTERNS:
+        stage_match = pattern.match(rest)
+        if stage_match:
+            if method is None and stage in ('binary', 'weighted'):
+                method = stage_match.group(1)
+            cell_type = next((cell for cell in CELL_TYPES
+                              if any(cell in part for part in os.path.abspath(path).split(os.sep))), None)
+            return {'patient': patient, 'cell_type': cell_type, 'method': method, 'stage': stage,
+                    'format': os.path.splitext(file)[1].lstrip('.')}
+    return None
+
+
+def describe_file(path, file_format, chunk_size=1 << 24):
+    """Content hash, shape and dtype of a file, reading it once."""
+    rows = cols = dtype = None
+    if file_format == 'npy':
+        array = np.load(path, mmap_mode='r')
+        rows, cols = (array.shape + (None,))[:2]
+        dtype = str(array.dtype)
+        meta = read_meta(path[:-len('.npy')] + '.json')
+        if meta and meta.get('layout') == 'upper_triangle':
+            rows = cols = len(meta['genes'])
+    elif file_format == 'bnet':
+        network = PackedNetwork(path)
+        rows = cols = network.n
+        dtype = 'bit'
+    elif file_format == 'npz':
+        with np.load(path) as data:
+            rows = cols = len(data['genes'])
+            dtype = 'bool'
+    elif file_format == 'csv':
+        cols = len(pd.read_csv(path, header=0, index_col=False, nrows=0).columns)
+        newlines = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                newlines += chunk.count(b'\n')
+        rows = max(newlines - 1, 0)
+        dtype = 'csv'
+    return file_digest(path), rows, cols, dtype
+
+
+class NetworkCatalog:
+    """SQLite catalog of pipeline files, updated incrementally as files are scanned or written."""
+
+    def __init__(self, catalog_path=None):
+        self.catalog_path = os.path.expanduser(catalog_path or os.environ.get(CATALOG_VARIABLE, DEFAULT_CATALOG))
+        self.connection = sqlite3.connect(self.catalog_path, timeout=60)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def register(self, path, force=False):
+        """Record (or refresh) a single file. Unchanged files are not hashed again."""
+        path = os.path.abspath(os.path.expanduser(path))
+        info = parse_artifact(path)
+        if info is None:
+            return None
+
+        stat = os.stat(path)
+        existing = self.connection.execute('SELECT * FROM artifacts WHERE path = ?', (path,)).fetchone()
+        if existing and not force and existing['size'] == stat.st_size and existing['mtime_ns'] == stat.st_mtime_ns:
+            return dict(existing)
+
+        content_hash, rows, cols, dtype = describe_file(path, info['format'])
+        record = dict(info, path=path, directory=os.path.dirname(path), rows=rows, cols=cols, dtype=dtype,
+                      content_hash=content_hash, size=stat.st_size, mtime_ns=stat.st_mtime_ns, recorded=time.time())
+        with self.connection:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO artifacts ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [record[column] for column in COLUMNS])
+        return record
+
+    def scan(self, directory):
+        """Bring the catalog up to date with a directory: add new or changed files, drop deleted ones."""
+        directory = os.path.abspath(os.path.expanduser(directory))
+        present = set()
+        for file in sorted(os.listdir(directory)):
+            path = os.path.join(directory, file)
+            if os.path.isfile(path) and self.register(path) is not None:
+                present.add(path)
+
+        known = [row['path'] for row in
+                 self.connection.execute('SELECT path FROM artifacts WHERE directory = ?', (directory,))]
+        with self.connection:
+            self.connection.executemany('DELETE FROM artifacts WHERE path = ?',
+                                        [(path,) for path in known if path not in present])
+
+    def find(self, stage=None, method=None, cell_type=None, patient=None, directory=None, file_format=None):
+        """All recorded files matching the given fields, ordered by patient and method."""
+        conditions = {'stage': stage, 'method': method, 'cell_type': cell_type, 'patient': patient,
+                      'format': file_format,
+                      'directory': os.path.abspath(os.path.expanduser(directory)) if directory else None}
+        conditions = {column: value for column, value in conditions.items() if value is not None}
+        where = ' AND '.join(f"{column} = ?" for column in conditions) or '1'
+        query = f"SELECT * FROM artifacts WHERE {where} ORDER BY patient, method, path"
+        return [dict(row) for row in self.connection.execute(query, list(conditions.values()))]
+
+    def by_patient(self, records, preferred_formats=('bnet', 'npz', 'npy', 'csv')):
+        """
+        Group records as {patient: {method: path}}. When a network exists in several formats
+        (e.g. GENIE_SYM as .csv and .npy), the first of preferred_formats is used.
+        """
+        rank = {file_format: i for i, file_format in enumerate(preferred_formats)}
+        grouped = {}
+        for record in sorted(records, key=lambda record: rank.get(record['format'], len(rank)), reverse=True):
+            grouped.setdefault(record['patient'], {})[record['method']] = record['path']
+        return grouped
+
+    def close(self):
+        self.connection.close()
+
+
+def network_hash(path):
+    """Content hash of a file, from the catalog for pipeline files (hashed again only when they change)."""
+    catalog = NetworkCatalog()
+    record = catalog.register(path)
+    catalog.close()
+    return record['content_hash'] if record else file_digest(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update and query the network file catalog.")
+    parser.add_argument("directories", type=str, nargs="*", help="Directories to scan into the catalog")
+    parser.add_argument("--catalog", type=str, help=f"Catalog file (default: ${CATALOG_VARIABLE} or {DEFAULT_CATALOG})")
+    parser.add_argument("--stage", type=str, help="Only list files of this stage")
+    parser.add_argument("--method", type=str, help="Only list files of this method")
+    parser.add_argument("--cell_type", type=str, help="Only list files of this cell type")
+    parser.add_argument("--patient", type=str, help="Only list files of this patient")
+    args = parser.parse_args()
+
+    catalog = NetworkCatalog(args.catalog)
+    for directory in args.directories:
+        catalog.scan(directory)
+        print(f"Scanned {directory}")
+
+    for record in catalog.find(args.stage, args.method, args.cell_type, args.patient):
+        print(json.dumps({column: record[column] for column in
+                          ['patient', 'cell_type', 'method', 'stage', 'rows', 'cols', 'dtype', 'content_hash', 'path']}))
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
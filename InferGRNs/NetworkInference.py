@@ -0,0 +1,241 @@
+import os
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+from concurrent.futures import ThreadPoolExecutor
+from NetworkCache import save_weighted_network
+from NetworkCatalog import NetworkCatalog
+from ExpressionStore import save_expression
+
+# NumPy backend for the inference of NetworkImputation&Inference.R: imputation, minet's Spearman
+# build.mim, clr, aracne and mrnet. The MIM is computed with blocked float32 matrix products of the
+# standardized ranks; ARACNE and MRNET run on blocks of genes in a thread pool (NumPy releases the GIL
+# in its kernels). All networks are written as float32 .npy files with their gene names, which
+# BinaryNetwork.py reads directly.
+
+INFERENCE_METHODS = ['ARACNE', 'CLR', 'MRNET']
+MAX_SQUARED_CORRELATION = 0.999999  # Same cap as minet's build.mim
+
+
+def rank_standardize(expression):
+    """
+    Rank every gene (column) like R's cor(method = "spearman") and scale the ranks so that
+    the dot product of two columns is their Spearman correlation.
+    """
+    ranks = rankdata(expression, axis=0)
+    ranks -= ranks.mean(axis=0)
+    norms = np.sqrt((ranks ** 2).sum(axis=0))
+    norms[norms == 0] = 1  # Constant genes get a correlation of zero with everything
+    return (ranks / norms).astype(np.float32)
+
+
+def spearman_to_mim(correlation):
+    """Mutual information of minet's build.mim(estimator = "spearman") from Spearman correlations."""
+    squared = np.minimum(correlation * correlation, MAX_SQUARED_CORRELATION)
+    return -0.5 * np.log1p(-squared)
+
+
+def impute(expression, rng):
+    """Replace zeros by uniform noise below the smallest nonzero value / 1e7, as in NetworkImputation&Inference.R."""
+    values = np.unique(expression)
+    smallest_value = values[1] / 1e7 if values.size > 1 else 0
+    imputed = expression.copy()
+    zeros = imputed == 0
+    imputed[zeros] = rng.uniform(0, smallest_value, size=int(zeros.sum()))
+    return imputed
+
+
+def spearman_mim(expression, block_size=2048):
+    """Spearman mutual information matrix (float32, zero diagonal) of a cells x genes matrix."""
+    return standardized_mim(rank_standardize(expression), block_size)
+
+
+def standardized_mim(standardized, block_size=2048):
+    """Mutual information matrix from the output of rank_standardize, block_size genes at a time."""
+    n = standardized.shape[1]
+    mim = np.empty((n, n), dtype=np.float32)
+    for i in range(0, n, block_size):
+        rows = slice(i, min(i + block_size, n))
+        for j in range(i, n, block_size):
+            cols = slice(j, min(j + block_size, n))
+            block = spearman_to_mim(standardized[:, rows].T @ standardized[:, cols])
+            mim[rows, cols] = block
+            mim[cols, rows] = block.T
+    np.fill_diagonal(mim, 0)
+    return mim
+
+
+def clr(mim, block_size=2048):
+    """minet's clr: sqrt(z_i^2 + z_j^2) with z-scores of every row (negative ones set to zero)."""
+    mean = mim.mean(axis=1, dtype=np.float64)
+    sd = np.sqrt(np.maximum((mim.astype(np.float64) ** 2).mean(axis=1) - mean ** 2, 0))
+    sd[sd == 0] = np.inf  # Rows without any spread get z-scores of zero
+    mean, sd = mean.astype(np.float32), sd.astype(np.float32)
+
+    network = np.empty_like(mim, dtype=np.float32)
+    for i in range(0, mim.shape[0], block_size):
+        rows = slice(i, min(i + block_size, mim.shape[0]))
+        z_rows = np.maximum((mim[rows] - mean[rows, None]) / sd[rows, None], 0)
+        z_cols = np.maximum((mim[rows] - mean[None, :]) / sd[None, :], 0)
+        network[rows] = np.sqrt(z_rows ** 2 + z_cols ** 2)
+    return network
+
+
+def aracne_rows(mim, network, rows, eps, k_block):
+    """Remove the weakest edge of every triangle for the pairs (i, j) with i in rows and j >= rows.start."""
+    start = rows.start
+    # max over k of min(mim[i, k], mim[j, k]), the strongest alternative path through a third gene
+    max_min = np.zeros((rows.stop - start, mim.shape[0] - start), dtype=np.float32)
+    for k in range(0, mim.shape[0], k_block):
+        genes = slice(k, min(k + k_block, mim.shape[0]))
+        paths = np.minimum(mim[rows, None, genes], mim[None, start:, genes])
+        np.maximum(max_min, paths.max(axis=2), out=max_min)
+
+    removed = mim[rows, start:] < max_min - eps
+    block = network[rows, start:]
+    block[removed] = 0
+    network[rows, start:] = block
+    network[start:, rows] = block.T
+
+
+def aracne(mim, eps=0, row_block=16, k_block=128, threads=None):
+    """
+    minet's aracne: an edge is removed when it is the weakest of a triangle (by more than eps).
+    Blocks of rows are processed in parallel; the work of a block is row_block x genes x k_block.
+    """
+    network = mim.astype(np.float32, copy=True)
+    blocks = [slice(i, min(i + row_block, mim.shape[0])) for i in range(0, mim.shape[0], row_block)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda rows: aracne_rows(mim, network, rows, eps, k_block), blocks))
+    return network
+
+
+def mrnet_targets(mim, targets):
+    """
+    Greedy maximum relevance / minimum redundancy selection of minet's mrnet for a batch of target
+    genes at once. Returns the scores of the selected genes of every target (targets x genes).
+    """
+    batch = np.arange(len(targets))
+    relevance = mim[targets].astype(np.float32)
+    redundancy = np.zeros_like(relevance)
+    available = np.ones_like(relevance, dtype=bool)
+    available[batch, targets] = False
+    scores = np.zeros_like(relevance)
+
+    candidates = np.where(available, relevance, -np.inf)
+    selected = candidates.argmax(axis=1)
+    best = candidates[batch, selected]
+    active = best > 0
+    n_selected = 1
+    while active.any():
+        rows = batch[active]
+        scores[rows, selected[rows]] = best[rows]
+        available[rows, selected[rows]] = False
+        redundancy[rows] += mim[selected[rows]]
+
+        candidates = np.where(available[rows], relevance[rows] - redundancy[rows] / n_selected, -np.inf)
+        selected[rows] = candidates.argmax(axis=1)
+        best[rows] = candidates[np.arange(len(rows)), selected[rows]]
+        active[rows] = best[rows] > 0
+        n_selected += 1
+    return scores
+
+
+def mrnet(mim, batch_size=256, threads=None):
+    """minet's mrnet, symmetrized with the maximum of both directions."""
+    n = mim.shape[0]
+    network = np.zeros((n, n), dtype=np.float32)
+
+    def run(start):
+        targets = np.arange(start, min(start + batch_size, n))
+        network[targets] = mrnet_targets(mim, targets)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(run, range(0, n, batch_size)))
+    return np.maximum(network, network.T)
+
+
+def infer_networks(mim, methods=INFERENCE_METHODS, threads=None):
+    """Infer the networks of the given methods from a MIM, as {method: network}."""
+    networks = {}
+    for method in methods:
+        if method == 'ARACNE':
+            networks[method] = aracne(mim, threads=threads)
+        elif method == 'CLR':
+            networks[method] = clr(mim)
+        elif method == 'MRNET':
+            networks[method] = mrnet(mim, threads=threads)
+        else:
+            raise ValueError(f"Unknown inference method {method}")
+    return networks
+
+
+def read_dataset(file_path):
+    """Read a patient's expression dataset (cells x genes) with missing values set to zero."""
+    dataset = pd.read_csv(file_path, header=0).fillna(0)
+    return dataset.to_numpy(dtype=np.float64), list(dataset.columns)
+
+
+def infer_patient(file_path, output_dir, methods=INFERENCE_METHODS, seed=7, block_size=2048, threads=None,
+                  write_mim=False, write_csv=False):
+    """
+    Impute one patient's dataset and write its networks to output_dir.
+
+    The file names follow NetworkImputation&Inference.R, with .npy files instead of CSV: the imputed
+    matrix is stored column-major (ExpressionStore.py), and the MIM, only written with write_mim, as
+    its float32 upper triangle. write_csv also writes the imputed CSV for GENIE3_Inference.R and
+    PermutationThreshold.R.
+    """
+    subject_name = os.path.splitext(os.path.basename(file_path))[0]
+    print(f"{subject_name} loading...")
+    expression, genes = read_dataset(file_path)
+
+    # Seeded per patient, like set.seed(7) in the R script (the random values themselves differ from R's)
+    imputed = impute(expression, np.random.default_rng(seed))
+    outputs = {'imputed': os.path.join(output_dir, f"{subject_name}_imputed.npy")}
+    save_expression(outputs['imputed'], imputed, genes)
+    if write_csv:
+        pd.DataFrame(imputed, columns=genes).to_csv(os.path.join(output_dir, f"{subject_name}_imputed.csv"), index=False)
+
+    mim = spearman_mim(imputed, block_size)
+    if write_mim:
+        outputs['MIM'] = os.path.join(output_dir, f"{subject_name}_matrix.npy")
+        save_weighted_network(outputs['MIM'], mim, genes, upper_triangle=True)
+
+    for method, network in infer_networks(mim, methods, threads).items():
+        outputs[method] = os.path.join(output_dir, f"{subject_name}_{method}.npy")
+        save_weighted_network(outputs[method], network, genes)
+    print(f"{subject_name} complete!")
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Impute datasets and infer ARACNE, CLR and MRNET networks with NumPy.")
+    parser.add_argument("--input", type=str, required=True, help="Input directory")
+    parser.add_argument("--output", type=str, required=True, help="Output directory")
+    parser.add_argument("--methods", type=str, nargs="+", default=INFERENCE_METHODS, choices=INFERENCE_METHODS)
+    parser.add_argument("--threads", type=int, help="Threads for ARACNE and MRNET (default: all CPUs)")
+    parser.add_argument("--block_size", type=int, default=2048, help="Genes per block of the MIM")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--write_mim", action="store_true", help="Also save the MIM (float32 upper triangle)")
+    parser.add_argument("--imputed_csv", action="store_true",
+                        help="Also save the imputed matrix as CSV, for GENIE3_Inference.R and PermutationThreshold.R")
+    args = parser.parse_args()
+
+    input_dir = os.path.expanduser(args.input)
+    output_dir = os.path.expanduser(args.output)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Same selection as the R script: CSV files with 10000 in their name
+    files = sorted(file for file in glob.glob(os.path.join(input_dir, "*10000*.csv")))
+    for file in files:
+        infer_patient(file, output_dir, args.methods, args.seed, args.block_size, args.threads,
+                      args.write_mim, args.imputed_csv)
+
+    NetworkCatalog().scan(output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+import os
+import json
+import struct
+import numpy as np
+import pandas as pd
+
+# Packed binary network format (.bnet)
+#   prefix  : magic, version, flags, number of genes, number of edges, header length
+#   header  : JSON object holding the gene vocabulary
+#   data    : upper triangle (diagonal excluded) packed 8 edges per byte, row-major,
+#             starting at the first 64 byte boundary after the header
+#
+# Sparse network format (.npz), for consensus networks whose size should follow the number of edges
+#   indptr  : CSR row pointers of the upper triangle (diagonal excluded), int64
+#   indices : column of every edge, int32, ascending within a row
+#   genes   : gene vocabulary
+MAGIC = b'BNET'
+VERSION = 1
+PREFIX = struct.Struct('<4sHHQQQ')
+ALIGNMENT = 64
+FLAG_SYMMETRIC = 1
+
+PACKED_EXTENSION = '.bnet'
+SPARSE_EXTENSION = '.npz'
+# In order of preference when a network exists in several formats
+NETWORK_EXTENSIONS = (SPARSE_EXTENSION, PACKED_EXTENSION, '.csv')
+
+
+def n_pairs(n):
+    """Number of entries in the strict upper triangle of an n x n matrix."""
+    return n * (n - 1) // 2
+
+
+def row_offsets(n):
+    """Position of the first upper triangle entry of every row."""
+    rows = np.arange(n, dtype=np.int64)
+    return rows * n - rows * (rows + 1) // 2
+
+
+def pairs_to_rows_cols(positions, n):
+    """Convert upper triangle positions back to (row, column) gene indices."""
+    offsets = row_offsets(n)
+    rows = np.searchsorted(offsets, positions, side='right') - 1
+    cols = positions - offsets[rows] + rows + 1
+    return rows, cols
+
+
+class PackedNetworkWriter:
+    """Write a symmetric binary network row by row into a packed .bnet file."""
+
+    def __init__(self, path, genes, flush_bits=1 << 23):
+        self.path = path
+        self.genes = [str(gene) for gene in genes]
+        self.n = len(self.genes)
+        self.row = 0
+        self.n_edges = 0
+        self.flush_bits = flush_bits
+        self._segments = []
+        self._buffered = 0
+        self._leftover = np.zeros(0, dtype=bool)
+
+        header = json.dumps({'genes': self.genes}).encode('utf-8')
+        data_offset = PREFIX.size + len(header)
+        data_offset += -data_offset % ALIGNMENT
+
+        # Write next to the target and move into place on close, so readers never see half a file
+        self._tmp_path = f"{path}.tmp"
+        self._file = open(self._tmp_path, 'wb')
+        self._header = header
+        self._file.write(self._prefix())
+        self._file.write(header)
+        self._file.write(b'\0' * (data_offset - PREFIX.size - len(header)))
+
+    def _prefix(self):
+        return PREFIX.pack(MAGIC, VERSION, FLAG_SYMMETRIC, self.n, self.n_edges, len(self._header))
+
+    def write_rows(self, rows):
+        """Append a block of consecutive adjacency matrix rows (nonzero means edge)."""
+        rows = np.asarray(rows)
+        if rows.ndim != 2 or rows.shape[1] != self.n:
+            raise ValueError(f"Expected rows of length {self.n}, got shape {rows.shape}")
+        if self.row + rows.shape[0] > self.n:
+            raise ValueError(f"Too many rows written to {self.path}")
+
+        for row in rows:
+            segment = row[self.row + 1:] != 0
+            self._segments.append(segment)
+            self._buffered += segment.size
+            self.row += 1
+            if self._buffered >= self.flush_bits:
+                self._flush()
+
+    def write_upper_bits(self, bits):
+        """Append upper triangle entries directly, in row-major order."""
+        bits = np.asarray(bits, dtype=bool).ravel()
+        self._segments.append(bits)
+        self._buffered += bits.size
+        if self._buffered >= self.flush_bits:
+            self._flush()
+
+    def _flush(self, final=False):
+        bits = np.concatenate([self._leftover] + self._segments)
+        self._segments = []
+        self._buffered = 0
+
+        usable = bits.size if final else bits.size - bits.size % 8
+        self.n_edges += int(np.count_nonzero(bits[:usable]))
+        self._file.write(np.packbits(bits[:usable]).tobytes())
+        self._leftover = bits[usable:]
+
+    def close(self):
+        """Finish the file and move it to its final location."""
+        self._flush(final=True)
+        expected = PREFIX.size + len(self._header)
+        expected += -expected % ALIGNMENT
+        expected += (n_pairs(self.n) + 7) // 8
+        if self._file.tell() != expected:
+            self._file.close()
+            os.remove(self._tmp_path)
+            raise ValueError(f"Incomplete network written to {self.path}")
+
+        self._file.seek(0)
+        self._file.write(self._prefix())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self._tmp_path)
+
+
+class SparseNetworkWriter:
+    """Write a symmetric binary network row by row into a CSR .npz file."""
+
+    def __init__(self, path, genes):
+        self.path = path
+        self.genes = [str(gene) for gene in genes]
+        self.n = len(self.genes)
+        self.row = 0
+        self._counts = []
+        self._indices = []
+
+    def write_rows(self, rows):
+        """Append a block of consecutive adjacency matrix rows (nonzero means edge)."""
+        rows = np.asarray(rows)
+        if rows.ndim != 2 or rows.shape[1] != self.n:
+            raise ValueError(f"Expected rows of length {self.n}, got shape {rows.shape}")
+        if self.row + rows.shape[0] > self.n:
+            raise ValueError(f"Too many rows written to {self.path}")
+
+        block_rows, cols = np.nonzero(rows)
+        upper = cols > block_rows + self.row
+        self._counts.append(np.bincount(block_rows[upper], minlength=rows.shape[0]))
+        self._indices.append(cols[upper].astype(np.int32))
+        self.row += rows.shape[0]
+
+    def close(self):
+        """Write the file, moving it into place once complete."""
+        if self.row != self.n:
+            raise ValueError(f"Incomplete network written to {self.path}")
+        indptr = np.zeros(self.n + 1, dtype=np.int64)
+        if self._counts:
+            np.cumsum(np.concatenate(self._counts), out=indptr[1:])
+        indices = np.concatenate(self._indices) if self._indices else np.zeros(0, dtype=np.int32)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, indptr=indptr, indices=indices, genes=np.array(self.genes, dtype=str))
+        os.replace(tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+class PackedNetwork:
+    """Memory-mapped view of a packed .bnet network."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, flags, n, n_edges, header_length = PREFIX.unpack(f.read(PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a packed network file")
+            if version > VERSION:
+                raise ValueError(f"{path} uses unsupported format version {version}")
+            header = json.loads(f.read(header_length).decode('utf-8'))
+
+        self.genes = header['genes']
+        self.n = n
+        self.n_edges = n_edges
+        self.symmetric = bool(flags & FLAG_SYMMETRIC)
+
+        data_offset = PREFIX.size + header_length
+        data_offset += -data_offset % ALIGNMENT
+        self.bits = np.memmap(path, dtype=np.uint8, mode='r', offset=data_offset,
+                              shape=((n_pairs(n) + 7) // 8,))
+
+    def upper_triangle(self, dtype=np.uint8):
+        """Upper triangle entries in the order of np.triu_indices(n, k=1)."""
+        return np.unpackbits(self.bits, count=n_pairs(self.n)).astype(dtype, copy=False)
+
+    def edge_positions(self, chunk_bytes=1 << 22):
+        """Upper triangle positions of all edges."""
+        positions = []
+        for start in range(0, self.bits.size, chunk_bytes):
+            chunk = np.unpackbits(self.bits[start:start + chunk_bytes])
+            positions.append(np.flatnonzero(chunk) + start * 8)
+        return np.concatenate(positions) if positions else np.zeros(0, dtype=np.int64)
+
+    def edges(self):
+        """Edge list as (row, column) gene index arrays with row < column."""
+        return pairs_to_rows_cols(self.edge_positions(), self.n)
+
+    def degree(self):
+        """Degree of every gene."""
+        rows, cols = self.edges()
+        return np.bincount(rows, minlength=self.n) + np.bincount(cols, minlength=self.n)
+
+    def to_dense(self, dtype=np.uint8):
+        """Full symmetric adjacency matrix."""
+        matrix = np.zeros((self.n, self.n), dtype=dtype)
+        rows, cols = self.edges()
+        matrix[rows, cols] = 1
+        matrix[cols, rows] = 1
+        return matrix
+
+    def to_dataframe(self, dtype=np.uint8):
+        """Adjacency matrix labelled with gene names, like the CSV networks."""
+        return pd.DataFrame(self.to_dense(dtype), index=self.genes, columns=self.genes)
+
+
+class SparseNetwork:
+    """CSR .npz network exposed through the same interface as PackedNetwork, in memory proportional to its edges."""
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as data:
+            self.indptr = data['indptr']
+            self.indices = data['indices']
+            self.genes = data['genes'].tolist()
+        self.n = len(self.genes)
+        self.n_edges = len(self.indices)
+        self.symmetric = True
+
+    def edges(self):
+        """Edge list as (row, column) gene index arrays with row < column."""
+        rows = np.repeat(np.arange(self.n, dtype=np.int64), np.diff(self.indptr))
+        return rows, self.indices.astype(np.int64)
+
+    def edge_positions(self):
+        """Upper triangle positions of all edges."""
+        rows, cols = self.edges()
+        return row_offsets(self.n)[rows] + cols - rows - 1
+
+    def upper_triangle(self, dtype=np.uint8):
+        """Upper triangle entries in the order of np.triu_indices(n, k=1)."""
+        triangle = np.zeros(n_pairs(self.n), dtype=dtype)
+        triangle[self.edge_positions()] = 1
+        return triangle
+
+    def degree(self):
+        """Degree of every gene."""
+        return np.diff(self.indptr) + np.bincount(self.indices, minlength=self.n)
+
+    def to_dense(self, dtype=np.uint8):
+        """Full symmetric adjacency matrix."""
+        matrix = np.zeros((self.n, self.n), dtype=dtype)
+        rows, cols = self.edges()
+        matrix[rows, cols] = 1
+        matrix[cols, rows] = 1
+        return matrix
+
+    def to_dataframe(self, dtype=np.uint8):
+        """Adjacency matrix labelled with gene names, like the CSV networks."""
+        return pd.DataFrame(self.to_dense(dtype), index=self.genes, columns=self.genes)
+
+
+class DenseNetwork:
+    """CSV adjacency matrix exposed through the same interface as PackedNetwork."""
+
+    def __init__(self, path):
+        self.path = path
+        df = pd.read_csv(path, header=0, index_col=False)
+        self.genes = list(df.columns)
+        self.n = len(self.genes)
+        self.matrix = df.to_numpy()
+        self.symmetric = bool(np.array_equal(self.matrix, self.matrix.T))
+        self.n_edges = int(np.count_nonzero(np.triu(self.matrix != 0, k=1)))
+
+    def upper_triangle(self, dtype=np.uint8):
+        return self.matrix[np.triu_indices(self.n, k=1)].astype(dtype, copy=False)
+
+    def edges(self):
+        return np.nonzero(np.triu(self.matrix != 0, k=1))
+
+    def degree(self):
+        return np.count_nonzero(self.matrix, axis=1)
+
+    def to_dense(self, dtype=np.uint8):
+        return self.matrix.astype(dtype, copy=False)
+
+    def to_dataframe(self, dtype=np.uint8):
+        return pd.DataFrame(self.to_dense(dtype), index=self.genes, columns=self.genes)
+
+
+def save_packed_network(network, output_path, genes=None):
+    """Save a symmetric binary adjacency matrix (DataFrame or array) as a packed network."""
+    if genes is None:
+        genes = network.columns
+    matrix = network.to_numpy() if isinstance(network, pd.DataFrame) else np.asarray(network)
+
+    if not np.array_equal(matrix != 0, (matrix != 0).T):
+        raise ValueError(f"Only symmetric networks can be packed: {output_path}")
+
+    with PackedNetworkWriter(output_path, genes) as writer:
+        for start in range(0, matrix.shape[0], 1024):
+            writer.write_rows(matrix[start:start + 1024])
+
+
+def save_sparse_network(network, output_path, genes=None):
+    """Save a symmetric binary adjacency matrix (DataFrame or array) as a CSR .npz network."""
+    if genes is None:
+        genes = network.columns
+    matrix = network.to_numpy() if isinstance(network, pd.DataFrame) else np.asarray(network)
+
+    if not np.array_equal(matrix != 0, (matrix != 0).T):
+        raise ValueError(f"Only symmetric networks can be saved as sparse networks: {output_path}")
+
+    with SparseNetworkWriter(output_path, genes) as writer:
+        for start in range(0, matrix.shape[0], 1024):
+            writer.write_rows(matrix[start:start + 1024])
+
+
+def open_network(path):
+    """Open a binary network from a sparse .npz file, a packed .bnet file or a CSV adjacency matrix."""
+    if path.endswith(SPARSE_EXTENSION):
+        return SparseNetwork(path)
+    if path.endswith(PACKED_EXTENSION):
+        return PackedNetwork(path)
+    return DenseNetwork(path)
+
+
+def network_genes(path):
+    """Gene names of a network from its header (packed), gene array (sparse) or CSV header, without reading the edges."""
+    if path.endswith(SPARSE_EXTENSION):
+        with np.load(path) as data:
+            return data['genes'].tolist()
+    if path.endswith(PACKED_EXTENSION):
+        return PackedNetwork(path).genes
+    return list(pd.read_csv(path, header=0, index_col=False, nrows=0).columns)
+
+
+def gene_vocabulary(paths):
+    """Genes shared by all networks, sorted, as {gene: integer ID}. Only the headers are read."""
+    common = None
+    for path in paths:
+        genes = set(network_genes(path))
+        common = genes if common is None else common & genes
+    return {gene: i for i, gene in enumerate(sorted(common or []))}
+
+
+def gene_permutation(genes, vocabulary):
+    """Position in genes of every gene of the vocabulary, in the order of their IDs."""
+    positions = {gene: i for i, gene in enumerate(genes)}
+    missing = [gene for gene in vocabulary if gene not in positions]
+    if missing:
+        raise KeyError(f"{len(missing)} genes of the vocabulary are missing, e.g. {missing[:5]}")
+    return np.array([positions[gene] for gene in vocabulary], dtype=np.int64)
+
+
+def aligned_upper_triangle(network, permutation, dtype=np.uint8):
+    """
+    Upper triangle of a network restricted to and reordered by permutation (positions in network.genes,
+    e.g. from gene_permutation), in the order of np.triu_indices(len(permutation), k=1).
+    """
+    m = len(permutation)
+    if m == network.n and np.array_equal(permutation, np.arange(m)):
+        return network.upper_triangle(dtype)
+
+    if isinstance(network, DenseNetwork):
+        # One take per row on the flat matrix
+        flat = network.matrix.ravel()
+        offsets = row_offsets(m)
+        triangle = np.empty(n_pairs(m), dtype=dtype)
+        for i in range(m - 1):
+            triangle[offsets[i]:offsets[i] + m - i - 1] = flat.take(permutation[i] * network.n + permutation[i + 1:])
+        return triangle
+
+    # Packed and sparse networks: move every edge to its position in the aligned triangle
+    inverse = np.full(network.n, -1, dtype=np.int64)
+    inverse[permutation] = np.arange(m)
+    rows, cols = network.edges()
+    rows, cols = inverse[rows], inverse[cols]
+    kept = (rows >= 0) & (cols >= 0)
+    low = np.minimum(rows[kept], cols[kept])
+    high = np.maximum(rows[kept], cols[kept])
+    triangle = np.zeros(n_pairs(m), dtype=dtype)
+    triangle[row_offsets(m)[low] + high - low - 1] = 1
+    return triangle
+
+
+def network_files(directory, suffix):
+    """
+    List the networks in a directory whose name ends with suffix + a network extension.
+    When a network exists in several formats, only the first in NETWORK_EXTENSIONS is returned.
+    """
+    found = {}
+    for file in sorted(os.listdir(directory)):
+        for rank, extension in enumerate(NETWORK_EXTENSIONS):
+            if file.endswith(suffix + extension):
+                stem = file[:-len(extension)]
+                if stem not in found or rank < found[stem][0]:
+                    found[stem] = (rank, os.path.join(directory, file))
+    return [found[stem][1] for stem in sorted(found)]
+
+
+def network_stem(path):
+    """File name of a network without its extension."""
+    file = os.path.basename(path)
+    for extension in NETWORK_EXTENSIONS:
+        if file.endswith(extension):
+            return file[:-len(extension)]
+    return file
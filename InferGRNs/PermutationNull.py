@@ -0,0 +1,182 @@
+import os
+import glob
+import zlib
+import argparse
+import numpy as np
+from ThresholdCalibration import QuantileSketch, save_thresholds
+from ExpressionStore import expression_files, read_expression_columns
+from NetworkInference import rank_standardize, spearman_to_mim, standardized_mim, infer_networks
+
+# Null distributions of network edge weights for every patient, replacing the single-patient loop of
+# PermutationThreshold.R. Each patient's expression is ranked once; permuting the ranks of every gene
+# is the same as ranking permuted data, so a permutation costs one shuffle and blocked matrix products.
+# Edge weights go straight into QuantileSketches instead of CSV files. ARACNE and MRNET need the whole
+# MIM of a permutation and are inferred with the NumPy backend of NetworkInference.py.
+
+NULL_METHODS = ['MIM', 'CLR', 'ARACNE', 'MRNET']
+BLOCK_METHODS = ['MIM', 'CLR']
+
+
+def mim_blocks(permuted, block_size):
+    """
+    Yield the MIM of a batch of permuted datasets block by block, for all blocks on or above the diagonal.
+
+    Args:
+        permuted (np.ndarray): Standardized ranks, permutations x cells x genes
+        block_size (int): Number of genes per block
+
+    Yields:
+        (slice, slice, np.ndarray): Gene rows, gene columns and the MIM block (permutations x rows x columns)
+    """
+    n = permuted.shape[2]
+    for i in range(0, n, block_size):
+        rows = slice(i, min(i + block_size, n))
+        left = np.ascontiguousarray(permuted[:, :, rows].transpose(0, 2, 1))
+        for j in range(i, n, block_size):
+            cols = slice(j, min(j + block_size, n))
+            mim = spearman_to_mim(np.matmul(left, permuted[:, :, cols]))
+            if i == j:
+                diagonal = np.arange(mim.shape[1])
+                mim[:, diagonal, diagonal] = 0
+            yield rows, cols, mim
+
+
+def upper_entries(block, rows, cols):
+    """Entries of a batch of blocks that lie in the strict upper triangle of the full matrix."""
+    if rows.start != cols.start:
+        return block.ravel()
+    upper = np.triu_indices(block.shape[1], k=1)
+    return block[:, upper[0], upper[1]].ravel()
+
+
+def mim_row_statistics(permuted, block_size):
+    """Mean and standard deviation of every MIM row (diagonal included), as used by minet's CLR."""
+    batch, _, n = permuted.shape
+    total = np.zeros((batch, n))
+    squares = np.zeros((batch, n))
+    for rows, cols, mim in mim_blocks(permuted, block_size):
+        total[:, rows] += mim.sum(axis=2)
+        squares[:, rows] += (mim.astype(np.float64) ** 2).sum(axis=2)
+        if rows.start != cols.start:
+            total[:, cols] += mim.sum(axis=1)
+            squares[:, cols] += (mim.astype(np.float64) ** 2).sum(axis=1)
+    mean = total / n
+    sd = np.sqrt(np.maximum(squares / n - mean ** 2, 0))
+    sd[sd == 0] = np.inf  # Rows without any spread get z-scores of zero
+    return mean, sd
+
+
+def upper_triangle_blocks(network, block_size):
+    """Yield the strict upper triangle of a square network, block_size rows at a time."""
+    n = network.shape[0]
+    for start in range(0, n, block_size):
+        rows = np.arange(start, min(start + block_size, n))
+        block = network[rows]
+        yield block[np.arange(n)[None, :] > rows[:, None]]
+
+
+def clr_block(mim, rows, cols, mean, sd):
+    """CLR scores of a batch of MIM blocks: sqrt(z_i^2 + z_j^2) with negative z-scores set to zero."""
+    z_rows = (mim - mean[:, rows, None]) / sd[:, rows, None]
+    z_cols = (mim - mean[:, None, cols]) / sd[:, None, cols]
+    z_rows = np.where(z_rows > 0, z_rows, 0)
+    z_cols = np.where(z_cols > 0, z_cols, 0)
+    return np.sqrt(z_rows ** 2 + z_cols ** 2)
+
+
+def null_sketches(standardized, n_permutations, rng, methods=BLOCK_METHODS, batch_size=4, block_size=2048,
+                  relative_accuracy=0.001, threads=None):
+    """
+    Sketch the null edge weight distribution of every method over n_permutations permutations.
+
+    Permutations are processed batch_size at a time and their networks block_size genes at a time,
+    so memory is bounded by the batch of permuted data plus one batch of blocks. ARACNE and MRNET
+    additionally hold the full MIM and network of one permutation at a time.
+    """
+    unknown = set(methods) - set(NULL_METHODS)
+    if unknown:
+        raise ValueError(f"Unknown null methods: {', '.join(sorted(unknown))}")
+
+    sketches = {method: QuantileSketch(relative_accuracy) for method in methods}
+    for start in range(0, n_permutations, batch_size):
+        batch = min(batch_size, n_permutations - start)
+        # Shuffle every gene independently, for every permutation in the batch
+        permuted = np.stack([rng.permuted(standardized, axis=0) for _ in range(batch)])
+
+        if 'CLR' in methods:
+            mean, sd = mim_row_statistics(permuted, block_size)
+
+        if set(methods) & set(BLOCK_METHODS):
+            for rows, cols, mim in mim_blocks(permuted, block_size):
+                if 'MIM' in methods:
+                    sketches['MIM'].update(upper_entries(mim, rows, cols))
+                if 'CLR' in methods:
+                    sketches['CLR'].update(upper_entries(clr_block(mim, rows, cols, mean, sd), rows, cols))
+
+        network_methods = [method for method in methods if method not in BLOCK_METHODS]
+        if network_methods:
+            for permutation in permuted:
+                mim = standardized_mim(permutation, block_size)
+                for method, network in infer_networks(mim, network_methods, threads).items():
+                    for weights in upper_triangle_blocks(network, block_size):
+                        sketches[method].update(weights)
+
+        print(f"Permutations {start + 1}-{start + batch} of {n_permutations} done")
+    return sketches
+
+
+def read_expression(file_path):
+    """Read an imputed expression matrix (cells x genes), stored as .npy or CSV."""
+    return read_expression_columns(file_path).fillna(0).to_numpy(dtype=np.float64)
+
+
+def patient_rng(seed, subject_name):
+    """Random generator of one patient, independent of the order patients are processed in."""
+    return np.random.default_rng([seed, zlib.crc32(subject_name.encode('utf-8'))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate permutation null distributions and thresholds for every patient.")
+    parser.add_argument("--input_dir", type=str, required=True, help="Directory containing the _imputed.npy or .csv files")
+    parser.add_argument("--output_dir", type=str, help="Output directory for thresholds (default: input_dir)")
+    parser.add_argument("--pattern", type=str, help="Expression files to process (default: all _imputed files, .npy first)")
+    parser.add_argument("--methods", type=str, nargs="+", default=BLOCK_METHODS, choices=NULL_METHODS,
+                        help="Null distributions to generate (ARACNE and MRNET are much slower than MIM and CLR)")
+    parser.add_argument("--n_permutations", type=int, default=50)
+    parser.add_argument("--batch_size", type=int, default=4, help="Permutations computed together")
+    parser.add_argument("--block_size", type=int, default=2048, help="Genes per block of the network")
+    parser.add_argument("--quantile", type=float, default=0.95, help="Percentile as a fraction")
+    parser.add_argument("--relative_accuracy", type=float, default=0.001, help="Relative error bound of the sketch")
+    parser.add_argument("--threads", type=int, help="Threads for ARACNE and MRNET (default: all CPUs)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    input_dir = os.path.expanduser(args.input_dir)
+    output_dir = os.path.expanduser(args.output_dir or args.input_dir)
+    files = sorted(glob.glob(os.path.join(input_dir, args.pattern))) if args.pattern else expression_files(input_dir)
+
+    cohort = {method: QuantileSketch(args.relative_accuracy) for method in args.methods}
+    for file in files:
+        subject_name = os.path.splitext(os.path.basename(file))[0]
+        print(f"Processing file: {file}")
+
+        standardized = rank_standardize(read_expression(file))
+        sketches = null_sketches(standardized, args.n_permutations, patient_rng(args.seed, subject_name),
+                                 args.methods, args.batch_size, args.block_size, args.relative_accuracy, args.threads)
+
+        thresholds = {method: sketch.quantile(args.quantile) for method, sketch in sketches.items()}
+        save_thresholds(thresholds, os.path.join(output_dir, f"{subject_name}_null_thresholds.csv"))
+        print(f"Thresholds for {subject_name}: {thresholds}")
+
+        for method, sketch in sketches.items():
+            cohort[method].merge(sketch)
+
+    # Thresholds over all patients in the directory (i.e. per cell type)
+    if files:
+        thresholds = {method: sketch.quantile(args.quantile) for method, sketch in cohort.items()}
+        save_thresholds(thresholds, os.path.join(output_dir, "null_thresholds.csv"))
+        print(f"Thresholds for all patients: {thresholds}")
+
+
+if __name__ == "__main__":
+    main()
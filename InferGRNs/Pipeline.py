@@ -0,0 +1,385 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+import subprocess
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from NetworkCache import file_digest
+from SymmetricGENIE import process_file
+from BinaryNetwork import binarize_file
+from ConsensusNetwork import save_consensus
+from ThresholdCalibration import load_thresholds
+from NetworkInference import INFERENCE_METHODS, infer_patient
+
+# Incremental runner for the whole pipeline: imputation/MIM -> ARACNE/CLR/MRNET (+ GENIE_SYM) -> binary ->
+# consensus -> statistics/UMAP/top genes. Every stage declares its input and output files and its
+# parameters. A stage is skipped when the content hashes of its inputs, its parameters and its action are
+# unchanged since it last succeeded, so changing one threshold only rebuilds the binaries of that method
+# and whatever depends on them. Stages whose dependencies are done run concurrently.
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPOSITORY, 'NetworkAnalysis'))
+sys.path.append(os.path.join(REPOSITORY, 'EnrichmentAnalysis'))
+DEFAULT_STATE = '~/pipeline_state.json'
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Args:
+        name (str): Unique stage name
+        action (callable or list): Function called as action(**params), or a command line to run
+        inputs (list): Files the stage reads
+        outputs (list): Files the stage writes
+        params (dict): Parameters passed to the action, part of the stage signature
+        clean_outputs (bool): Delete the outputs before running (for scripts that skip existing outputs)
+    """
+
+    def __init__(self, name, action, inputs=(), outputs=(), params=None, clean_outputs=False):
+        self.name = name
+        self.action = action
+        self.inputs = [os.path.expanduser(path) for path in inputs]
+        self.outputs = [os.path.expanduser(path) for path in outputs]
+        self.params = params or {}
+        self.clean_outputs = clean_outputs
+
+    def describe_action(self):
+        """Stable description of what the stage runs, for its signature."""
+        action = self.action
+        if isinstance(action, list):
+            return json.dumps(action)
+        if isinstance(action, partial):
+            return f"{action.func.__module__}.{action.func.__qualname__}{action.args!r}{sorted(action.keywords.items())!r}"
+        return f"{action.__module__}.{action.__qualname__}"
+
+    def run(self):
+        if isinstance(self.action, list):
+            subprocess.run(self.action, check=True)
+        else:
+            self.action(**self.params)
+
+
+class Pipeline:
+    """DAG of stages, with dependencies derived from which stage writes which file."""
+
+    def __init__(self, state_path=None):
+        self.state_path = os.path.expanduser(state_path or DEFAULT_STATE)
+        self.stages = {}
+        self.lock = threading.Lock()
+        try:
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+        self.state.setdefault('stages', {})
+        self.state.setdefault('files', {})
+
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage {stage.name}")
+        self.stages[stage.name] = stage
+        return stage
+
+    def dependencies(self):
+        """Stages each stage depends on, checked for cycles."""
+        producers = {}
+        for stage in self.stages.values():
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(f"{output} is written by both {producers[output]} and {stage.name}")
+                producers[output] = stage.name
+        dependencies = {name: {producers[path] for path in stage.inputs if path in producers} - {name}
+                        for name, stage in self.stages.items()}
+
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle in pipeline at stage {name}")
+            visiting.add(name)
+            for dependency in dependencies[name]:
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+        return dependencies
+
+    def file_hash(self, path):
+        """Content hash of a file, reusing the previous hash while size and mtime are unchanged."""
+        stat = os.stat(path)
+        with self.lock:
+            known = self.state['files'].get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        digest = file_digest(path)
+        with self.lock:
+            self.state['files'][path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def signature(self, stage):
+        missing = [path for path in stage.inputs if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"{stage.name} is missing inputs: {', '.join(missing)}")
+        content = {
+            'action': stage.describe_action(),
+            'params': stage.params,
+            'inputs': {path: self.file_hash(path) for path in sorted(stage.inputs)},
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def is_up_to_date(self, stage, signature):
+        with self.lock:
+            previous = self.state['stages'].get(stage.name)
+        return previous == signature and all(os.path.exists(path) for path in stage.outputs)
+
+    def save_state(self):
+        with self.lock:
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.state_path)
+
+    def execute(self, stage, force=False):
+        """Run a stage unless it is up to date. Returns 'ran' or 'skipped'."""
+        signature = self.signature(stage)
+        if not force and self.is_up_to_date(stage, signature):
+            return 'skipped'
+
+        if stage.clean_outputs:
+            for path in stage.outputs:
+                if os.path.exists(path):
+                    os.remove(path)
+        for path in stage.outputs:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        print(f"Running {stage.name}")
+        stage.run()
+        missing = [path for path in stage.outputs if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"{stage.name} did not write: {', '.join(missing)}")
+
+        with self.lock:
+            self.state['stages'][stage.name] = signature
+        self.save_state()
+        return 'ran'
+
+    def plan(self):
+        """Stages that would run, without running anything. Stages after one that runs also run."""
+        dependencies = self.dependencies()
+        will_run = set()
+        for name in self.order(dependencies):
+            stage = self.stages[name]
+            if dependencies[name] & will_run or any(not os.path.exists(path) for path in stage.inputs) or \
+                    not self.is_up_to_date(stage, self.signature(stage)):
+                will_run.add(name)
+        return will_run
+
+    def order(self, dependencies):
+        ordered, done = [], set()
+        while len(ordered) < len(dependencies):
+            ready = sorted(name for name in dependencies if name not in done and dependencies[name] <= done)
+            ordered.extend(ready)
+            done.update(ready)
+        return ordered
+
+    def run(self, max_workers=4, force=False):
+        """Run all stages, independent ones concurrently. Returns {stage: status}."""
+        dependencies = self.dependencies()
+        pending = set(self.stages)
+        status = {}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                for name in sorted(pending):
+                    if any(status.get(dependency) in ('failed', 'blocked') for dependency in dependencies[name]):
+                        status[name] = 'blocked'
+                        pending.discard(name)
+                    elif all(status.get(dependency) in ('ran', 'skipped') for dependency in dependencies[name]):
+                        running[executor.submit(self.execute, self.stages[name], force)] = name
+                        pending.discard(name)
+
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        status[name] = future.result()
+                    except Exception as e:
+                        status[name] = 'failed'
+                        print(f"{name} failed: {e}")
+                    print(f"{name}: {status[name]}")
+
+        self.save_state()
+        return status
+
+
+def run_script(script, *args):
+    """Run a Python script of the repository in its own directory."""
+    script = os.path.join(REPOSITORY, script)
+    subprocess.run([sys.executable, script, *args], cwd=os.path.dirname(script), check=True)
+
+
+def run_rscript(script, *args):
+    """Run an R script of the repository in its own directory."""
+    script = os.path.join(REPOSITORY, script)
+    subprocess.run(['Rscript', os.path.basename(script), *args], cwd=os.path.dirname(script), check=True)
+
+
+# The analysis scripts are imported when their stage runs, so that igraph and umap are only needed then
+def network_statistics(directory, output_file):
+    from BinaryStats_V2 import process_directory_igraph
+    process_directory_igraph(directory, output_file)
+
+
+def umap_networks(directories, output_plot_path, umap_coords_path):
+    from UMAP_Vector import cluster_networks
+    cluster_networks(*directories, output_plot_path, umap_coords_path)
+
+
+def top_genes_patients(cell_dirs, output_dir):
+    from TopGenesPatients import process_networks
+    process_networks(cell_dirs, output_dir)
+
+
+def build_pipeline(thresholds, state_path=None, data_dir='~/Data', binary_dir='~/BinaryFinal',
+                   cell_types=('Dendritic', 'Monocyte', 'Progenitor'), inference_backend='R'):
+    """
+    Pipeline of all stages for every patient found in the {cell type}_Datasets directories.
+
+    The inference runs either with NetworkImputation&Inference.R, one stage per cell type, or with the
+    NumPy backend of NetworkInference.py, one stage per patient writing .npy networks.
+
+    GENIE3 (call_GENIE.sh) is run separately; its formatted {patient}_GENIE.csv networks are taken as inputs.
+    """
+    pipeline = Pipeline(state_path)
+    data_dir = os.path.expanduser(data_dir)
+    binary_dir = os.path.expanduser(binary_dir)
+    methods = ['ARACNE', 'CLR', 'MRNET', 'GENIE_SYM']
+    all_consensus = {}
+
+    for cell_type in cell_types:
+        dataset_dir = os.path.join(data_dir, f"{cell_type}_Datasets")
+        network_dir = os.path.join(data_dir, f"Final_{cell_type}_Net")
+        cell_binary_dir = os.path.join(binary_dir, cell_type)
+        datasets = sorted(file for file in os.listdir(dataset_dir)
+                          if file.startswith('10000_Genes_') and file.endswith('.csv')) if os.path.isdir(dataset_dir) else []
+        patients = [file[len('10000_Genes_'):-len('.csv')] for file in datasets]
+
+        # Imputation, MIM and ARACNE/CLR/MRNET inference
+        weighted = {}
+        if inference_backend == 'numpy':
+            for patient, dataset in zip(patients, datasets):
+                prefix = os.path.join(network_dir, f"10000_Genes_{patient}")
+                weighted[patient] = {method: f"{prefix}_{method}.npy" for method in INFERENCE_METHODS}
+                # The imputed CSV is the input of GENIE3_Inference.R and PermutationThreshold.R
+                pipeline.add(Stage(f"inference:{cell_type}:{patient}", infer_patient,
+                                   inputs=[os.path.join(dataset_dir, dataset)],
+                                   outputs=[f"{prefix}_imputed.npy", f"{prefix}_imputed.csv"] + list(weighted[patient].values()),
+                                   params={'file_path': os.path.join(dataset_dir, dataset), 'output_dir': network_dir,
+                                           'write_csv': True}))
+        else:
+            outputs = []
+            for patient in patients:
+                prefix = os.path.join(network_dir, f"10000_Genes_{patient}")
+                weighted[patient] = {method: f"{prefix}_{method}.csv" for method in INFERENCE_METHODS}
+                outputs += [f"{prefix}_imputed.csv", f"{prefix}_matrix.csv"] + list(weighted[patient].values())
+            pipeline.add(Stage(f"inference:{cell_type}",
+                               partial(run_rscript, os.path.join('InferGRNs', 'NetworkImputation&Inference.R'),
+                                       '--input', dataset_dir, '--output', network_dir),
+                               inputs=[os.path.join(dataset_dir, file) for file in datasets], outputs=outputs))
+
+        consensus_files = []
+        for patient in patients:
+            genie = os.path.join(network_dir, f"{patient}_GENIE.csv")
+            weighted[patient]['GENIE_SYM'] = os.path.join(network_dir, f"{patient}_GENIE_SYM.csv")
+            pipeline.add(Stage(f"genie_sym:{cell_type}:{patient}", process_file, inputs=[genie],
+                               outputs=[weighted[patient]['GENIE_SYM']],
+                               params={'file': genie, 'output_file': weighted[patient]['GENIE_SYM']}))
+
+            binaries = []
+            for method in methods:
+                binary = os.path.join(cell_binary_dir, f"{patient}_{method}_binary.bnet")
+                binaries.append(binary)
+                pipeline.add(Stage(f"binary:{cell_type}:{patient}:{method}", binarize_file,
+                                   inputs=[weighted[patient][method]], outputs=[binary],
+                                   params={'input_file': weighted[patient][method], 'output_file': binary,
+                                           'threshold': thresholds[method]}))
+
+            consensus_file = os.path.join(cell_binary_dir, f"{patient}_consensus_network.bnet")
+            sparse_file = os.path.join(cell_binary_dir, f"{patient}_consensus_network.npz")
+            consensus_files += [consensus_file, sparse_file]
+            pipeline.add(Stage(f"consensus:{cell_type}:{patient}", save_consensus, inputs=binaries,
+                               outputs=[consensus_file, sparse_file],
+                               params={'network_files': binaries, 'output_file': consensus_file,
+                                       'sparse_file': sparse_file}))
+
+        statistics_file = os.path.join(cell_binary_dir, f"{cell_type}_Statistics_Consensus.csv")
+        pipeline.add(Stage(f"statistics:{cell_type}", network_statistics, inputs=consensus_files,
+                           outputs=[statistics_file],
+                           params={'directory': cell_binary_dir, 'output_file': statistics_file}))
+        all_consensus[cell_type] = consensus_files
+
+    every_consensus = [path for files in all_consensus.values() for path in files]
+    cell_dirs = [os.path.join(binary_dir, cell_type) for cell_type in cell_types]
+    umap_dir = os.path.join(REPOSITORY, 'NetworkAnalysis')
+    pipeline.add(Stage("umap", umap_networks, inputs=every_consensus,
+                       outputs=[os.path.join(umap_dir, 'umap_results.png'), os.path.join(umap_dir, 'umap_coordinates.csv')],
+                       params={'directories': [os.path.join(binary_dir, cell_type) for cell_type in ('Dendritic', 'Progenitor', 'Monocyte')],
+                               'output_plot_path': os.path.join(umap_dir, 'umap_results.png'),
+                               'umap_coords_path': os.path.join(umap_dir, 'umap_coordinates.csv')},
+                       clean_outputs=True))
+    pipeline.add(Stage("top_genes", partial(run_script, os.path.join('SingleCell', 'TopGenes.py'),
+                                            '--binary_dir', binary_dir, '--cell_types', *cell_types),
+                       inputs=every_consensus,
+                       outputs=[os.path.expanduser(f"~/SingleCellData/Top_1000_Genes_{cell_type}.txt")
+                                for cell_type in cell_types]))
+    pipeline.add(Stage("top_genes_patients", top_genes_patients, inputs=every_consensus,
+                       outputs=[os.path.expanduser('~/EnrichmentData/top_connected_genes.csv')],
+                       params={'cell_dirs': cell_dirs, 'output_dir': '~/EnrichmentData'}))
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline, skipping stages whose inputs and parameters are unchanged.")
+    parser.add_argument("--thresholds", type=str, help="Thresholds file from ThresholdCalibration.py")
+    parser.add_argument("--state", type=str, help=f"Pipeline state file (default: {DEFAULT_STATE})")
+    parser.add_argument("--workers", type=int, default=4, help="Number of stages run concurrently")
+    parser.add_argument("--inference_backend", type=str, choices=["R", "numpy"], default="R",
+                        help="Infer ARACNE/CLR/MRNET with NetworkImputation&Inference.R or NetworkInference.py")
+    parser.add_argument("--force", action="store_true", help="Run all stages, even when up to date")
+    parser.add_argument("--dry_run", action="store_true", help="Only list the stages that would run")
+    args = parser.parse_args()
+
+    thresholds = {
+        'ARACNE': 0,
+        'CLR': 2.84166785553267,
+        'MRNET': 0.00306545740959235,
+        'GENIE_SYM': 0.000288810502691997
+    }
+    if args.thresholds:
+        thresholds.update(load_thresholds(os.path.expanduser(args.thresholds)))
+
+    pipeline = build_pipeline(thresholds, args.state, inference_backend=args.inference_backend)
+    if args.dry_run:
+        will_run = pipeline.plan()
+        for name in pipeline.order(pipeline.dependencies()):
+            print(f"{'run ' if name in will_run else 'skip'} {name}")
+        return
+
+    status = pipeline.run(args.workers, args.force)
+    for outcome in ('ran', 'skipped', 'failed', 'blocked'):
+        print(f"{outcome}: {sum(value == outcome for value in status.values())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,109 @@
 import os
 import numpy as np
 import pandas as pd
-import glob
-from multiprocessing import Pool, cpu_count
+import argparse
+from functools import partial
+from NetworkCache import load_weighted_network, write_meta
+from NetworkCatalog import NetworkCatalog
+from MemoryScheduler import MemoryScheduler, matrix_bytes, network_memory
 
-def process_file(file):
-    # Read the CSV file
-    network = pd.read_csv(file, header=0, index_col=False)
-    network.index = network.columns
-
-    # Convert to numpy array
-    network_array = network.to_numpy()
+def process_file(file, output_file=None):
+    # Read the network through its memory-mapped float32 cache
+    network_array, genes = load_weighted_network(file)
 
     # Make symmetric
     symmetric_network = (network_array + network_array.T) / 2
 
     # Convert back to DataFrame
-    symmetric_df = pd.DataFrame(symmetric_network, index=network.index, columns=network.columns)
+    symmetric_df = pd.DataFrame(symmetric_network, index=genes, columns=genes)
 
     # Create output filename
-    output_file = file.replace("_GENIE.csv", "_GENIE_SYM.csv")
+    output_file = output_file or file.replace("_GENIE.csv", "_GENIE_SYM.csv")
 
     # Save to CSV
     symmetric_df.to_csv(output_file, index=False)
 
-    return f"Processed {file} -> {output_file}"
+    return output_file
+
+def symmetrize_blocked(network_array, output_file, tile_size=1024):
+    """
+    Write (A + A.T) / 2 of a memory-mapped matrix to a float32 .npy file, one tile pair at a time.
+
+    Tile (i, j) and its mirror (j, i) are read together and both output tiles are written from
+    their mean, so only a few tiles are held in memory regardless of the size of the network.
+    """
+    n = network_array.shape[0]
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    symmetric = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.float32, shape=(n, n))
+
+    for i in range(0, n, tile_size):
+        rows = slice(i, min(i + tile_size, n))
+        for j in range(i, n, tile_size):
+            cols = slice(j, min(j + tile_size, n))
+            tile = (np.asarray(network_array[rows, cols], dtype=np.float32) +
+                    np.asarray(network_array[cols, rows], dtype=np.float32).T) / 2
+            symmetric[rows, cols] = tile
+            symmetric[cols, rows] = tile.T
+        symmetric.flush()
+
+    del symmetric
+    os.replace(tmp_file, output_file)
+
+def process_file_blocked(file, tile_size=1024):
+    # Memory-map the network through its float32 cache
+    network_array, genes = load_weighted_network(file)
+
+    # Make symmetric tile by tile, straight into a float32 .npy file
+    output_file = file.replace("_GENIE.csv", "_GENIE_SYM.npy")
+    symmetrize_blocked(network_array, output_file, tile_size)
+    write_meta(output_file[:-len('.npy')] + '.json', {'genes': genes})
+
+    return output_file
 
 def main():
+    parser = argparse.ArgumentParser(description="Make GENIE networks symmetrical.")
+    parser.add_argument("--blocked", action="store_true",
+                        help="Symmetrize out of core, tile by tile, into float32 _GENIE_SYM.npy files")
+    parser.add_argument("--tile_size", type=int, default=1024, help="Tile size used with --blocked")
+    parser.add_argument("--workers", type=int, default=8, help="Maximum number of files processed concurrently")
+    parser.add_argument("--memory_budget", type=float, help="Memory in GB for all workers (default: 80%% of the available memory)")
+    args = parser.parse_args()
+
     # Define the directories
-    directories = [
-        os.path.expanduser("~/Data/Final_Dendritic_Net"),
-        os.path.expanduser("~/Data/Final_Monocyte_Net"),
-        os.path.expanduser("~/Data/Final_Progenitor_Net")
-    ]
+    directories = {
+        "Dendritic": os.path.expanduser("~/Data/Final_Dendritic_Net"),
+        "Monocyte": os.path.expanduser("~/Data/Final_Monocyte_Net"),
+        "Progenitor": os.path.expanduser("~/Data/Final_Progenitor_Net")
+    }
 
-    # Collect all input files
+    # Look the GENIE networks of every cell type up in the catalog. GENIE3_Inference.R does not
+    # record its outputs, so its directories are brought up to date first (unchanged files are not hashed again)
+    catalog = NetworkCatalog()
     all_input_files = []
-    for directory in directories:
-        input_files = glob.glob(os.path.join(directory, "*_GENIE.csv"))
-        all_input_files.extend(input_files)
+    for cell_type, directory in directories.items():
+        catalog.scan(directory)
+        records = catalog.find(stage='weighted', method='GENIE', cell_type=cell_type, directory=directory,
+                               file_format='csv')
+        all_input_files.extend(record['path'] for record in records)
 
-    # Determine the number of cores to use (max 8)
-    num_cores = min(8, cpu_count())
+    # Admit files under a memory budget: the in-memory version holds about three float32 copies of a
+    # network, the blocked version a few tiles per file
+    if args.blocked:
+        worker = partial(process_file_blocked, tile_size=args.tile_size)
+        estimates = [matrix_bytes((args.tile_size, args.tile_size), np.float32, 3)] * len(all_input_files)
+    else:
+        worker = process_file
+        estimates = [network_memory(file, np.float32, 3) for file in all_input_files]
 
-    # Create a pool of workers
-    with Pool(num_cores) as pool:
-        # Map the process_file function to all input files
-        results = pool.map(process_file, all_input_files)
+    # Record every symmetric network in the catalog as soon as it is written
+    def record(file, output_file):
+        catalog.register(output_file)
+        print(f"Processed {file} -> {output_file}")
 
-    # Print results
-    for result in results:
-        print(result)
+    scheduler = MemoryScheduler(args.workers, args.memory_budget and int(args.memory_budget * 1e9))
+    scheduler.map(worker, all_input_files, estimates, callback=record)
+    print(scheduler.report())
+    catalog.close()
 
     print("All files processed successfully.")
 
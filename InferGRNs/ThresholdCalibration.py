@@ -0,0 +1,284 @@
+import os
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+
+# Calibrate edge weight thresholds from the null networks of PermutationThreshold.R (or PermutationNull.py).
+# Edge weights are streamed file by file into a QuantileSketch, so memory does not grow with the number
+# of permutations. The sketch estimates any percentile with a bounded relative error; with --exact a
+# second pass narrows the sketch's bracket down to the exact value of R's quantile().
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with a relative error guarantee (logarithmic buckets, as in DDSketch).
+
+    Every nonzero value is counted in the bucket (gamma^(k-1), gamma^k] of its magnitude, with
+    gamma = (1 + a) / (1 - a). Any quantile is returned within a relative error a of the true value,
+    and the number of buckets only depends on the range of the values, never on how many there are.
+    """
+
+    min_key = -20000
+    max_key = 20000
+
+    def __init__(self, relative_accuracy=0.001):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self.count = 0
+        self.zeros = 0
+        self.min = np.inf
+        self.max = -np.inf
+        # Bucket counts of positive values and of the magnitude of negative values, first key at offset
+        self._stores = {1: [np.zeros(0, dtype=np.int64), 0], -1: [np.zeros(0, dtype=np.int64), 0]}
+
+    def _keys(self, magnitudes):
+        keys = np.ceil(np.log(magnitudes) / self._log_gamma)
+        return np.clip(keys, self.min_key, self.max_key).astype(np.int64)
+
+    def _add(self, sign, keys, counts=None):
+        if keys.size == 0:
+            return
+        store = self._stores[sign]
+        low = min(int(keys.min()), store[1] if store[0].size else int(keys.min()))
+        high = max(int(keys.max()), store[1] + store[0].size - 1)
+        if low != store[1] or high - low + 1 != store[0].size:
+            grown = np.zeros(high - low + 1, dtype=np.int64)
+            grown[store[1] - low:store[1] - low + store[0].size] = store[0]
+            store[0], store[1] = grown, low
+        store[0] += np.bincount(keys - low, weights=counts, minlength=store[0].size).astype(np.int64)
+
+    def update(self, values):
+        """Add an array of values (NaNs are ignored)."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        self.count += values.size
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.zeros += int(np.count_nonzero(values == 0))
+        self._add(1, self._keys(values[values > 0]))
+        self._add(-1, self._keys(-values[values < 0]))
+
+    def merge(self, other):
+        """Add all values counted by another sketch with the same relative accuracy."""
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same relative accuracy can be merged")
+        self.count += other.count
+        self.zeros += other.zeros
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for sign, (counts, offset) in other._stores.items():
+            keys = np.flatnonzero(counts)
+            self._add(sign, keys + offset, counts[keys])
+
+    def _buckets(self):
+        """Counts, lower and upper bounds of all nonempty buckets in ascending order of value."""
+        counts, lower, upper = [], [], []
+        for sign in (-1, 1):
+            store, offset = self._stores[sign]
+            keys = np.flatnonzero(store) + offset
+            # The outermost buckets also hold the clipped magnitudes
+            low = np.where(keys == self.min_key, 0, self.gamma ** (keys - 1.0))
+            high = np.where(keys == self.max_key, np.inf, self.gamma ** keys.astype(np.float64))
+            if sign < 0:
+                counts.append(store[keys - offset][::-1])
+                lower.append(-high[::-1])
+                upper.append(-low[::-1])
+                counts.append(np.array([self.zeros]))
+                lower.append(np.zeros(1))
+                upper.append(np.zeros(1))
+            else:
+                counts.append(store[keys - offset])
+                lower.append(low)
+                upper.append(high)
+
+        counts, lower, upper = np.concatenate(counts), np.concatenate(lower), np.concatenate(upper)
+        keep = counts > 0
+        lower, upper = np.maximum(lower[keep], self.min), np.minimum(upper[keep], self.max)
+        return counts[keep], lower, upper
+
+    def bracket(self, rank):
+        """Interval that contains the value of the given rank (0-based) in the sorted data."""
+        if not 0 <= rank < self.count:
+            raise ValueError(f"Rank {rank} outside of the {self.count} counted values")
+        counts, lower, upper = self._buckets()
+        bucket = np.searchsorted(np.cumsum(counts), rank, side='right')
+        return lower[bucket], upper[bucket]
+
+    def quantile(self, q):
+        """Estimate the q-th quantile (0 <= q <= 1) within the relative accuracy of the sketch."""
+        if self.count == 0:
+            raise ValueError("No values added to the sketch")
+        lower, upper = self.bracket(int(round(q * (self.count - 1))))
+        if lower == upper:
+            return float(lower)
+        # Harmonic mean of the bounds, which is within the relative accuracy of every value in the bucket
+        return float(2 * lower * upper / (lower + upper))
+
+
+def read_edge_weights(path, chunk_size=10_000_000):
+    """Yield the edge weights of a null distribution file (CSV with an edge_weights column, or .npy) in chunks."""
+    if path.endswith('.npy'):
+        weights = np.load(path, mmap_mode='r').ravel()
+        for start in range(0, weights.size, chunk_size):
+            yield np.asarray(weights[start:start + chunk_size], dtype=np.float64)
+    else:
+        for chunk in pd.read_csv(path, usecols=['edge_weights'], chunksize=chunk_size):
+            yield chunk['edge_weights'].to_numpy(dtype=np.float64)
+
+
+def sketch_files(files, relative_accuracy=0.001):
+    """Stream all edge weights of the given files into one QuantileSketch."""
+    sketch = QuantileSketch(relative_accuracy)
+    for file in files:
+        for weights in read_edge_weights(file):
+            sketch.update(weights)
+    return sketch
+
+
+def order_statistics(files, ranks, lower, upper, max_values=20_000_000, bins=4096):
+    """
+    Exact values of the given ranks (0-based) in the sorted edge weights of all files, knowing they
+    lie within [lower, upper]. Every pass over the files either collects the few values inside the
+    interval and selects the answer, or narrows the interval with a histogram.
+    """
+    while True:
+        below = 0
+        inside = []
+        n_inside = 0
+        histogram = np.zeros(bins, dtype=np.int64)
+        inside_min, inside_max = np.inf, -np.inf
+        for file in files:
+            for weights in read_edge_weights(file):
+                weights = weights[~np.isnan(weights)]
+                below += int(np.count_nonzero(weights < lower))
+                selected = weights[(weights >= lower) & (weights <= upper)]
+                if selected.size == 0:
+                    continue
+                n_inside += selected.size
+                inside_min = min(inside_min, selected.min())
+                inside_max = max(inside_max, selected.max())
+                if upper > lower:
+                    histogram += np.histogram(selected, bins=bins, range=(lower, upper))[0]
+                if inside is not None:
+                    # Too many values to select from directly, narrow the interval with the histogram instead
+                    inside = inside + [selected] if n_inside <= max_values else None
+
+        local = [rank - below for rank in ranks]
+        if any(rank < 0 or rank >= n_inside for rank in local):
+            raise ValueError("Interval does not contain the requested ranks")
+        if inside is not None:
+            values = np.sort(np.concatenate(inside))
+            return [float(values[rank]) for rank in local]
+        if inside_min == inside_max:
+            return [float(inside_min) for _ in ranks]
+
+        cumulative = np.cumsum(histogram)
+        edges = np.linspace(lower, upper, bins + 1)
+        first = np.searchsorted(cumulative, min(local), side='right')
+        last = np.searchsorted(cumulative, max(local), side='right')
+        narrowed = max(edges[first], inside_min), min(edges[last + 1], inside_max)
+        if narrowed == (lower, upper):
+            # Ranks far apart keep all values between them inside, so collect them whatever their number
+            max_values = np.inf
+        lower, upper = narrowed
+
+
+def calibrate_threshold(files, quantile=0.95, exact=False, relative_accuracy=0.001):
+    """
+    Percentile of the edge weights of all null distribution files.
+
+    Args:
+        files (list): Null distribution files of one technique, one per permutation
+        quantile (float): Percentile as a fraction, 0.95 for the 95th percentile
+        exact (bool): Refine the sketch estimate to the exact value of R's quantile() (type 7)
+        relative_accuracy (float): Relative error bound of the sketch
+
+    Returns:
+        (float, int): Threshold and the number of edge weights it was computed from
+    """
+    sketch = sketch_files(files, relative_accuracy)
+    if sketch.count == 0:
+        raise ValueError("No edge weights found")
+    if not exact:
+        return sketch.quantile(quantile), sketch.count
+
+    # R's default quantile interpolates between the two order statistics around (n - 1) * q
+    position = (sketch.count - 1) * quantile
+    ranks = [int(np.floor(position)), min(int(np.floor(position)) + 1, sketch.count - 1)]
+    lower = min(sketch.bracket(rank)[0] for rank in ranks)
+    upper = max(sketch.bracket(rank)[1] for rank in ranks)
+    low_value, high_value = order_statistics(files, ranks, lower, upper)
+    return low_value + (position - ranks[0]) * (high_value - low_value), sketch.count
+
+
+def save_thresholds(thresholds, output_file):
+    """Save thresholds in the Technique,Threshold layout of CalculateThresholds.R."""
+    pd.DataFrame({'Technique': list(thresholds), 'Threshold': list(thresholds.values())}).to_csv(
+        output_file, index=False)
+
+
+def load_thresholds(thresholds_file):
+    """Read a thresholds file (Technique or Method column, and a Threshold column) into a dict."""
+    thresholds = pd.read_csv(thresholds_file)
+    name_column = 'Technique' if 'Technique' in thresholds.columns else 'Method'
+    return dict(zip(thresholds[name_column], thresholds['Threshold'].astype(float)))
+
+
+# Null files written by PermutationThreshold.R, {subject}_{method}_perm_{i}.csv. GENIE_SYM is calibrated
+# on its GENIE3 files; CalculateThresholds.R instead reads copies symmetrized outside this repository,
+# {subject}_GENIE3_perm_{i}_SYM.csv, which are used with GENIE_SYM={subject}_GENIE3_perm_*_SYM.csv
+DEFAULT_TECHNIQUES = ["ARACNE", "CLR", "MRNET", "GENIE_SYM={subject}_GENIE3_perm_*.csv"]
+
+
+def null_files(input_dir, subject, technique):
+    """
+    Null distribution files of a technique given as NAME ({subject}_NAME_perm_*.csv) or NAME=GLOB, as
+    (name, pattern, files). The _SYM.csv copies of the same permutations are left out unless the
+    pattern asks for them, so no permutation is counted twice.
+    """
+    name, _, pattern = technique.partition('=')
+    pattern = (pattern or f"{{subject}}_{name}_perm_*.csv").replace('{subject}', subject)
+    files = sorted(glob.glob(os.path.join(input_dir, pattern)))
+    if '_SYM' not in pattern:
+        files = [file for file in files if not file.endswith('_SYM.csv')]
+    return name, pattern, files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculate edge weight thresholds from permutation null distributions.")
+    parser.add_argument("--input_dir", type=str, required=True, help="Directory containing the null distribution files")
+    parser.add_argument("--subject", type=str, default="AML556_imputed", help="Subject name used in the file names")
+    parser.add_argument("--techniques", type=str, nargs="+", default=DEFAULT_TECHNIQUES,
+                        help="Techniques as NAME (files {subject}_NAME_perm_*.csv) or NAME=GLOB, where {subject} is replaced by --subject")
+    parser.add_argument("--quantile", type=float, default=0.95, help="Percentile as a fraction")
+    parser.add_argument("--exact", action="store_true", help="Compute the exact percentile with a second pass")
+    parser.add_argument("--relative_accuracy", type=float, default=0.001, help="Relative error bound of the sketch")
+    parser.add_argument("--output", type=str, default="technique_thresholds.csv", help="Output thresholds file")
+    args = parser.parse_args()
+
+    input_dir = os.path.expanduser(args.input_dir)
+    technique_files = {}
+    for technique in args.techniques:
+        name, pattern, technique_files[name] = null_files(input_dir, args.subject, technique)
+        # A technique without null files would silently get no threshold
+        if not technique_files[name]:
+            raise FileNotFoundError(f"No null distribution files found for {name} ({os.path.join(input_dir, pattern)})")
+
+    thresholds = {}
+    for name, files in technique_files.items():
+        print(f"Processing {name} ({len(files)} permutations)")
+        thresholds[name], n_weights = calibrate_threshold(files, args.quantile, args.exact, args.relative_accuracy)
+        print(f"Threshold for {name}: {thresholds[name]} ({n_weights} edge weights)")
+
+    save_thresholds(thresholds, os.path.join(input_dir, args.output))
+    print(f"Thresholds saved to {os.path.join(input_dir, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
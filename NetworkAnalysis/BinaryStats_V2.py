@@ -1,8 +1,19 @@
 import os
+import sys
+import json
+import time
+import signal
+import argparse
+from functools import partial
 import pandas as pd
 import igraph as ig
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from NetworkStore import network_files, open_network
+from MemoryScheduler import MemoryScheduler, network_memory
+from NetworkCatalog import network_hash
+from StatisticsCache import StatisticsCache
 
 # Directories and output files
 directories = ['~/BinaryFinal/Dendritic', '~/BinaryFinal/Monocyte', '~/BinaryFinal/Progenitor']
@@ -10,139 +21,469 @@ directories = ['~/BinaryFinal/Dendritic', '~/BinaryFinal/Monocyte', '~/BinaryFin
 output_files = ['Dendritic_Statistics_Consensus.csv', 'Monocyte_Statistics_Consensus.csv', 'Progenitor_Statistics_Consensus.csv']
 
 # Target file keywords
-#valid_keywords = ['binary.csv', 'consensus_network.csv']
-valid_keywords = ['consensus_network.csv']
+#valid_keywords = ['binary', 'consensus_network']
+valid_keywords = ['consensus_network']
 
 
-def read_network_igraph(csv):
-    """Load adjacency matrix and convert to igraph object."""
-    df = pd.read_csv(csv, header=0, index_col=False)
-    df.index = df.columns  # Ensure index and columns are aligned with the gene names
+def read_network_igraph(path):
+    """
+    Load a network (sparse, packed or CSV) as an igraph object, built from its edge array.
+    Packed and sparse networks store whether they are symmetric, so no dense matrix is needed.
+    """
+    network = open_network(path)
 
-    # Check if the network is symmetric
-    is_symmetric = np.allclose(df.values, df.values.T)
+    if network.symmetric:
+        # One undirected edge per upper triangle entry
+        rows, cols = network.edges()
+        edges = np.column_stack([rows, cols])
+    else:
+        # Only CSV networks can be asymmetric: every nonzero entry is a directed edge
+        edges = np.argwhere(network.to_dense() != 0)
+
+    g = ig.Graph(n=network.n, edges=edges.tolist(), directed=not network.symmetric)
+    g.vs["name"] = network.genes  # Assign vertex names (gene names)
+    return g, network.symmetric
+
+
+def graph_memory(path):
+    """Memory needed to load a network and its graph: proportional to the edges, except for CSV networks."""
+    if path.endswith('.csv'):
+        return network_memory(path, np.int64, 2)
+    network = open_network(path)
+    # Edge list as Python lists plus igraph's own edge and incidence arrays
+    return network.n_edges * 200 + network.n * 1000
+
+
+def sample_path_length(g, n_sources=256, time_budget=None, seed=7, batch_size=32):
+    """
+    Estimate the average path length (over all connected pairs, like g.average_path_length()) from
+    BFS runs of a random sample of source vertices.
+
+    Returns:
+        (float, float, float, int): Estimate, 95% confidence interval bounds and number of sources used
+    """
+    n = g.vcount()
+    sources = np.random.default_rng(seed).permutation(n)[:min(n_sources, n)]
+    deadline = time.time() + time_budget if time_budget else None
+
+    path_sums, path_counts = [], []
+    for start in range(0, len(sources), batch_size):
+        distances = np.array(g.distances(source=sources[start:start + batch_size].tolist()), dtype=float)
+        reachable = np.isfinite(distances) & (distances > 0)
+        path_sums.append(np.where(reachable, distances, 0).sum(axis=1))
+        path_counts.append(reachable.sum(axis=1))
+        if deadline and time.time() > deadline:
+            break
+
+    path_sums, path_counts = np.concatenate(path_sums), np.concatenate(path_counts)
+    used = len(path_sums)
+    if path_counts.sum() == 0:
+        return None, None, None, used
+
+    # Ratio estimator of sum(distances) / number of connected pairs, with a delta method standard error
+    # and finite population correction (exact when every vertex was a source)
+    estimate = float(path_sums.sum() / path_counts.sum())
+    if used < 2:
+        return estimate, None, None, used
+    residuals = path_sums - estimate * path_counts
+    variance = (1 - used / n) * residuals.var(ddof=1) / (used * path_counts.mean() ** 2)
+    margin = float(1.96 * np.sqrt(variance))
+    return estimate, estimate - margin, estimate + margin, used
+
+
+def sample_efficiency(g, n_sources=None, time_budget=None, seed=7, batch_size=32):
+    """
+    Global efficiency, the mean of 1/d over all ordered pairs of distinct vertices (0 for unreachable pairs),
+    from BFS runs of batches of sources: all vertices when n_sources is None, else a random sample of them.
+
+    Returns:
+        (float, float, float, int): Efficiency, 95% confidence interval bounds (None when exact) and number of sources used
+    """
+    n = g.vcount()
+    if n < 2:
+        return 0.0, None, None, n
+    sources = np.random.default_rng(seed).permutation(n)[:min(n_sources or n, n)]
+    deadline = time.time() + time_budget if n_sources and time_budget else None
+
+    source_efficiencies = []
+    for start in range(0, len(sources), batch_size):
+        distances = np.array(g.distances(source=sources[start:start + batch_size].tolist()), dtype=float)
+        with np.errstate(divide='ignore'):
+            inverse = np.where(distances > 0, 1 / distances, 0)
+        source_efficiencies.append(inverse.sum(axis=1) / (n - 1))
+        if deadline and time.time() > deadline:
+            break
+
+    source_efficiencies = np.concatenate(source_efficiencies)
+    used = len(source_efficiencies)
+    efficiency = float(source_efficiencies.mean())
+    if used == n or used < 2:
+        return efficiency, None, None, used
+    # Mean of the sampled sources, with finite population correction
+    margin = float(1.96 * np.sqrt((1 - used / n) * source_efficiencies.var(ddof=1) / used))
+    return efficiency, efficiency - margin, efficiency + margin, used
+
+
+def diameter_bounds(g, time_budget=None, batch_size=64):
+    """
+    Lower and upper bound of the diameter of a connected undirected graph (equal when exact).
+
+    A double sweep from the highest degree vertex gives a lower bound; the iFUB algorithm then
+    computes the eccentricities of the vertices farthest from the middle of that path, level by
+    level, until the bounds meet or the time budget is spent.
+    """
+    if g.vcount() < 2:
+        return 0, 0
+    deadline = time.time() + time_budget if time_budget else None
+
+    start = int(np.argmax(g.degree()))
+    a = int(np.argmax(g.distances(source=start)[0]))
+    distances_a = g.distances(source=a)[0]
+    b = int(np.argmax(distances_a))
+    lower = int(distances_a[b])
+
+    path = g.get_shortest_paths(a, to=b)[0]
+    middle = path[len(path) // 2]
+    levels = np.array(g.distances(source=middle)[0], dtype=int)
+    eccentricity = int(levels.max())
+    lower = max(lower, eccentricity)
+    upper = 2 * eccentricity
+
+    for level in range(eccentricity, 0, -1):
+        fringe = np.flatnonzero(levels == level)
+        for batch in range(0, len(fringe), batch_size):
+            lower = max(lower, int(max(g.eccentricity(vertices=fringe[batch:batch + batch_size].tolist()))))
+            if deadline and time.time() > deadline:
+                # Vertices up to this level are at most 2 * level apart, all others were checked
+                return lower, min(upper, max(lower, 2 * level))
+        # All vertices above level - 1 are done: any longer path runs between the remaining vertices
+        upper = min(upper, max(lower, 2 * (level - 1)))
+        if lower >= upper:
+            break
+    return lower, upper
+
+
+# Registry of the statistics: name -> function(g, is_symmetric, options) returning a dict of columns,
+# whether it is computed by default and the options its result depends on (part of its cache key).
+# Statistics are listed in the column order of the output files.
+STATISTICS = {}
+APPROXIMATION_OPTIONS = ('approximate', 'n_sources', 'time_budget', 'seed')
+
+
+class StatisticTimeout(Exception):
+    """Raised when a statistic runs out of its time budget."""
+
+
+def statistic(name, default=True, options=()):
+    """Register a statistic function under a name."""
+    def register(function):
+        STATISTICS[name] = {'function': function, 'default': default, 'options': options}
+        return function
+    return register
+
+
+def default_statistics():
+    """Names of the statistics computed when none are selected."""
+    return [name for name, entry in STATISTICS.items() if entry['default']]
+
+
+@statistic('size')
+def size_statistics(g, is_symmetric, options):
+    return {"Nodes": g.vcount(), "Edges": g.ecount(),
+            "Network Type": "Symmetric" if is_symmetric else "Asymmetric"}
+
+
+@statistic('components')
+def component_statistics(g, is_symmetric, options):
+    if not is_symmetric:
+        return {"Weakly Connected Components": len(g.clusters(mode="weak")),
+                "Strongly Connected Components": len(g.clusters(mode="strong"))}
+    return {"Components": len(g.clusters())}
 
-    # Create graph: Nonzero entries represent edges
-    g = ig.Graph.Adjacency(
-        df.values.tolist(),
-        mode=ig.ADJ_UNDIRECTED if is_symmetric else ig.ADJ_DIRECTED
-    )
-    g.vs["name"] = df.columns  # Assign vertex names (gene names)
-    return g, is_symmetric
 
+@statistic('diameter', options=APPROXIMATION_OPTIONS)
+def diameter_statistics(g, is_symmetric, options):
+    # Diameter of the largest connected component, bounded with iFUB in approximate mode
+    largest_cc = g.clusters(mode="weak" if not is_symmetric else "strong").giant()
+    if options.get('approximate') and is_symmetric:
+        lower, upper = diameter_bounds(largest_cc, options.get('time_budget'))
+        return {"Diameter": lower, "Diameter Upper Bound": upper}
+    return {"Diameter": largest_cc.diameter()}
 
-def compute_statistics_igraph(g, is_symmetric):
-    """Compute network statistics using igraph."""
-    stats = {}
 
-    # Basic graph metrics
-    stats["Nodes"] = g.vcount()
-    stats["Edges"] = g.ecount()
+@statistic('density')
+def density_statistics(g, is_symmetric, options):
+    return {"Density": g.density()}
 
-    # Components
-    if not is_symmetric:
-        stats["Weakly Connected Components"] = len(g.clusters(mode="weak"))
-        stats["Strongly Connected Components"] = len(g.clusters(mode="strong"))
-    else:
-        stats["Components"] = len(g.clusters())
 
-    # Largest connected component and diameter
-    largest_cc = g.clusters(mode="weak" if not is_symmetric else "strong").giant()
-    stats["Diameter"] = largest_cc.diameter()
+@statistic('transitivity')
+def transitivity_statistics(g, is_symmetric, options):
+    return {"Transitivity": g.transitivity_undirected() if is_symmetric else g.transitivity_avglocal_undirected()}
+
 
-    # Density and transitivity
-    stats["Density"] = g.density()
-    stats["Transitivity"] = g.transitivity_undirected() if is_symmetric else g.transitivity_avglocal_undirected()
+@statistic('reciprocity')
+def reciprocity_statistics(g, is_symmetric, options):
+    # Only for asymmetric graphs
+    return {"Reciprocity": g.reciprocity() if not is_symmetric else None}
 
-    # Reciprocity (only for asymmetric graphs)
-    stats["Reciprocity"] = g.reciprocity() if not is_symmetric else None
 
-    # Degree statistics
+@statistic('degree')
+def degree_statistics(g, is_symmetric, options):
     degrees = g.degree()
     max_degree_idx = np.argmax(degrees)
     max_degree_gene = g.vs[max_degree_idx]["name"] if len(degrees) > 0 else None
-    stats.update({
+    return {
         "Mean Degree": np.mean(degrees),
         "Min Degree": np.min(degrees),
         "Max Degree": np.max(degrees),
         "SD Degree": np.std(degrees),
         "Gene with Highest Degree": max_degree_gene,
-    })
+    }
 
-    # Clustering coefficient
+
+@statistic('clustering')
+def clustering_statistics(g, is_symmetric, options):
     clustering_coeffs = g.transitivity_local_undirected(mode="zero")
-    stats.update({
+    return {
         "Mean Clustering Coefficient": np.mean(clustering_coeffs),
         "Variance Clustering Coefficient": np.var(clustering_coeffs),
-    })
+    }
+
+
+@statistic('path_length', options=APPROXIMATION_OPTIONS)
+def path_length_statistics(g, is_symmetric, options):
+    if options.get('approximate') and is_symmetric:
+        estimate, low, high, used = sample_path_length(g, options.get('n_sources', 256), options.get('time_budget'),
+                                                       options.get('seed', 7))
+        return {
+            "Average Path Length": estimate,
+            "Average Path Length CI Low": low,
+            "Average Path Length CI High": high,
+            "Path Length Sources": used,
+        }
+    return {"Average Path Length": g.average_path_length()}
+
 
-    # Additional global statistics
-    stats["Average Path Length"] = g.average_path_length()
-    #stats["Global Efficiency"] = g.global_efficiency()
-    stats["Assortativity Coefficient"] = g.assortativity_degree()
+@statistic('assortativity')
+def assortativity_statistics(g, is_symmetric, options):
+    return {"Assortativity Coefficient": g.assortativity_degree()}
 
+
+@statistic('girth')
+def girth_statistics(g, is_symmetric, options):
     try:
-        stats["Girth"] = g.girth()
+        return {"Girth": g.girth()}
     except:
-        stats["Girth"] = None  # In case the graph is acyclic
+        return {"Girth": None}  # In case the graph is acyclic
 
-    #stats["Clique Number"] = g.clique_number()
 
-    # Modularity (using fast_greedy community detection for undirected graphs)
-    #if is_symmetric:
-    #    community = g.community_fastgreedy()
-    #    stats["Modularity"] = community.modularity
-    #else:
-    #    stats["Modularity"] = None  # For directed graphs, more complex methods might be needed
+# Expensive statistics, only computed when selected
+@statistic('global_efficiency', default=False, options=APPROXIMATION_OPTIONS)
+def global_efficiency_statistics(g, is_symmetric, options):
+    # Mean inverse distance over all pairs, from sampled BFS sources in approximate mode
+    if options.get('approximate') and is_symmetric:
+        efficiency, low, high, used = sample_efficiency(g, options.get('n_sources', 256), options.get('time_budget'),
+                                                        options.get('seed', 7))
+        return {
+            "Global Efficiency": efficiency,
+            "Global Efficiency CI Low": low,
+            "Global Efficiency CI High": high,
+            "Global Efficiency Sources": used,
+        }
+    return {"Global Efficiency": sample_efficiency(g)[0]}
 
-    # Edge and Vertex Connectivity
-    #stats["Edge Connectivity"] = g.edge_connectivity()
-    #stats["Vertex Connectivity"] = g.vertex_connectivity()
 
-    # Number of Triangles
-    #stats["Total Triangles"] = sum(g.triangles())
+@statistic('clique_number', default=False)
+def clique_number_statistics(g, is_symmetric, options):
+    return {"Clique Number": g.clique_number()}
+
+
+@statistic('modularity', default=False)
+def modularity_statistics(g, is_symmetric, options):
+    # Modularity of fast_greedy communities, for undirected graphs only
+    if is_symmetric:
+        return {"Modularity": g.community_fastgreedy().as_clustering().modularity}
+    return {"Modularity": None}  # For directed graphs, more complex methods might be needed
 
-    return stats
 
+@statistic('connectivity', default=False)
+def connectivity_statistics(g, is_symmetric, options):
+    return {"Edge Connectivity": g.edge_connectivity(), "Vertex Connectivity": g.vertex_connectivity()}
 
-def process_file(file_path):
-    """Process a single network file and print its stats."""
-    g, is_symmetric = read_network_igraph(file_path)
-    stats = compute_statistics_igraph(g, is_symmetric)
+
+@statistic('triangles', default=False)
+def triangle_statistics(g, is_symmetric, options):
+    # Every triangle is listed once
+    return {"Total Triangles": len(g.list_triangles())}
+
+
+def statistic_key(name, options):
+    """
+    Cache key of the options a statistic depends on. The sampling options only change approximate
+    results, so exact results stay cached when they change.
+    """
+    names = STATISTICS[name]['options']
+    if not options.get('approximate'):
+        names = [option for option in names if option not in ('n_sources', 'time_budget', 'seed')]
+    return json.dumps({option: options.get(option) for option in names}, sort_keys=True)
+
+
+def run_statistic(name, g, is_symmetric, options, budget=None):
+    """
+    Compute one statistic, stopped after budget seconds. igraph checks for Python signals in its
+    long loops, so the timer interrupts it; the statistic is then reported as timed out.
+
+    Returns:
+        (dict, float, str): The columns (None on timeout), seconds spent and status ('done' or 'timeout')
+    """
+    def expire(signum, frame):
+        raise StatisticTimeout(name)
+
+    start = time.time()
+    previous = signal.signal(signal.SIGALRM, expire) if budget else None
+    try:
+        if budget:
+            signal.setitimer(signal.ITIMER_REAL, budget)
+        result = STATISTICS[name]['function'](g, is_symmetric, options)
+        status = 'done'
+    except StatisticTimeout:
+        result, status = None, 'timeout'
+    finally:
+        if budget:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    return result, time.time() - start, status
+
+
+def process_file(file_path, statistics=None, budgets=None, cache_path=None, **options):
+    """
+    Compute the statistics of a single network file and print them.
+
+    With approximate set, the average path length and global efficiency are estimated from n_sources
+    BFS sources (with a 95% confidence interval) and the diameter is bounded with iFUB; time_budget
+    limits each of them (in seconds). Approximations are only used for symmetric networks.
+
+    Every statistic is cached by the content hash of the network, so only statistics that are not
+    cached yet are computed, and the network is only loaded when there is one. budgets maps statistic
+    names to seconds; a statistic that timed out is retried only with a larger budget.
+    """
+    budgets = budgets or {}
+    cache = StatisticsCache(cache_path)
+    content_hash = network_hash(file_path)
+    g = is_symmetric = None
+
+    # The size statistics also record whether the network is symmetric, they are always included
+    stats = {}
+    for name in dict.fromkeys(['size'] + list(statistics or default_statistics())):
+        key = statistic_key(name, options)
+        budget = budgets.get(name)
+        record = cache.get(content_hash, name, key)
+        if record and record['status'] == 'timeout' and budget and budget > (record['budget'] or 0):
+            record = None
+        if record is None:
+            if g is None:
+                g, is_symmetric = read_network_igraph(file_path)
+            result, seconds, status = run_statistic(name, g, is_symmetric, options, budget)
+            cache.put(content_hash, name, key, result, seconds, status, budget)
+            record = {'result': result, 'status': status}
+            print(f"{os.path.basename(file_path)}: {name} {status} in {seconds:.1f}s")
+        if record['status'] == 'timeout':
+            print(f"{os.path.basename(file_path)}: {name} timed out, left empty")
+        stats.update(record['result'] or {})
+    cache.close()
+
+    network_type = stats.pop("Network Type")
+    approximate = options.get('approximate') and network_type == "Symmetric"
+    stats = {"Statistics Mode": "approximate" if approximate else "exact", **stats}
     stats["Filename"] = os.path.basename(file_path)
-    stats["Network Type"] = "Symmetric" if is_symmetric else "Asymmetric"
+    stats["Network Type"] = network_type
 
     # Print stats to follow progress
     print(f"Processed {stats['Filename']} with stats: {stats}")
     return stats
 
 
-def process_directory_igraph(directory, output_file):
-    """Process all valid networks in a directory in parallel and save statistics."""
-    expanded_directory = os.path.expanduser(directory)
-    valid_files = [
-        os.path.join(expanded_directory, file)
-        for file in os.listdir(expanded_directory)
-        if any(keyword in file for keyword in valid_keywords)
-    ]
+def selection_key(statistics=None, budgets=None, cache_path=None, **options):
+    """Key of the statistics, options and budgets a row of an output file was computed with."""
+    names = list(dict.fromkeys(['size'] + list(statistics or default_statistics())))
+    return json.dumps({'statistics': {name: json.loads(statistic_key(name, options)) for name in names},
+                       'budgets': budgets or {}}, sort_keys=True)
 
-    network_statistics = []
 
-    with ProcessPoolExecutor(max_workers=30) as executor:
-        results = list(executor.map(process_file, valid_files))
-        network_statistics.extend(results)
+def process_directory_igraph(directory, output_file, **options):
+    """
+    Process all valid networks in a directory in parallel and save statistics.
 
-    # Save results to CSV in the same directory as the consensus files
+    The row of every network is saved in the statistics cache as soon as it is done. Networks whose
+    row was saved for the same content and selection of statistics are skipped, so a run that was
+    interrupted continues where it stopped; the output file is assembled from the saved rows.
+    """
+    expanded_directory = os.path.expanduser(directory)
+    valid_files = [
+        file
+        for keyword in valid_keywords
+        for file in network_files(expanded_directory, keyword)
+    ]
     output_path = os.path.join(expanded_directory, output_file)
-    stats_df = pd.DataFrame(network_statistics)
-    stats_df.to_csv(output_path, index=False)
+
+    cache = StatisticsCache(options.get('cache_path'))
+    selection = selection_key(**options)
+    hashes = {file: network_hash(file) for file in valid_files}
+    rows = {file: cache.get_row(output_path, os.path.basename(file), hashes[file], selection) for file in valid_files}
+    remaining = [file for file in valid_files if rows[file] is None]
+    print(f"{directory}: {len(valid_files) - len(remaining)} networks already done, {len(remaining)} to process")
+
+    def save_row(file, stats):
+        rows[file] = stats
+        cache.put_row(output_path, os.path.basename(file), hashes[file], selection, stats)
+
+    if remaining:
+        scheduler = MemoryScheduler(max_workers=30)
+        scheduler.map(partial(process_file, **options), remaining, [graph_memory(file) for file in remaining],
+                      callback=save_row)
+        print(scheduler.report())
+
+    # Time spent per statistic, over every network in the cache
+    print(cache.timings().to_string(index=False))
+    cache.close()
+
+    # Save results to CSV in the same directory as the consensus files, replacing the old file at once
+    stats_df = pd.DataFrame([rows[file] for file in valid_files])
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    stats_df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
     print(f"Statistics saved to {output_path}")
 
 
 # Main function to sequentially process directories
 def main():
+    parser = argparse.ArgumentParser(description="Calculate descriptive statistics of consensus networks.")
+    parser.add_argument("--approximate", action="store_true",
+                        help="Estimate average path length and bound the diameter instead of computing them exactly")
+    parser.add_argument("--sources", type=int, default=256, help="BFS sources sampled for the average path length")
+    parser.add_argument("--time_budget", type=float, help="Seconds per approximate statistic and network")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--statistics", type=str, nargs="+", choices=list(STATISTICS),
+                        help=f"Statistics to compute (default: {' '.join(default_statistics())})")
+    parser.add_argument("--add", type=str, nargs="+", default=[], choices=list(STATISTICS),
+                        help="Statistics to compute on top of the selected ones, e.g. modularity")
+    parser.add_argument("--budget", type=str, nargs="+", default=[], metavar="STATISTIC=SECONDS",
+                        help="Time budget of a statistic per network; statistics out of time are left empty")
+    parser.add_argument("--cache", type=str, help="Statistics cache (default: $STATISTICS_CACHE or ~/network_statistics.sqlite)")
+    args = parser.parse_args()
+
+    budgets = {}
+    for budget in args.budget:
+        name, seconds = budget.split('=')
+        if name not in STATISTICS:
+            parser.error(f"Unknown statistic {name} in --budget")
+        budgets[name] = float(seconds)
+
+    statistics = list(dict.fromkeys((args.statistics or default_statistics()) + args.add))
+    options = {'approximate': args.approximate, 'n_sources': args.sources, 'time_budget': args.time_budget,
+               'seed': args.seed, 'statistics': statistics, 'budgets': budgets, 'cache_path': args.cache}
     for directory, output_file in zip(directories, output_files):
-        process_directory_igraph(directory, output_file)
+        process_directory_igraph(directory, output_file, **options)
 
 
 if __name__ == "__main__":
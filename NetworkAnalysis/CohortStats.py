@@ -0,0 +1,143 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from NetworkStore import network_files, open_network
+
+# Degree, triangle and clustering statistics of all consensus networks of a cell type at once. The
+# networks are loaded as edge arrays over a shared gene index and stacked as one block diagonal sparse
+# matrix, so a single sparse product gives the triangles of every gene of every patient
+# (diag(A^3) / 2 = rowsum((A @ A) * A) / 2). The columns are named like those of BinaryStats_V2.py.
+
+# Directories and output files
+directories = ['~/BinaryFinal/Dendritic', '~/BinaryFinal/Monocyte', '~/BinaryFinal/Progenitor']
+output_files = ['Dendritic_Cohort_Statistics.csv', 'Monocyte_Cohort_Statistics.csv', 'Progenitor_Cohort_Statistics.csv']
+
+# Target file keywords
+valid_keywords = ['consensus_network']
+
+
+def load_cohort(paths):
+    """
+    Load the edges of symmetric networks and index their genes in one shared gene index.
+
+    Returns:
+        (list, list): Gene index (names) and one dict per network with its genes' positions in the
+        index and its edges as (row, column) arrays of those positions
+    """
+    index = {}
+    networks = []
+    for path in paths:
+        network = open_network(path)
+        if not network.symmetric:
+            raise ValueError(f"Cohort statistics need symmetric networks: {path}")
+        positions = np.array([index.setdefault(gene, len(index)) for gene in network.genes], dtype=np.int64)
+        rows, cols = network.edges()
+        networks.append({'path': path, 'genes': network.genes, 'positions': positions,
+                         'rows': positions[rows], 'cols': positions[cols]})
+    return list(index), networks
+
+
+def cohort_matrix(networks, n_genes):
+    """Block diagonal adjacency matrix (CSR) of networks over a shared index of n_genes genes."""
+    offsets = np.arange(len(networks), dtype=np.int64) * n_genes
+    rows = np.concatenate([network['rows'] + offset for network, offset in zip(networks, offsets)])
+    cols = np.concatenate([network['cols'] + offset for network, offset in zip(networks, offsets)])
+    size = len(networks) * n_genes
+    upper = sp.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(size, size))
+    return upper + upper.T
+
+
+def assortativity(rows, cols, degrees):
+    """Degree assortativity (Pearson correlation of the degrees at both ends of every edge)."""
+    if len(rows) == 0:
+        return None
+    j = degrees[rows].astype(np.float64)
+    k = degrees[cols].astype(np.float64)
+    mean = np.mean((j + k) / 2)
+    numerator = np.mean(j * k) - mean ** 2
+    denominator = np.mean((j ** 2 + k ** 2) / 2) - mean ** 2
+    return numerator / denominator if denominator > 0 else None
+
+
+def cohort_statistics(paths, batch_size=16):
+    """
+    Statistics of many symmetric networks, computed batch_size networks at a time with sparse products.
+
+    Returns:
+        pd.DataFrame: One row per network (patients x statistics), in the order of paths
+    """
+    genes, networks = load_cohort(paths)
+    n_genes = len(genes)
+
+    rows = []
+    for start in range(0, len(networks), batch_size):
+        batch = networks[start:start + batch_size]
+        adjacency = cohort_matrix(batch, n_genes)
+
+        # Degree and triangles through every gene, one row of genes per network
+        degrees = np.asarray(adjacency.sum(axis=1)).reshape(len(batch), n_genes)
+        triangles = np.asarray((adjacency @ adjacency).multiply(adjacency).sum(axis=1)).reshape(len(batch), n_genes) // 2
+        triples = degrees * (degrees - 1) / 2
+
+        # Local clustering coefficient, zero for genes with less than two neighbours
+        clustering = np.divide(triangles, triples, out=np.zeros(triples.shape), where=triples > 0)
+
+        for network, index_degree, triangle, triple, coefficient in zip(batch, degrees, triangles, triples, clustering):
+            # Only the genes of this network, in its own order
+            degree = index_degree[network['positions']]
+            coefficient = coefficient[network['positions']]
+            n = len(network['genes'])
+            n_edges = len(network['rows'])
+            rows.append({
+                "Nodes": n,
+                "Edges": n_edges,
+                "Density": n_edges / (n * (n - 1) / 2) if n > 1 else None,
+                "Transitivity": triangle.sum() / triple.sum() if triple.sum() > 0 else None,
+                "Mean Degree": np.mean(degree),
+                "Min Degree": np.min(degree),
+                "Max Degree": np.max(degree),
+                "SD Degree": np.std(degree),
+                "Gene with Highest Degree": network['genes'][int(np.argmax(degree))],
+                "Mean Clustering Coefficient": np.mean(coefficient),
+                "Variance Clustering Coefficient": np.var(coefficient),
+                "Assortativity Coefficient": assortativity(network['rows'], network['cols'], index_degree),
+                "Total Triangles": int(triangle.sum()) // 3,
+                "Filename": os.path.basename(network['path']),
+                "Network Type": "Symmetric",
+            })
+    return pd.DataFrame(rows)
+
+
+def process_directory(directory, output_file, batch_size=16):
+    """Compute the cohort statistics of all valid networks in a directory and save them."""
+    expanded_directory = os.path.expanduser(directory)
+    valid_files = [
+        file
+        for keyword in valid_keywords
+        for file in network_files(expanded_directory, keyword)
+    ]
+
+    stats_df = cohort_statistics(valid_files, batch_size)
+
+    # Save results to CSV in the same directory as the consensus files
+    output_path = os.path.join(expanded_directory, output_file)
+    stats_df.to_csv(output_path, index=False)
+    print(f"Cohort statistics of {len(stats_df)} networks saved to {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculate degree, triangle and clustering statistics of all consensus networks of a cell type at once.")
+    parser.add_argument("--batch_size", type=int, default=16, help="Networks per sparse product")
+    args = parser.parse_args()
+
+    for directory, output_file in zip(directories, output_files):
+        process_directory(directory, output_file, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
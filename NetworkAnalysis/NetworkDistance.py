@@ -0,0 +1,181 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from FeatureStore import FeatureStore, BITS
+
+# Pairwise distances between binary networks, computed on the bit-packed upper triangles of a
+# FeatureStore. Every distance follows from the number of edges of both networks and the number of
+# edges they share, the popcount of the AND of their bits. The shared edges are counted for blocks of
+# networks and chunks of bytes in a thread pool (NumPy releases the GIL in its kernels).
+DISTANCE_METRICS = ['jaccard', 'hamming', 'overlap', 'euclidean']
+
+# Bits set in every byte value, for NumPy versions without np.bitwise_count
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def popcount(packed):
+    """Number of set bits of every byte."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(packed)
+    return POPCOUNT_TABLE[packed]
+
+
+def edge_counts(packed, rows, chunk_bytes=1 << 22):
+    """Number of edges of the given rows of a packed matrix."""
+    counts = np.zeros(len(rows), dtype=np.int64)
+    for start in range(0, packed.shape[1], chunk_bytes):
+        counts += popcount(np.asarray(packed[rows, start:start + chunk_bytes])).sum(axis=1, dtype=np.int64)
+    return counts
+
+
+def shared_edge_block(packed, rows, cols, chunk_bytes):
+    """Edges shared by every pair of networks of rows x cols."""
+    shared = np.zeros((len(rows), len(cols)), dtype=np.int64)
+    for start in range(0, packed.shape[1], chunk_bytes):
+        a = np.asarray(packed[rows, start:start + chunk_bytes])
+        b = np.asarray(packed[cols, start:start + chunk_bytes])
+        shared += popcount(a[:, None, :] & b[None, :, :]).sum(axis=2, dtype=np.int64)
+    return shared
+
+
+def shared_edges(packed, rows, block_size=16, chunk_bytes=1 << 16, threads=None, known=None):
+    """
+    Matrix of the edges shared by every pair of the given rows of a packed matrix. Pairs of blocks of
+    block_size networks run in parallel, each holding block_size^2 x chunk_bytes bytes at a time.
+    known is a matrix of counts from an earlier run (-1 where unknown): only the rows with unknown
+    counts are compared with all rows.
+    """
+    rows = np.asarray(rows)
+    n = len(rows)
+
+    def blocks(positions):
+        return [positions[start:start + block_size] for start in range(0, len(positions), block_size)]
+
+    if known is None:
+        shared = np.zeros((n, n), dtype=np.int64)
+        all_blocks = blocks(np.arange(n))
+        pairs = [(all_blocks[i], all_blocks[j]) for i in range(len(all_blocks)) for j in range(i, len(all_blocks))]
+    else:
+        shared = known.copy()
+        pairs = [(first, second) for first in blocks(np.flatnonzero((known < 0).any(axis=1)))
+                 for second in blocks(np.arange(n))]
+
+    def run(pair):
+        first, second = pair
+        block = shared_edge_block(packed, rows[first], rows[second], chunk_bytes)
+        shared[np.ix_(first, second)] = block
+        shared[np.ix_(second, first)] = block.T
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(run, pairs))
+    return shared
+
+
+def cached_shared_edges(packed, rows, keys, cache_path, **options):
+    """
+    shared_edges with the counts of earlier runs saved in cache_path (.npz) by row key, e.g. the content
+    hash of every network: only the pairs with a network that is new since then are counted.
+    """
+    keys = [str(key) for key in keys]
+    known = np.full((len(keys), len(keys)), -1, dtype=np.int64)
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            positions = {key: i for i, key in enumerate(data['keys'].tolist())}
+            found = np.array([i for i, key in enumerate(keys) if key in positions], dtype=np.int64)
+            cached = np.array([positions[keys[i]] for i in found], dtype=np.int64)
+            known[np.ix_(found, found)] = data['shared'][np.ix_(cached, cached)]
+        print(f"{len(found)} of {len(keys)} networks compared before, counting the shared edges of the others")
+
+    shared = shared_edges(packed, rows, known=known, **options)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, keys=np.array(keys, dtype=str), shared=shared)
+    os.replace(tmp_path, cache_path)
+    return shared
+
+
+def distance_matrix(shared, edges, n_features, metric):
+    """
+    Distances between networks from their shared edges and edge counts:
+    jaccard = 1 - |A & B| / |A | B|, hamming = |A ^ B| / n_features, overlap = 1 - |A & B| / min(|A|, |B|)
+    and euclidean = sqrt(|A ^ B|). Two empty networks are at distance 0.
+    """
+    both = edges[:, None] + edges[None, :]
+    if metric == 'jaccard':
+        union = both - shared
+        distances = 1 - np.divide(shared, union, out=np.ones(shared.shape), where=union > 0)
+    elif metric == 'hamming':
+        distances = (both - 2 * shared) / n_features
+    elif metric == 'overlap':
+        smaller = np.minimum(edges[:, None], edges[None, :])
+        distances = 1 - np.divide(shared, smaller, out=np.ones(shared.shape), where=smaller > 0)
+    elif metric == 'euclidean':
+        distances = np.sqrt(both - 2 * shared)
+    else:
+        raise ValueError(f"Unknown distance metric {metric}, expected one of {DISTANCE_METRICS}")
+    distances = distances.astype(np.float64)
+    np.fill_diagonal(distances, 0)
+    return distances
+
+
+def network_distances(store, rows=None, metrics=DISTANCE_METRICS, block_size=16, chunk_bytes=1 << 16, threads=None,
+                      keys=None, cache_path=None):
+    """
+    Distance matrices {metric: rows x rows matrix} between rows (all by default) of a bit-packed FeatureStore.
+    With keys (one per row, e.g. content hashes) and cache_path, shared edges counted before are reused.
+    """
+    if store.encoding != BITS:
+        raise ValueError(f"{store.path} does not hold binary networks, its encoding is {store.encoding}")
+    rows = np.arange(store.n_rows) if rows is None else np.asarray(rows)
+    packed = store.stored()
+    options = {'block_size': block_size, 'chunk_bytes': chunk_bytes, 'threads': threads}
+    if cache_path is not None:
+        shared = cached_shared_edges(packed, rows, keys, cache_path, **options)
+    else:
+        shared = shared_edges(packed, rows, **options)
+    edges = edge_counts(packed, rows)
+    return {metric: distance_matrix(shared, edges, store.n_features, metric) for metric in metrics}
+
+
+def current_rows(store):
+    """
+    Rows of a store and their labels: the last row of every cell type and patient, labelled {cell type}_{patient},
+    when the store has these columns (a network appended again replaces its earlier rows), all rows by number otherwise.
+    """
+    metadata = store.rows()
+    if {'Cell_Type', 'Network_ID'} <= set(metadata.columns):
+        rows = store.latest('Cell_Type', 'Network_ID')
+        return rows, (metadata['Cell_Type'] + '_' + metadata['Network_ID']).iloc[rows].tolist()
+    return np.arange(store.n_rows), [str(row) for row in range(store.n_rows)]
+
+
+def save_distances(distances, labels, output_prefix):
+    """Save every distance matrix as a labelled CSV file, {output_prefix}_{metric}.csv, e.g. for heatmaps."""
+    for metric, matrix in distances.items():
+        output_path = f"{output_prefix}_{metric}.csv"
+        pd.DataFrame(matrix, index=labels, columns=labels).to_csv(output_path)
+        print(f"{metric} distances saved to {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pairwise Jaccard, Hamming, overlap and Euclidean distances between the binary networks of a feature store.")
+    parser.add_argument("--store", type=str, required=True, help="FeatureStore directory, e.g. written by UMAP_Vector.py")
+    parser.add_argument("--output", type=str, default="network_distances", help="Prefix of the output CSV files")
+    parser.add_argument("--metrics", type=str, nargs="+", default=DISTANCE_METRICS, choices=DISTANCE_METRICS)
+    parser.add_argument("--block_size", type=int, default=16, help="Networks per block")
+    parser.add_argument("--threads", type=int, help="Threads (default: all CPUs)")
+    args = parser.parse_args()
+
+    store = FeatureStore(args.store)
+    rows, labels = current_rows(store)
+    distances = network_distances(store, rows, metrics=args.metrics, block_size=args.block_size, threads=args.threads)
+    save_distances(distances, labels, os.path.expanduser(args.output))
+
+
+if __name__ == "__main__":
+    main()
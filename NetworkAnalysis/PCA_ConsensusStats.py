@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import numpy as np
 import re
@@ -5,10 +6,33 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
 import matplotlib.pyplot as plt
 
+def read_statistics(cell_type):
+    """
+    Statistics of a cell type's consensus networks from BinaryStats_V2.py and/or CohortStats.py.
+    When both files exist, the statistics of CohortStats.py replace the same columns of BinaryStats_V2.py.
+    """
+    paths = [f'~/BinaryFinal/{cell_type}/{cell_type}_Statistics_Consensus.csv',
+             f'~/BinaryFinal/{cell_type}/{cell_type}_Cohort_Statistics.csv']
+    frames = [pd.read_csv(path) for path in paths if os.path.exists(os.path.expanduser(path))]
+    if not frames:
+        raise FileNotFoundError(f"No statistics found for {cell_type}: {paths}")
+    stats = frames[0]
+    for frame in frames[1:]:
+        shared = [column for column in frame.columns if column in stats.columns and column != 'Filename']
+        stats = stats.drop(columns=shared).merge(frame, on='Filename', how='outer', validate='one_to_one', indicator=True)
+        # Files made from other networks (e.g. CSV statistics next to a run on .npz networks) do not pair up
+        unmatched = stats.loc[stats['_merge'] != 'both', 'Filename'].tolist()
+        if unmatched:
+            raise ValueError(f"The statistics files of {cell_type} cover different networks, "
+                             f"{len(unmatched)} without a match: {unmatched}")
+        stats = stats.drop(columns='_merge')
+    return stats
+
+
 # Read the CSV files
-dendritic = pd.read_csv('~/BinaryFinal/Dendritic/Dendritic_Statistics_Consensus.csv')
-progenitor = pd.read_csv('~/BinaryFinal/Progenitor/Progenitor_Statistics_Consensus.csv')
-monocyte = pd.read_csv('~/BinaryFinal/Monocyte/Monocyte_Statistics_Consensus.csv')
+dendritic = read_statistics('Dendritic')
+progenitor = read_statistics('Progenitor')
+monocyte = read_statistics('Monocyte')
 
 # Combine the dataframes and add a 'Cell_Type' column
 dendritic['Cell_Type'] = 'Dendritic'
@@ -23,6 +47,8 @@ combined_df['Network_ID'] = combined_df['Filename'].apply(lambda x: re.search(r'
 numerical_features = ['Edges', 'Density', 'Transitivity', 'Mean Degree', 'Min Degree', 'Max Degree',
                       'SD Degree', 'Mean Clustering Coefficient', 'Variance Clustering Coefficient',
                       'Average Path Length', 'Assortativity Coefficient'] # 'Nodes', 'Diameter', 'Reciprocity', 'Girth'
+# Average Path Length is only in the statistics of BinaryStats_V2.py
+numerical_features = [feature for feature in numerical_features if feature in combined_df.columns]
 
 # Prepare the data for PCA
 X = combined_df[numerical_features]
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import sqlite3
+import pandas as pd
+
+# Cache of network statistics, one record per network content hash, statistic and the options the
+# statistic depends on. Statistics computed once are never recomputed for an unchanged network, so
+# enabling a new statistic only computes that one. Every record keeps how long the statistic took,
+# and statistics that ran out of their time budget are recorded as such. The finished rows of every
+# output file are saved as well, one per network as soon as it is done, so an interrupted run resumes
+# with the networks that are left and the output file is assembled from the saved rows.
+CACHE_VARIABLE = 'STATISTICS_CACHE'
+DEFAULT_CACHE = '~/network_statistics.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS statistics (
+    content_hash TEXT NOT NULL,
+    statistic TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    seconds REAL NOT NULL,
+    budget REAL,
+    recorded REAL NOT NULL,
+    PRIMARY KEY (content_hash, statistic, options)
+);
+CREATE TABLE IF NOT EXISTS results (
+    output_path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    selection TEXT NOT NULL,
+    result TEXT NOT NULL,
+    recorded REAL NOT NULL,
+    PRIMARY KEY (output_path, filename)
+);
+"""
+
+
+def to_json(values):
+    """JSON of a dict of statistics, with NumPy scalars converted to Python numbers."""
+    return json.dumps(values, default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+
+
+class StatisticsCache:
+    """SQLite cache of per-network statistics, shared by all worker processes."""
+
+    def __init__(self, cache_path=None):
+        self.cache_path = os.path.expanduser(cache_path or os.environ.get(CACHE_VARIABLE, DEFAULT_CACHE))
+        self.connection = sqlite3.connect(self.cache_path, timeout=60)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def get(self, content_hash, statistic, options):
+        """Cached record of a statistic as a dict (result decoded), or None."""
+        row = self.connection.execute(
+            'SELECT * FROM statistics WHERE content_hash = ? AND statistic = ? AND options = ?',
+            (content_hash, statistic, options)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record['result'] = json.loads(record['result']) if record['result'] else None
+        return record
+
+    def put(self, content_hash, statistic, options, result, seconds, status='done', budget=None):
+        """Record the result of a statistic (status 'done' or 'timeout')."""
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO statistics VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (content_hash, statistic, options, status, to_json(result) if result is not None else None,
+                 seconds, budget, time.time()))
+
+    def get_row(self, output_path, filename, content_hash, selection):
+        """Saved row of a network in an output file, or None when it is missing or was computed differently."""
+        row = self.connection.execute(
+            'SELECT result FROM results WHERE output_path = ? AND filename = ? AND content_hash = ? AND selection = ?',
+            (output_path, filename, content_hash, selection)).fetchone()
+        return json.loads(row['result']) if row else None
+
+    def put_row(self, output_path, filename, content_hash, selection, result):
+        """Save the row of a network in an output file, replacing an older one."""
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                                    (output_path, filename, content_hash, selection, to_json(result), time.time()))
+
+    def timings(self):
+        """Time spent per statistic over all cached networks."""
+        return pd.read_sql_query(
+            """SELECT statistic, COUNT(*) AS networks, SUM(status = 'timeout') AS timeouts,
+                      AVG(seconds) AS mean_seconds, MAX(seconds) AS max_seconds
+               FROM statistics GROUP BY statistic ORDER BY statistic""", self.connection)
+
+    def close(self):
+        self.connection.close()
+
@@ -1,93 +1,113 @@
 import os
 import re
+import sys
+import hashlib
 import numpy as np
 import pandas as pd
 from sklearn.metrics import silhouette_score
 import matplotlib.pyplot as plt
 import umap
-from multiprocessing import Pool
 from mpl_toolkits.mplot3d import Axes3D
 
-def load_and_process_network(file_path):
-    df = pd.read_csv(file_path, header=0, index_col=None)
-    df.index = df.columns
-    return df, set(df.columns)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from NetworkStore import (network_files, open_network, gene_vocabulary, gene_permutation, network_genes,
+                          aligned_upper_triangle, n_pairs)
+from MemoryScheduler import MemoryScheduler, network_memory, matrix_bytes
+from NetworkCatalog import network_hash
+from FeatureStore import FeatureStore
+from NetworkDistance import network_distances
 
-def get_common_genes(all_gene_sets):
-    return sorted(set.intersection(*all_gene_sets))  # Sorted for consistent ordering
-
-def extract_upper_triangle(matrix):
-    return matrix.values[np.triu_indices(matrix.shape[0], k=1)]
+# Metadata of every network in the feature store
+FEATURE_COLUMNS = ['Filename', 'Cell_Type', 'Network_ID', 'Content_Hash']
 
 def process_network(args):
-    file_path, cell_type, common_genes = args
-    network, _ = load_and_process_network(file_path)
-
-    present_genes = [g for g in common_genes if g in network.index]
-    if len(present_genes) != len(common_genes):
-        missing = set(common_genes) - set(present_genes)
-        raise ValueError(f"{file_path} is missing genes: {missing}")
-
-    network = network.loc[common_genes, common_genes]
-    upper_triangle = extract_upper_triangle(network)
-
-    if np.isnan(upper_triangle).any():
-        raise ValueError(f"NaNs found in upper triangle of {file_path}")
-
-    return upper_triangle, os.path.basename(file_path), cell_type
-
-def process_directory(directory, cell_type, common_genes):
-    file_paths = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('consensus_network.csv')]
-    args = [(file_path, cell_type, common_genes) for file_path in file_paths]
-
-    with Pool(processes=10) as pool:
-        results = pool.map(process_network, args)
-
-    data, filenames, cell_types = zip(*results)
-    df = pd.DataFrame(data)
-    df['Filename'] = filenames
-    df['Cell_Type'] = cell_types
-    return df
-
-def cluster_networks(dendritic_dir, progenitor_dir, monocyte_dir, output_plot_path, umap_coords_path):
+    # The permutation holds the position in this network of every common gene
+    file_path, cell_type, permutation = args
+    upper_triangle = aligned_upper_triangle(open_network(file_path), permutation)
+    # Bit-packed, the row of the feature store
+    return np.packbits(upper_triangle), os.path.basename(file_path), cell_type
+
+def process_directory(directory, cell_type, vocabulary, store):
+    """Add the networks of a directory that are not in the feature store yet; returns their rows in the store."""
+    file_paths = network_files(directory, 'consensus_network')
+    hashes = {file_path: network_hash(file_path) for file_path in file_paths}
+    missing = [file_path for file_path in file_paths
+               if not len(store.find(Cell_Type=cell_type, Content_Hash=hashes[file_path]))]
+    print(f"{len(file_paths) - len(missing)} networks already in the feature store, {len(missing)} to add")
+
+    # Integer permutation of every network into the gene vocabulary, from the gene names only
+    args = [(file_path, cell_type, gene_permutation(network_genes(file_path), vocabulary)) for file_path in missing]
+
+    # The aligned upper triangle (and the unpacked one), plus the dense matrix of CSV networks
+    triangle = matrix_bytes((n_pairs(len(vocabulary)),), np.uint8, 2)
+    estimates = [triangle + (network_memory(file_path, np.int64) if file_path.endswith('.csv') else 0)
+                 for file_path in missing]
+
+    # Every network is stored as soon as it is done
+    def store_network(task, result):
+        file_path = task[0]
+        bits, filename, cell_type = result
+        store.append(bits, packed=True, Filename=filename, Cell_Type=cell_type,
+                     Network_ID=re.search(r'(AML\d+[A-Z]?|BM\d+)', filename).group(1),
+                     Content_Hash=hashes[file_path])
+
+    if missing:
+        scheduler = MemoryScheduler(max_workers=10)
+        scheduler.map(process_network, args, estimates, callback=store_network)
+        print(scheduler.report())
+
+    return [int(store.find(Cell_Type=cell_type, Content_Hash=hashes[file_path])[-1]) for file_path in file_paths]
+
+def build_feature_store(directories, feature_store_path):
+    """
+    Bring the feature store of the consensus networks up to date with the directories ({cell type: directory}).
+    Returns the store and the metadata of the current networks, with their row in the store.
+    """
+    # Find common genes (sorted, with integer IDs) from the network headers
+    vocabulary = gene_vocabulary([file_path
+                                  for directory in directories.values()
+                                  for file_path in network_files(directory, 'consensus_network')])
+    print(f"Number of common genes: {len(vocabulary)}")
+
+    # One store per vocabulary, so networks with other genes start a new store
+    digest = hashlib.blake2b('\n'.join(vocabulary).encode('utf-8'), digest_size=8).hexdigest()
+    store = FeatureStore(os.path.join(feature_store_path, digest), n_pairs(len(vocabulary)), FEATURE_COLUMNS,
+                         attrs={'genes': list(vocabulary)})
+    rows = []
+    for cell_type, directory in directories.items():
+        print(f"Processing {cell_type} cells...")
+        rows.extend(process_directory(directory, cell_type, vocabulary, store))
+
+    networks = store.rows().iloc[rows].copy()
+    networks['Row'] = rows
+    return store, networks.reset_index(drop=True)
+
+def cluster_networks(dendritic_dir, progenitor_dir, monocyte_dir, output_plot_path, umap_coords_path,
+                     feature_store_path=None, metric='euclidean'):
     # Check if UMAP coordinates file already exists
     if os.path.exists(umap_coords_path):
         print(f"UMAP coordinates already saved at {umap_coords_path}. Skipping UMAP processing.")
         umap_df = pd.read_csv(umap_coords_path)
     else:
-        # Find common genes
-        all_gene_sets = []
-        for directory in [dendritic_dir, progenitor_dir, monocyte_dir]:
-            for file in os.listdir(directory):
-                if file.endswith('consensus_network.csv'):
-                    _, genes = load_and_process_network(os.path.join(directory, file))
-                    all_gene_sets.append(genes)
-
-        common_genes = get_common_genes(all_gene_sets)
-        print(f"Number of common genes: {len(common_genes)}")
-
-        # Process all directories
-        print("Processing Dendritic cells...")
-        dendritic_df = process_directory(dendritic_dir, 'Dendritic', common_genes)
-        print("Processing Progenitor cells...")
-        progenitor_df = process_directory(progenitor_dir, 'Progenitor', common_genes)
-        print("Processing Monocyte cells...")
-        monocyte_df = process_directory(monocyte_dir, 'Monocyte', common_genes)
-
-        combined_df = pd.concat([dendritic_df, progenitor_df, monocyte_df], ignore_index=True)
-
-        # Extract Network IDs
-        combined_df['Network_ID'] = combined_df['Filename'].apply(lambda x: re.search(r'(AML\d+[A-Z]?|BM\d+)', x).group(1))
-
-        # Run UMAP
-        feature_columns = [col for col in combined_df.columns if col not in ['Filename', 'Cell_Type', 'Network_ID']]
-        features = combined_df[feature_columns].values
+        # Upper triangles of all networks over the common genes, as rows of the feature store
+        feature_store_path = feature_store_path or os.path.join(os.path.dirname(dendritic_dir), 'Consensus_Features')
+        store, combined_df = build_feature_store(
+            {'Dendritic': dendritic_dir, 'Progenitor': progenitor_dir, 'Monocyte': monocyte_dir}, feature_store_path)
+
+        # Distances between the networks from popcounts of their packed bits (euclidean is what UMAP
+        # computes on the raw vectors by default), so UMAP never sees the full vectors and builds its
+        # kNN graph from this small matrix
+        print(f"Computing {metric} distances...")
+        # The shared edges of networks compared before are reused, only new networks are counted
+        distances = network_distances(store, combined_df['Row'].to_numpy(), [metric],
+                                      keys=combined_df['Content_Hash'].tolist(),
+                                      cache_path=os.path.join(store.path, 'shared_edges.npz'))[metric]
         cell_types = combined_df['Cell_Type'].values
 
-        print("Checking for NaNs in features:", np.isnan(features).any())
+        # Run UMAP
         print("Running 3D UMAP...")
-        reducer = umap.UMAP(n_components=3, random_state=42)
-        embedding = reducer.fit_transform(features)
+        reducer = umap.UMAP(n_components=3, random_state=42, metric='precomputed')
+        embedding = reducer.fit_transform(distances)
 
         # Create DataFrame
         umap_df = pd.DataFrame(embedding, columns=['UMAP1', 'UMAP2', 'UMAP3'])
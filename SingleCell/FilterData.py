@@ -1,11 +1,21 @@
 import os
+import sys
+import zlib
+import argparse
 import pandas as pd
 import numpy as np
+from functools import partial
 
-# Set the random seed for reproducibility
-np.random.seed(7)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from ExpressionStore import expression_files, expression_rows, read_expression_columns
+from MemoryScheduler import MemoryScheduler, matrix_bytes
 
-# Input directories containing the imputed.csv files for different cell types
+# Random seed for reproducibility; every imputed file samples from its own stream derived from this
+# seed and its file name without extension, so the selected cells do not depend on the order or number
+# of workers, nor on whether the matrix is read from its CSV or its .npy copy
+SEED = 7
+
+# Input directories containing the imputed files (.npy or .csv) for different cell types
 imputed_directories = {
     "Progenitor": "~/Data/Final_Progenitor_Net",
     "Monocyte": "~/Data/Final_Monocyte_Net",
@@ -29,11 +39,46 @@ sample_counts = {
     "Dendritic": 147
 }
 
-print("Processing...")
+def file_rng(file, seed=SEED):
+    """Random generator of one imputed file, from the seed and the file name without its .csv/.npy extension."""
+    stem = os.path.splitext(os.path.basename(file))[0]
+    return np.random.default_rng(np.random.SeedSequence([seed, zlib.crc32(stem.encode())]))
+
+
+def filter_imputed_file(file_path, top_genes, output_dir, n_samples, seed=SEED):
+    """
+    Write the Top 1000 gene columns of a random selection of n_samples cells of one imputed file.
+    Only the selected columns and cells are read.
+    """
+    file = os.path.basename(file_path)
+
+    # Randomly select the specified number of samples (rows), then load only their Top 1000 gene columns
+    try:
+        n_rows = expression_rows(file_path)
+        if n_rows > n_samples:
+            selected_samples = file_rng(file, seed).choice(n_rows, size=n_samples, replace=False)
+        else:
+            print(f"Warning: {file} has fewer than {n_samples} samples. Using all available samples.")
+            selected_samples = None
+        filtered_counts = read_expression_columns(file_path, top_genes, selected_samples)
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return None
+
+    # Write the filtered data to a new file
+    output_file = os.path.join(
+        os.path.expanduser(output_dir),
+        os.path.splitext(file)[0].replace("imputed", "filtered") + ".csv"
+    )
+    filtered_counts.to_csv(output_file, index=False)
+    print(f"Filtered file saved: {output_file}")
+    return output_file
+
 
-def filter_imputed_files(imputed_dir, top_genes_file, output_dir, cell_type, n_samples):
+def filter_imputed_files(imputed_dir, top_genes_file, output_dir, cell_type, n_samples, seed=SEED, max_workers=None):
     """
-    Filter imputed.csv files to include only the Top 1000 genes and randomly select specified number of samples.
+    Filter imputed files to include only the Top 1000 genes and randomly select specified number of samples.
+    The files are filtered in parallel, each reading only the columns of the Top 1000 genes and the selected cells.
     """
     # Read the Top 1000 genes file
     top_genes_path = os.path.join(os.path.expanduser(top_genes_dir), top_genes_file)
@@ -43,39 +88,30 @@ def filter_imputed_files(imputed_dir, top_genes_file, output_dir, cell_type, n_s
         print(f"Error reading {top_genes_path}: {e}")
         return
 
-    # Process all imputed.csv files in the directory
-    for file in os.listdir(imputed_dir):
-        if file.endswith("imputed.csv"):
-            file_path = os.path.join(imputed_dir, file)
-
-            # Load the gene count matrix
-            try:
-                gene_counts = pd.read_csv(file_path, header=0)
-            except Exception as e:
-                print(f"Error reading {file_path}: {e}")
-                continue
-
-            # Filter columns to include only Top 1000 genes
-            filtered_counts = gene_counts[top_genes]
-
-            # Randomly select the specified number of samples (rows)
-            if filtered_counts.shape[0] > n_samples:
-                selected_samples = np.random.choice(filtered_counts.index, size=n_samples, replace=False)
-                filtered_counts = filtered_counts.loc[selected_samples]
-            else:
-                print(f"Warning: {file} has fewer than {n_samples} samples. Using all available samples.")
-
-            # Write the filtered data to a new file
-            output_file = os.path.join(
-                os.path.expanduser(output_dir),
-                file.replace("imputed.csv", "filtered.csv")
-            )
-            filtered_counts.to_csv(output_file, index=False)
-            print(f"Filtered file saved: {output_file}")
-
-# Process each cell type
-for cell_type, imputed_dir in imputed_directories.items():
-    top_genes_file = f"Top_1000_Genes_{cell_type}.txt"
-    output_dir = filtered_output_directories[cell_type]
-    n_samples = sample_counts[cell_type]
-    filter_imputed_files(os.path.expanduser(imputed_dir), top_genes_file, os.path.expanduser(output_dir), cell_type, n_samples)
+    # Process all imputed files in the directory (the .npy version when both exist)
+    files = expression_files(imputed_dir)
+    scheduler = MemoryScheduler(max_workers=max_workers)
+    scheduler.map(partial(filter_imputed_file, top_genes=top_genes, output_dir=output_dir, n_samples=n_samples, seed=seed),
+                  files, [matrix_bytes((n_samples, len(top_genes)), copies=3) for _ in files])
+    print(scheduler.report())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter imputed files to the Top 1000 genes and a random selection of cells.")
+    parser.add_argument("--seed", type=int, default=SEED, help="Seed of the per-file random streams")
+    parser.add_argument("--workers", type=int, help="Maximum number of files filtered at once")
+    args = parser.parse_args()
+
+    print("Processing...")
+
+    # Process each cell type
+    for cell_type, imputed_dir in imputed_directories.items():
+        top_genes_file = f"Top_1000_Genes_{cell_type}.txt"
+        output_dir = filtered_output_directories[cell_type]
+        n_samples = sample_counts[cell_type]
+        filter_imputed_files(os.path.expanduser(imputed_dir), top_genes_file, os.path.expanduser(output_dir), cell_type,
+                             n_samples, args.seed, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,49 +6,16 @@ from sklearn.model_selection import StratifiedKFold
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
 from sklearn.preprocessing import StandardScaler
-from multiprocessing import Pool
 from io import StringIO
 
-
-def process_network(file_path):
-    adj_matrix = pd.read_csv(file_path, header=0, index_col=None).values
-    upper_tri = adj_matrix[np.triu_indices(len(adj_matrix), k=1)]
-    return upper_tri
-
-
-def process_patient(args):
-    patient_dir, cell_type = args
-    networks = []
-    for file in os.listdir(patient_dir):
-        if file.endswith('.csv'):
-            file_path = os.path.join(patient_dir, file)
-            networks.append(process_network(file_path))
-    return np.array(networks), os.path.basename(patient_dir), cell_type
-
-
-def process_cell_type(cell_type_dir):
-    patient_dirs = [os.path.join(cell_type_dir, d) for d in os.listdir(cell_type_dir)
-                    if os.path.isdir(os.path.join(cell_type_dir, d))]
-    cell_type = os.path.basename(cell_type_dir)
-    args = [(patient_dir, cell_type) for patient_dir in patient_dirs]
-
-    with Pool(processes=20) as pool:
-        results = pool.map(process_patient, args)
-
-    data, patient_ids, cell_types = zip(*results)
-    flat_data = np.vstack(data)
-    flat_patient_ids = np.repeat(patient_ids, [len(d) for d in data])
-
-    df = pd.DataFrame(flat_data)
-    df['Patient_ID'] = flat_patient_ids
-    df['Cell_Type'] = cell_types[0]
-    return df
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from LIONESS import read_cell_type
 
 
 def train_knn(cell_type_dir):
     cell_type = os.path.basename(cell_type_dir)
     print(f"Processing {cell_type} cells...")
-    df = process_cell_type(cell_type_dir)
+    df = read_cell_type(cell_type_dir)
 
     X = df.drop(['Patient_ID', 'Cell_Type'], axis=1)
     y = df['Patient_ID'].values
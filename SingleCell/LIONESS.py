@@ -0,0 +1,190 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from functools import partial
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from ExpressionStore import expression_genes, expression_rows, read_expression_columns
+from NetworkCache import write_meta
+from MemoryScheduler import MemoryScheduler, matrix_bytes
+
+# Python alternative to LIONESS.R for Pearson networks. LIONESS gives cell q of n cells the network
+# n * (R - R_q) + R_q, with R the correlation matrix of all cells and R_q the one without cell q.
+# R_q follows from the statistics of all cells by a rank-one downdate: with z the centered cells and
+# M = z'z their scatter matrix, the scatter of the other cells is M - n/(n-1) * z_q z_q', so all
+# correlation matrices come from one matrix product. Cells are processed in batches on the upper
+# triangle only, and the networks of a patient are written as the float32 rows of one array,
+# networks.npy in the patient directory (gene names in networks.json), instead of a CSV per cell.
+NETWORKS_FILE = 'networks.npy'
+
+# Cell types processed
+cell_types = ["Dendritic", "Monocyte", "Progenitor"]
+base_input_dir = "~/SingleCellData"
+base_output_dir = "~/SingleCellData/LIONESS_Output"
+
+
+def lioness_pearson(expression, batch_size=32, out=None):
+    """
+    LIONESS Pearson networks of every cell of a cells x genes matrix, as a cells x genes*(genes-1)/2 float32
+    matrix of upper triangles (row-major, in the order of np.triu_indices), written into out when given.
+    Genes without variance (in all cells or without a cell) get NaN correlations, as with cor in R.
+    """
+    x = np.asarray(expression, dtype=np.float64)
+    n, n_genes = x.shape
+    if n < 3:
+        raise ValueError(f"LIONESS needs at least 3 cells, got {n}")
+    rows, cols = np.triu_indices(n_genes, k=1)
+    if out is None:
+        out = np.empty((n, len(rows)), dtype=np.float32)
+
+    # Scatter matrix and correlations of all cells
+    z = x - x.mean(axis=0)
+    scatter = z.T @ z
+    variance = np.diag(scatter).copy()
+    scatter = scatter[rows, cols]
+    downdate = n / (n - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = 1 / np.sqrt(variance)
+        full = scatter * scale[rows] * scale[cols]
+
+        for start in range(0, n, batch_size):
+            cells = z[start:start + batch_size]
+            # Scatter and variances without each cell of the batch (rank-one downdates)
+            scale = 1 / np.sqrt(variance - downdate * cells ** 2)
+            without = cells[:, rows]
+            without *= cells[:, cols]
+            without *= -downdate
+            without += scatter
+            # Correlations without each cell, then the LIONESS networks
+            without *= scale[:, rows]
+            without *= scale[:, cols]
+            without *= -(n - 1)
+            without += n * full
+            out[start:start + len(cells)] = without
+    return out
+
+
+def lioness_memory(file_path, batch_size=32):
+    """Memory of the LIONESS networks of one patient: the output rows, the scatter matrix and the batch arrays."""
+    n, n_genes = expression_rows(file_path), len(expression_genes(file_path))
+    pairs = n_genes * (n_genes - 1) // 2
+    return (matrix_bytes((n, pairs), np.float32) + matrix_bytes((n_genes, n_genes), copies=2)
+            + matrix_bytes((min(batch_size, n), pairs), copies=3))
+
+
+def process_dataset(file_path, output_dir, batch_size=32):
+    """Write the LIONESS networks of all cells of a filtered expression file to output_dir/networks.npy."""
+    expression = read_expression_columns(file_path)
+    n, n_genes = expression.shape
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Rows are written into the memory-mapped output file, which replaces an older one once complete
+    output_path = os.path.join(output_dir, NETWORKS_FILE)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(n, n_genes * (n_genes - 1) // 2))
+    lioness_pearson(expression.to_numpy(), batch_size, out)
+    out.flush()
+    del out
+    os.replace(tmp_path, output_path)
+    write_meta(output_path[:-len('.npy')] + '.json', {'genes': [str(gene) for gene in expression.columns]})
+    print(f"Processed: {file_path}")
+    return output_path
+
+
+def process_patient(task, batch_size=32):
+    file_path, output_dir = task
+    return process_dataset(file_path, output_dir, batch_size)
+
+
+def network_csv_files(patient_dir):
+    """Per-cell CSV networks of a patient (as written by LIONESS.R), in file name order."""
+    return [os.path.join(patient_dir, file) for file in sorted(os.listdir(patient_dir)) if file.endswith('.csv')]
+
+
+def read_patient_networks(patient_dir):
+    """
+    Upper triangles of all networks of a patient as a cells x pairs array: networks.npy when LIONESS.py
+    wrote it, otherwise the per-cell CSV networks read one at a time.
+    """
+    path = os.path.join(patient_dir, NETWORKS_FILE)
+    if os.path.exists(path):
+        return np.load(path)
+    networks = []
+    for file_path in network_csv_files(patient_dir):
+        adj_matrix = pd.read_csv(file_path, header=0, index_col=None).values
+        networks.append(adj_matrix[np.triu_indices(len(adj_matrix), k=1)])
+    return np.array(networks)
+
+
+def patient_networks_memory(patient_dir):
+    """
+    Memory of read_patient_networks: networks.npy and its copy when stacked, or one dense CSV network plus the
+    upper triangles of all of them, copied once more when stacked. The CSV networks of a patient share the genes
+    of its expression file, so only the header of the first one is read.
+    """
+    path = os.path.join(patient_dir, NETWORKS_FILE)
+    if os.path.exists(path):
+        return 2 * os.path.getsize(path)
+    files = network_csv_files(patient_dir)
+    if not files:
+        return 0
+    n_genes = len(pd.read_csv(files[0], header=0, index_col=None, nrows=0).columns)
+    return matrix_bytes((n_genes, n_genes)) + matrix_bytes((len(files), n_genes * (n_genes - 1) // 2), copies=2)
+
+
+def read_patient(task):
+    patient_dir, cell_type = task
+    return read_patient_networks(patient_dir), os.path.basename(patient_dir), cell_type
+
+
+def read_cell_type(cell_type_dir, max_workers=20):
+    """
+    Networks of all cells of a cell type, one row per cell with its Patient_ID and Cell_Type, for the UMAP and
+    the classifiers. Patients are read in parallel under a memory budget, in sorted order so that the rows keep
+    their order between runs.
+    """
+    patient_dirs = [os.path.join(cell_type_dir, d) for d in sorted(os.listdir(cell_type_dir))
+                    if os.path.isdir(os.path.join(cell_type_dir, d))]
+    cell_type = os.path.basename(os.path.normpath(cell_type_dir))
+
+    scheduler = MemoryScheduler(max_workers=max_workers)
+    results = scheduler.map(read_patient, [(patient_dir, cell_type) for patient_dir in patient_dirs],
+                            [patient_networks_memory(patient_dir) for patient_dir in patient_dirs])
+    print(scheduler.report())
+
+    data, patient_ids, _ = zip(*results)
+    df = pd.DataFrame(np.vstack(data))
+    df['Patient_ID'] = np.repeat(patient_ids, [len(d) for d in data])
+    df['Cell_Type'] = cell_type
+    return df
+
+
+def process_directory(input_dir, output_base_dir, batch_size=32, max_workers=None):
+    """Compute the LIONESS networks of all filtered expression files of a directory, patients in parallel."""
+    files = sorted(os.path.join(input_dir, file) for file in os.listdir(input_dir) if file.endswith('_filtered.csv'))
+    output_dirs = [os.path.join(output_base_dir, os.path.basename(file).replace('_filtered.csv', '')) for file in files]
+
+    scheduler = MemoryScheduler(max_workers=max_workers)
+    scheduler.map(partial(process_patient, batch_size=batch_size), list(zip(files, output_dirs)),
+                  [lioness_memory(file, batch_size) for file in files])
+    print(scheduler.report())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LIONESS Pearson networks of every cell, one float32 array per patient.")
+    parser.add_argument("--cell_types", type=str, nargs="+", default=cell_types)
+    parser.add_argument("--batch_size", type=int, default=32, help="Cells computed at once")
+    parser.add_argument("--workers", type=int, help="Maximum number of patients processed at once")
+    args = parser.parse_args()
+
+    for cell_type in args.cell_types:
+        print(f"Processing {cell_type} cells...")
+        process_directory(os.path.expanduser(os.path.join(base_input_dir, cell_type)),
+                          os.path.expanduser(os.path.join(base_output_dir, cell_type)), args.batch_size, args.workers)
+        print(f"Finished processing {cell_type} cells.\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,56 @@
 import os
+import sys
+import argparse
 from os.path import expanduser, join
-import pandas as pd
 
-# Directories containing the adjacency matrices
-directories = {
-    "Progenitor": "~/BinaryFinal/Progenitor",
-    "Monocyte": "~/BinaryFinal/Monocyte",
-    "Dendritic": "~/BinaryFinal/Dendritic"
-}
+sys.path.append(join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from NetworkStore import network_files
+from DegreeCache import degree_matrix, top_k
+
+# Directory containing the adjacency matrices of every cell type, in {binary_dir}/{cell type}
+binary_dir = "~/BinaryFinal"
+cell_types = ["Progenitor", "Monocyte", "Dendritic"]
 
 # Output directory for results
 output_dir = expanduser("~/SingleCellData")
-os.makedirs(output_dir, exist_ok=True)
 
-print('Processing...')
 
-def process_adjacency_matrices(directory, cell_type):
+def process_adjacency_matrices(directory, cell_type, top=(1000,), cache_dir=None):
     """
-    Process all adjacency matrix CSV files in a directory to find the top 1000 genes with the highest connectivity.
+    Find the genes with the highest connectivity (summed degree) over all consensus networks (packed, sparse
+    or CSV) in a directory, for every cutoff in top. Degrees come from the degree cache, so other cutoffs
+    only repeat the ranking.
     """
-    gene_connectivity = {}
-
-    # Iterate through all CSV files in the directory
-    for file in os.listdir(directory):
-        if file.endswith("consensus_network.csv"):
-            file_path = join(directory, file)
-
-            # Load the adjacency matrix
-            try:
-                adj_matrix = pd.read_csv(file_path, header=0, index_col=None)
-                adj_matrix.index = adj_matrix.columns
-            except Exception as e:
-                print(f"Error reading {file_path}: {e}")
-                continue
-
-            # Calculate connectivity (sum of a single axis since the matrix is binary and symmetric)
-            connectivity = adj_matrix.sum(axis=1)
-
-            # Update global connectivity scores
-            for gene, conn_value in connectivity.items():
-                if gene in gene_connectivity:
-                    gene_connectivity[gene] += conn_value
-                else:
-                    gene_connectivity[gene] = conn_value
-
-    # Sort genes by connectivity and get the top 1000
-    sorted_genes = sorted(gene_connectivity.items(), key=lambda x: x[1], reverse=True)[:1000]
-
-    # Save results to a file
-    output_file = join(output_dir, f"Top_1000_Genes_{cell_type}.txt")
-    with open(output_file, "w") as f:
-        f.write("Gene\tConnectivity\n")
-        for gene, conn_value in sorted_genes:
-            f.write(f"{gene}\t{conn_value}\n")
-
-    print(f"Top 1000 genes with connectivity for {cell_type} saved to {output_file}")
-
-# Process each directory
-for cell_type, directory in directories.items():
-    process_adjacency_matrices(expanduser(directory), cell_type)
+    # Degrees of all networks aligned on their genes; connectivity is the sum over networks
+    genes, degrees = degree_matrix(network_files(directory, "consensus_network"), cache_dir)
+    connectivity = degrees.sum(axis=0)
+
+    for k in top:
+        # Save results to a file
+        output_file = join(output_dir, f"Top_{k}_Genes_{cell_type}.txt")
+        with open(output_file, "w") as f:
+            f.write("Gene\tConnectivity\n")
+            for position in top_k(connectivity, k):
+                f.write(f"{genes[position]}\t{connectivity[position]}\n")
+
+        print(f"Top {k} genes with connectivity for {cell_type} saved to {output_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Identify the most connected genes of every cell type.")
+    parser.add_argument("--top", type=int, nargs="+", default=[1000], help="Numbers of top genes, e.g. 1000 2500")
+    parser.add_argument("--cell_types", type=str, nargs="+", default=cell_types, choices=cell_types)
+    parser.add_argument("--binary_dir", type=str, default=binary_dir, help="Directory of the consensus networks of every cell type")
+    parser.add_argument("--degree_cache", type=str, help="Degree cache directory (default: $DEGREE_CACHE_DIR or ~/.cache/network_degrees)")
+    args = parser.parse_args()
+
+    os.makedirs(output_dir, exist_ok=True)
+    print('Processing...')
+
+    # Process each directory
+    for cell_type in args.cell_types:
+        process_adjacency_matrices(expanduser(join(args.binary_dir, cell_type)), cell_type, args.top, args.degree_cache)
+
+
+if __name__ == "__main__":
+    main()
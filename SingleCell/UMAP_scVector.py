@@ -1,53 +1,20 @@
 import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import umap
-from sklearn.preprocessing import StandardScaler
-from multiprocessing import Pool
 from mpl_toolkits.mplot3d import Axes3D
 
-
-# Helper function definitions
-def process_network(file_path):
-    adj_matrix = pd.read_csv(file_path, header=0, index_col=None).values
-    upper_tri = adj_matrix[np.triu_indices(len(adj_matrix), k=1)]
-    return upper_tri
-
-
-def process_patient(args):
-    patient_dir, cell_type = args
-    networks = []
-    for file in os.listdir(patient_dir):
-        if file.endswith('.csv'):
-            file_path = os.path.join(patient_dir, file)
-            networks.append(process_network(file_path))
-    return np.array(networks), os.path.basename(patient_dir), cell_type
-
-
-def process_cell_type(cell_type_dir):
-    patient_dirs = [os.path.join(cell_type_dir, d) for d in os.listdir(cell_type_dir)
-                    if os.path.isdir(os.path.join(cell_type_dir, d))]
-    cell_type = os.path.basename(cell_type_dir)
-    args = [(patient_dir, cell_type) for patient_dir in patient_dirs]
-
-    with Pool(processes=20) as pool:
-        results = pool.map(process_patient, args)
-
-    data, patient_ids, cell_types = zip(*results)
-    flat_data = np.vstack(data)
-    flat_patient_ids = np.repeat(patient_ids, [len(d) for d in data])
-
-    df = pd.DataFrame(flat_data)
-    df['Patient_ID'] = flat_patient_ids
-    df['Cell_Type'] = cell_types[0]
-    return df
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from LIONESS import read_cell_type
+from NeighborCache import NeighborCache
 
 
 def load_data(cell_type_dir):
     """Loads data and returns feature matrix (X) and patient labels (y)."""
-    df = process_cell_type(cell_type_dir)
+    df = read_cell_type(cell_type_dir)
     X = df.drop(['Patient_ID', 'Cell_Type'], axis=1).values
     y = df['Patient_ID'].values
     return X, y
@@ -72,15 +39,21 @@ def create_global_color_mapping(patient_ids):
 
 
 # Modified plotting function
-def run_umap_3d(cell_type_dir, cell_type, global_color_map, n_neighbors=15, min_dist=0.1):
-    """Create 3D UMAP plot with consistent colors and formatting."""
+def run_umap_3d(cell_type_dir, cell_type, global_color_map, n_neighbors=15, min_dist=0.1, knn_cache_dir=None):
+    """
+    Create 3D UMAP plot with consistent colors and formatting.
+    The kNN graph is saved in knn_cache_dir, so runs with other min_dist or plotting only redo the layout.
+    """
     X, y = load_data(cell_type_dir)
 
-    # Data processing
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+    # Data processing: the cache standardizes X with the scaler saved with its graph, so cells added
+    # later are scaled like the indexed ones and inserted into the saved graph
+    knn_cache_dir = knn_cache_dir or os.path.join(os.path.dirname(os.path.normpath(cell_type_dir)), 'UMAP_kNN', cell_type)
+    knn, X_scaled = NeighborCache(knn_cache_dir).neighbors(X, 'euclidean', n_neighbors, scale=True)
+    # Without force_approximation_algorithm UMAP recomputes all distances of small data sets itself
     umap_model = umap.UMAP(n_components=3, n_neighbors=n_neighbors,
-                           min_dist=min_dist, random_state=42)
+                           min_dist=min_dist, random_state=42,
+                           precomputed_knn=knn, force_approximation_algorithm=True)
     X_umap = umap_model.fit_transform(X_scaled)
 
     # Plot setup
@@ -0,0 +1,47 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from BinaryNetwork import binarize_file, process_consensus
+from ConsensusNetwork import save_consensus
+from NetworkCatalog import NetworkCatalog
+from NetworkStore import open_network
+
+METHODS = ['ARACNE', 'CLR', 'MRNET', 'GENIE_SYM']
+THRESHOLDS = {'ARACNE': 0.8, 'CLR': 0.85, 'MRNET': 0.9, 'GENIE_SYM': 0.75}
+
+
+def test_single_pass_consensus_matches_method_networks(tmp_path, monkeypatch):
+    monkeypatch.setenv('NETWORK_CACHE_DIR', str(tmp_path / 'cache'))
+    input_dir, output_dir, reference_dir = tmp_path / 'weighted', tmp_path / 'binary', tmp_path / 'reference'
+    for directory in (input_dir, output_dir, reference_dir, tmp_path / 'cache'):
+        directory.mkdir()
+
+    rng = np.random.default_rng(0)
+    genes = [f"G{i}" for i in range(11)]
+    for method in METHODS:
+        weights = rng.random((len(genes), len(genes)))
+        pd.DataFrame((weights + weights.T) / 2, columns=genes).to_csv(input_dir / f"AML1_{method}.csv", index=False)
+
+    # Blocks of 4 rows do not divide the 11 genes
+    catalog = NetworkCatalog(str(tmp_path / 'catalog.sqlite'))
+    process_consensus(str(input_dir), str(output_dir), THRESHOLDS, write_binaries=True, block_size=4, catalog=catalog)
+    catalog.close()
+
+    # The same networks thresholded one by one and combined afterwards
+    binaries = []
+    for method in METHODS:
+        binaries.append(str(reference_dir / f"AML1_{method}_binary.bnet"))
+        binarize_file(str(input_dir / f"AML1_{method}.csv"), binaries[-1], THRESHOLDS[method])
+        np.testing.assert_array_equal(open_network(str(output_dir / f"AML1_{method}_binary.bnet")).to_dense(),
+                                      open_network(binaries[-1]).to_dense())
+    save_consensus(binaries, str(reference_dir / "AML1_consensus_network.bnet"))
+
+    expected = open_network(str(reference_dir / "AML1_consensus_network.bnet"))
+    assert expected.n_edges > 0
+    for extension in ('bnet', 'npz'):
+        consensus = open_network(str(output_dir / f"AML1_consensus_network.{extension}"))
+        assert consensus.genes == genes
+        np.testing.assert_array_equal(consensus.to_dense(), expected.to_dense())
@@ -0,0 +1,113 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import igraph as ig
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'NetworkAnalysis'))
+from BinaryStats_V2 import (STATISTICS, process_directory_igraph, read_network_igraph, run_statistic, sample_efficiency,
+                            statistic_key)
+from NetworkStore import save_packed_network, save_sparse_network
+
+
+def small_graph(directed=False):
+    """Petersen graph plus a separate triangle, with gene names."""
+    g = ig.Graph.Famous('Petersen')
+    g.add_vertices(3)
+    g.add_edges([(10, 11), (11, 12), (12, 10)])
+    if directed:
+        g.to_directed(mode='mutual')
+    g.vs['name'] = [f"G{i}" for i in range(g.vcount())]
+    return g
+
+
+@pytest.mark.parametrize('name', list(STATISTICS))
+@pytest.mark.parametrize('approximate', [False, True])
+@pytest.mark.parametrize('is_symmetric', [True, False])
+def test_every_statistic_runs(name, approximate, is_symmetric):
+    g = small_graph(directed=not is_symmetric)
+    options = {'approximate': approximate, 'n_sources': 4, 'time_budget': None, 'seed': 7}
+    result, seconds, status = run_statistic(name, g, is_symmetric, options)
+    assert status == 'done'
+    assert isinstance(result, dict) and result
+
+
+def test_global_efficiency_exact():
+    g = small_graph()
+    distances = np.array(g.distances(), dtype=float)
+    off_diagonal = ~np.eye(g.vcount(), dtype=bool)
+    expected = np.where(np.isfinite(distances), 1 / np.where(distances > 0, distances, 1), 0)[off_diagonal].mean()
+    efficiency, low, high, used = sample_efficiency(g)
+    assert efficiency == pytest.approx(expected)
+    assert (low, high, used) == (None, None, g.vcount())
+
+
+def test_global_efficiency_sampled_interval():
+    g = ig.Graph.Erdos_Renyi(n=200, p=0.03)
+    exact = sample_efficiency(g)[0]
+    efficiency, low, high, used = sample_efficiency(g, n_sources=100, seed=3)
+    assert used == 100
+    assert low <= efficiency <= high
+    assert abs(efficiency - exact) < 0.05
+
+
+def test_sampling_options_only_key_approximate_results():
+    exact = {'approximate': False, 'n_sources': 256, 'time_budget': None, 'seed': 7}
+    approximate = dict(exact, approximate=True)
+    for name in ('path_length', 'diameter', 'global_efficiency'):
+        assert statistic_key(name, exact) == statistic_key(name, dict(exact, n_sources=64, seed=1))
+        assert statistic_key(name, approximate) != statistic_key(name, dict(approximate, n_sources=64))
+
+
+@pytest.mark.parametrize('extension', ['bnet', 'npz', 'csv'])
+def test_graph_from_edge_arrays(tmp_path, extension):
+    g = small_graph()
+    adjacency = np.array(g.get_adjacency().data)
+    network = pd.DataFrame(adjacency, columns=g.vs['name'])
+    path = str(tmp_path / f"AML1_consensus_network.{extension}")
+    if extension == 'bnet':
+        save_packed_network(network, path)
+    elif extension == 'npz':
+        save_sparse_network(network, path)
+    else:
+        network.to_csv(path, index=False)
+
+    loaded, is_symmetric = read_network_igraph(path)
+    assert is_symmetric and not loaded.is_directed()
+    assert loaded.vs['name'] == g.vs['name']
+    assert loaded.get_edgelist() == sorted(g.get_edgelist())
+
+
+def test_asymmetric_csv_graph_is_directed(tmp_path):
+    adjacency = np.zeros((4, 4), dtype=int)
+    adjacency[0, 1] = adjacency[1, 0] = adjacency[2, 3] = 1
+    pd.DataFrame(adjacency, columns=list('ABCD')).to_csv(tmp_path / "network.csv", index=False)
+    loaded, is_symmetric = read_network_igraph(str(tmp_path / "network.csv"))
+    assert not is_symmetric and loaded.is_directed()
+    assert sorted(loaded.get_edgelist()) == [(0, 1), (1, 0), (2, 3)]
+
+
+def test_interrupted_directory_run_resumes(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv('NETWORK_CATALOG', str(tmp_path / 'catalog.sqlite'))
+    options = {'cache_path': str(tmp_path / 'statistics.sqlite'), 'statistics': ['size', 'degree']}
+    g = small_graph()
+    network = pd.DataFrame(np.array(g.get_adjacency().data), columns=g.vs['name'])
+    for patient in ('AML1', 'AML2'):
+        save_packed_network(network, str(tmp_path / f"{patient}_consensus_network.bnet"))
+
+    process_directory_igraph(str(tmp_path), 'Statistics.csv', **options)
+    first = pd.read_csv(tmp_path / 'Statistics.csv')
+    assert list(first['Filename']) == ['AML1_consensus_network.bnet', 'AML2_consensus_network.bnet']
+
+    # Saved rows are reused; a changed network and a new one are processed
+    network.iloc[0, 1] = network.iloc[1, 0] = 1 - network.iloc[0, 1]
+    save_packed_network(network, str(tmp_path / "AML2_consensus_network.bnet"))
+    save_packed_network(network, str(tmp_path / "AML3_consensus_network.bnet"))
+    capsys.readouterr()
+    process_directory_igraph(str(tmp_path), 'Statistics.csv', **options)
+    assert "1 networks already done, 2 to process" in capsys.readouterr().out
+    second = pd.read_csv(tmp_path / 'Statistics.csv')
+    assert len(second) == 3
+    pd.testing.assert_series_equal(second.iloc[0], first.iloc[0], check_names=False)
+    assert second.iloc[1].equals(second.iloc[2].replace('AML3', 'AML2', regex=True))
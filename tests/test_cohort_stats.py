@@ -0,0 +1,48 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import igraph as ig
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'NetworkAnalysis'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from CohortStats import cohort_statistics
+from NetworkStore import save_packed_network, save_sparse_network
+
+
+def igraph_statistics(g):
+    degree = np.array(g.degree())
+    clustering = np.array(g.transitivity_local_undirected(mode='zero'))
+    return {
+        "Nodes": g.vcount(),
+        "Edges": g.ecount(),
+        "Density": g.density(),
+        "Transitivity": g.transitivity_undirected(),
+        "Mean Degree": degree.mean(),
+        "Max Degree": degree.max(),
+        "SD Degree": degree.std(),
+        "Gene with Highest Degree": g.vs[int(np.argmax(degree))]['name'],
+        "Mean Clustering Coefficient": clustering.mean(),
+        "Variance Clustering Coefficient": clustering.var(),
+        "Assortativity Coefficient": g.assortativity_degree(directed=False),
+        "Total Triangles": len(g.list_triangles()),
+    }
+
+
+def test_cohort_statistics_match_igraph(tmp_path):
+    # Networks over different genes, in different orders, in batches that do not divide the cohort
+    paths, graphs = [], []
+    for i, (n, p) in enumerate([(30, 0.2), (25, 0.3), (40, 0.1)]):
+        g = ig.Graph.Erdos_Renyi(n=n, p=p)
+        g.vs['name'] = [f"G{gene}" for gene in np.random.default_rng(i).permutation(45)[:n]]
+        network = pd.DataFrame(np.array(g.get_adjacency().data), columns=g.vs['name'])
+        paths.append(str(tmp_path / f"AML{i}_consensus_network.{'npz' if i == 1 else 'bnet'}"))
+        (save_sparse_network if i == 1 else save_packed_network)(network, paths[-1])
+        graphs.append(g)
+
+    stats = cohort_statistics(paths, batch_size=2)
+    assert list(stats['Filename']) == [os.path.basename(path) for path in paths]
+    for (_, row), g in zip(stats.iterrows(), graphs):
+        for column, expected in igraph_statistics(g).items():
+            assert row[column] == pytest.approx(expected), column
@@ -0,0 +1,73 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from DegreeCache import degree_matrix, degree_memory, network_degrees, top_k
+from NetworkStore import save_packed_network, save_sparse_network
+
+
+def save_network(path, genes, seed):
+    upper = np.triu(np.random.default_rng(seed).random((len(genes), len(genes))) < 0.4, k=1)
+    network = pd.DataFrame((upper | upper.T).astype(np.int64), columns=genes)
+    if path.endswith('.bnet'):
+        save_packed_network(network, path)
+    elif path.endswith('.npz'):
+        save_sparse_network(network, path)
+    else:
+        network.to_csv(path, index=False)
+    return network.sum(axis=0)
+
+
+def test_degrees_are_cached_by_content(tmp_path, monkeypatch):
+    monkeypatch.setenv('NETWORK_CATALOG', str(tmp_path / 'catalog.sqlite'))
+    cache_dir = str(tmp_path / 'degrees')
+    path = str(tmp_path / "AML1_consensus_network.bnet")
+    expected = save_network(path, [f"G{i}" for i in range(12)], 0)
+
+    genes, degrees = network_degrees(path, cache_dir)
+    assert genes == list(expected.index) and degrees.tolist() == expected.tolist()
+    assert len(os.listdir(cache_dir)) == 1
+    assert network_degrees(path, cache_dir)[1].tolist() == expected.tolist()
+
+    # A changed network gets its own cache entry
+    expected = save_network(path, [f"G{i}" for i in range(12)], 1)
+    assert network_degrees(path, cache_dir)[1].tolist() == expected.tolist()
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_degree_matrix_aligns_genes(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv('NETWORK_CATALOG', str(tmp_path / 'catalog.sqlite'))
+    paths = [str(tmp_path / name) for name in ("AML1_consensus_network.npz", "AML2_consensus_network.csv",
+                                                "AML3_consensus_network.bnet")]
+    first = save_network(paths[0], ['A', 'B', 'C', 'D'], 2)
+    second = save_network(paths[1], ['C', 'E', 'A'], 3)
+    with open(paths[2], 'wb') as f:
+        f.write(b'not a network')
+
+    genes, matrix = degree_matrix(paths, str(tmp_path / 'degrees'))
+    assert genes == ['A', 'B', 'C', 'D', 'E']
+    np.testing.assert_array_equal(matrix, [first.reindex(genes, fill_value=0), second.reindex(genes, fill_value=0)])
+    assert "Error reading" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('k', [1, 3, 4, 6, 10])
+def test_top_k_like_pandas_nlargest(k):
+    scores = pd.Series([5, 9, 7, 9, 7, 7, 1, 0])
+    assert top_k(scores.to_numpy(), k).tolist() == scores.nlargest(k, keep='first').index.tolist()
+    assert top_k(scores.to_numpy(), k, ties='all').tolist() == scores.nlargest(k, keep='all').index.tolist()
+
+
+def test_degree_memory_follows_the_edges(tmp_path):
+    # A large sparse network: its estimate must not be that of a dense gene x gene matrix
+    n = 3000
+    genes = [f"G{i}" for i in range(n)]
+    network = np.zeros((n, n), dtype=np.uint8)
+    network[0, 1:11] = network[1:11, 0] = 1
+    save_packed_network(network, str(tmp_path / "network.bnet"), genes)
+    save_sparse_network(network, str(tmp_path / "network.npz"), genes)
+
+    assert degree_memory(str(tmp_path / "network.npz")) < n * n // 10
+    assert degree_memory(str(tmp_path / "network.bnet"), chunk_bytes=1 << 16) < n * n // 10
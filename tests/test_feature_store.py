@@ -0,0 +1,49 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from FeatureStore import FeatureStore
+
+COLUMNS = ['Filename', 'Cell_Type']
+
+
+@pytest.mark.parametrize('encoding', ['bits', 'float32'])
+def test_rows_survive_reopening(tmp_path, encoding):
+    rng = np.random.default_rng(0)
+    features = (rng.random((5, 21)) < 0.4).astype(np.float32)
+    store = FeatureStore(str(tmp_path / 'store'), 21, COLUMNS, encoding=encoding, attrs={'genes': ['A', 'B']})
+    for i, row in enumerate(features):
+        store.append(row, Filename=f"AML{i}_consensus_network.bnet", Cell_Type='Monocyte' if i % 2 else 'Dendritic')
+
+    reopened = FeatureStore(str(tmp_path / 'store'))
+    assert reopened.n_rows == 5 and reopened.attrs == {'genes': ['A', 'B']}
+    np.testing.assert_array_equal(reopened.matrix(), features)
+    np.testing.assert_array_equal(reopened.matrix([3, 1]), features[[3, 1]])
+    assert list(reopened.find(Cell_Type='Monocyte')) == [1, 3]
+    assert np.vstack([block for _, block in reopened.blocks(block_rows=2)]).tolist() == features.tolist()
+
+
+def test_packed_append_and_truncated_tail(tmp_path):
+    store = FeatureStore(str(tmp_path / 'store'), 12, COLUMNS)
+    bits = np.array([1, 0, 1, 1, 0, 0, 0, 1, 1, 1, 0, 1], dtype=np.uint8)
+    store.append(np.packbits(bits), packed=True, Filename='a', Cell_Type='Monocyte')
+
+    # Bytes of an append that crashed before its metadata line are dropped by the next append
+    with open(store.data_path, 'ab') as f:
+        f.write(b'\xff\xff\xff')
+    store = FeatureStore(str(tmp_path / 'store'))
+    store.append(1 - bits, Filename='b', Cell_Type='Monocyte')
+    assert os.path.getsize(store.data_path) == 2 * store.row_bytes
+    np.testing.assert_array_equal(store.matrix(), [bits, 1 - bits])
+
+
+def test_mismatched_store_is_refused(tmp_path):
+    FeatureStore(str(tmp_path / 'store'), 12, COLUMNS, attrs={'genes': ['A']})
+    with pytest.raises(ValueError):
+        FeatureStore(str(tmp_path / 'store'), 13, COLUMNS)
+    with pytest.raises(ValueError):
+        FeatureStore(str(tmp_path / 'store'), 12, COLUMNS, attrs={'genes': ['B']})
+    with pytest.raises(ValueError):
+        FeatureStore(str(tmp_path / 'store')).append(np.zeros(12), Filename='a')
@@ -0,0 +1,27 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'SingleCell'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from FilterData import file_rng, filter_imputed_file
+from ExpressionStore import save_expression
+
+
+def test_same_cells_from_csv_and_npy(tmp_path):
+    genes = [f"G{i}" for i in range(8)]
+    matrix = np.random.default_rng(0).random((50, len(genes)))
+    pd.DataFrame(matrix, columns=genes).to_csv(tmp_path / "AML1_imputed.csv", index=False)
+    save_expression(str(tmp_path / "AML1_imputed.npy"), matrix, genes)
+    assert (file_rng("AML1_imputed.csv").choice(50, 10, replace=False) ==
+            file_rng("AML1_imputed.npy").choice(50, 10, replace=False)).all()
+
+    outputs = []
+    for extension in ('csv', 'npy'):
+        output_dir = tmp_path / extension
+        output_dir.mkdir()
+        output_file = filter_imputed_file(str(tmp_path / f"AML1_imputed.{extension}"), ['G3', 'G1'], str(output_dir), 10)
+        outputs.append(pd.read_csv(output_file))
+    np.testing.assert_allclose(outputs[0].to_numpy(), outputs[1].to_numpy())
+    assert list(outputs[0].columns) == ['G3', 'G1']
@@ -0,0 +1,69 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'SingleCell'))
+from LIONESS import lioness_pearson, patient_networks_memory, process_dataset, read_cell_type
+
+
+def brute_force_lioness(expression):
+    """n * (R - R_q) + R_q with R_q recomputed from the other cells, for every cell q."""
+    n, n_genes = expression.shape
+    rows, cols = np.triu_indices(n_genes, k=1)
+    full = np.corrcoef(expression, rowvar=False)
+    networks = []
+    for q in range(n):
+        without = np.corrcoef(np.delete(expression, q, axis=0), rowvar=False)
+        networks.append((n * (full - without) + without)[rows, cols])
+    return np.array(networks)
+
+
+@pytest.mark.parametrize('batch_size', [1, 4, 32])
+def test_lioness_matches_leave_one_out(batch_size):
+    expression = np.random.default_rng(1).lognormal(size=(11, 7))
+    networks = lioness_pearson(expression, batch_size)
+    assert networks.dtype == np.float32 and networks.shape == (11, 21)
+    np.testing.assert_allclose(networks, brute_force_lioness(expression), rtol=1e-4, atol=1e-4)
+
+
+def test_constant_genes_get_nan_like_r():
+    expression = np.random.default_rng(2).random((6, 4))
+    expression[:, 2] = 1.0
+    # Gene 0 only varies in cell 3, so without that cell it is constant as well
+    expression[:, 0] = 0.0
+    expression[3, 0] = 5.0
+    networks = lioness_pearson(expression)
+    rows, cols = np.triu_indices(4, k=1)
+    assert np.isnan(networks[:, (rows == 2) | (cols == 2)]).all()
+    assert np.isnan(networks[3, (rows == 0) & (cols != 2)]).all()
+    assert np.isfinite(networks[np.arange(6) != 3][:, (rows == 0) & (cols != 2)]).all()
+
+
+def test_cell_type_from_csv_and_npy_networks(tmp_path):
+    rng = np.random.default_rng(0)
+    genes = [f"G{i}" for i in range(6)]
+    expression = pd.DataFrame(rng.random((12, len(genes))), columns=genes)
+    expression.to_csv(tmp_path / "AML1_filtered.csv", index=False)
+
+    # AML1 as written by LIONESS.py, AML2 as one CSV network per cell as written by LIONESS.R
+    process_dataset(str(tmp_path / "AML1_filtered.csv"), str(tmp_path / 'Monocyte' / 'AML1'))
+    csv_dir = tmp_path / 'Monocyte' / 'AML2'
+    csv_dir.mkdir()
+    networks = []
+    for cell in range(3):
+        network = rng.random((len(genes), len(genes)))
+        network = network + network.T
+        pd.DataFrame(network, columns=genes).to_csv(csv_dir / f"cell_{cell}.csv", index=False)
+        networks.append(network[np.triu_indices(len(genes), k=1)])
+
+    df = read_cell_type(str(tmp_path / 'Monocyte'), max_workers=2)
+    assert list(df['Patient_ID']) == ['AML1'] * 12 + ['AML2'] * 3
+    assert (df['Cell_Type'] == 'Monocyte').all()
+    features = df.drop(['Patient_ID', 'Cell_Type'], axis=1).to_numpy()
+    np.testing.assert_allclose(features[12:], np.array(networks))
+    np.testing.assert_allclose(features[:12], np.load(tmp_path / 'Monocyte' / 'AML1' / 'networks.npy'))
+
+    # The CSV estimate holds one dense network plus two copies of all upper triangles
+    assert patient_networks_memory(str(csv_dir)) == 8 * (6 * 6 + 2 * 3 * 15)
@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from MemoryScheduler import MemoryScheduler, matrix_bytes, network_memory, networks_memory
+from NetworkStore import save_packed_network
+
+
+def timed_square(value):
+    start = time.time()
+    time.sleep(0.05)
+    return value * value, (start, time.time())
+
+
+def failing(value):
+    if value == 2:
+        raise RuntimeError("task 2 failed")
+    return value
+
+
+def test_results_in_task_order_and_callback_per_task():
+    finished = {}
+    scheduler = MemoryScheduler(max_workers=3, memory_budget=10 ** 9)
+    results = scheduler.map(timed_square, range(6), [1000] * 6, callback=finished.__setitem__)
+    assert [result for result, _ in results] == [value * value for value in range(6)]
+    assert {task: result for task, (result, _) in finished.items()} == {value: value * value for value in range(6)}
+    assert len(scheduler.task_stats) == 6
+
+
+def test_tasks_beyond_the_budget_wait():
+    # Two tasks fit in the budget at once, the third (larger than the budget) runs alone
+    scheduler = MemoryScheduler(max_workers=4, memory_budget=250)
+    results = scheduler.map(timed_square, range(5), [100, 100, 100, 1000, 100])
+    intervals = [interval for _, interval in results]
+    overlapping = [sum(start < other_end and other_start < end for other_start, other_end in intervals) - 1
+                   for start, end in intervals]
+    assert max(overlapping) <= 2
+    assert overlapping[3] == 0
+
+
+def test_failure_is_raised():
+    with pytest.raises(RuntimeError, match="task 2 failed"):
+        MemoryScheduler(max_workers=2, memory_budget=10 ** 9).map(failing, range(4), [1] * 4)
+
+
+def test_estimates_from_headers(tmp_path):
+    genes = [f"G{i}" for i in range(20)]
+    save_packed_network(np.zeros((20, 20), dtype=np.uint8), str(tmp_path / "AML1_consensus_network.bnet"), genes)
+    pd.DataFrame(np.zeros((10, 10)), columns=genes[:10]).to_csv(tmp_path / "AML1_CLR.csv", index=False)
+
+    assert matrix_bytes((20, 20), np.float32, copies=3) == 20 * 20 * 4 * 3
+    assert network_memory(str(tmp_path / "AML1_consensus_network.bnet"), np.uint8) == 400
+    assert network_memory(str(tmp_path / "AML1_CLR.csv")) == 800
+    # The largest dense matrix plus the retained upper triangles of all networks
+    assert networks_memory([str(tmp_path / "AML1_consensus_network.bnet"), str(tmp_path / "AML1_CLR.csv")]) == \
+        3200 + (3200 + 800) // 2
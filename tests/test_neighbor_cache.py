@@ -0,0 +1,22 @@
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from NeighborCache import NeighborCache, data_digest, row_digests
+
+
+def test_appended_rows_replace_the_saved_graph(tmp_path):
+    matrix = np.random.default_rng(0).random((120, 6)).astype(np.float32)
+    cache = NeighborCache(str(tmp_path))
+
+    cache.neighbors(matrix[:100], n_neighbors=5, n_jobs=1, scale=True)
+    (indices, distances, _), data = cache.neighbors(matrix, n_neighbors=5, n_jobs=1, scale=True)
+    assert indices.shape == (120, 5) and data.shape == matrix.shape
+
+    # Only the graph of all rows is left, and it is used as is for the same rows
+    assert list(cache.candidates('euclidean_scaled')) == [data_digest(row_digests(matrix))]
+    assert sorted(os.listdir(tmp_path)) == sorted(f"knn_euclidean_scaled_{data_digest(row_digests(matrix))}.{extension}"
+                                                  for extension in ('json', 'pkl'))
+    (cached, _, _), _ = cache.neighbors(matrix, n_neighbors=5, n_jobs=1, scale=True)
+    np.testing.assert_array_equal(cached, indices)
@@ -0,0 +1,60 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from NetworkCache import cache_paths, load_weighted_genes, load_weighted_network, save_weighted_network
+
+
+def write_network(path, n=7, seed=0):
+    genes = [f"G{i}" for i in range(n)]
+    matrix = np.random.default_rng(seed).random((n, n))
+    pd.DataFrame(matrix, columns=genes).to_csv(path, index=False)
+    return matrix, genes
+
+
+def test_csv_cache_is_reused_until_the_source_changes(tmp_path):
+    csv_path = str(tmp_path / "AML1_CLR.csv")
+    matrix, genes = write_network(csv_path)
+    # The cache directory is created on first use
+    cache_dir = str(tmp_path / 'cache' / 'networks')
+
+    cached, cached_genes = load_weighted_network(csv_path, cache_dir)
+    assert cached.dtype == np.float32 and cached_genes == genes
+    np.testing.assert_array_equal(cached, matrix.astype(np.float32))
+    assert load_weighted_genes(csv_path, cache_dir) == genes
+
+    array_path, _ = cache_paths(csv_path, cache_dir)
+    converted = os.stat(array_path).st_mtime_ns
+    load_weighted_network(csv_path, cache_dir)
+    assert os.stat(array_path).st_mtime_ns == converted
+
+    # A rewritten source is converted again
+    matrix, _ = write_network(csv_path, seed=1)
+    os.utime(csv_path, ns=(converted + 10 ** 9, converted + 10 ** 9))
+    np.testing.assert_array_equal(load_weighted_network(csv_path, cache_dir)[0], matrix.astype(np.float32))
+
+
+def test_touched_source_is_accepted_by_hash(tmp_path):
+    csv_path = str(tmp_path / "AML1_CLR.csv")
+    write_network(csv_path)
+    load_weighted_network(csv_path, use_hash=True)
+    array_path, _ = cache_paths(csv_path)
+    converted = os.stat(array_path).st_mtime_ns
+
+    os.utime(csv_path, ns=(converted + 10 ** 9, converted + 10 ** 9))
+    load_weighted_network(csv_path, use_hash=True)
+    assert os.stat(array_path).st_mtime_ns == converted
+
+
+def test_saved_upper_triangle_expands_to_the_symmetric_matrix(tmp_path):
+    weights = np.random.default_rng(2).random((9, 9)).astype(np.float32)
+    weights = np.triu(weights, k=1) + np.triu(weights, k=1).T
+    genes = [f"G{i}" for i in range(9)]
+    for upper_triangle in (False, True):
+        path = str(tmp_path / f"AML1_MRNET_{upper_triangle}.npy")
+        save_weighted_network(path, weights, genes, upper_triangle=upper_triangle)
+        matrix, saved_genes = load_weighted_network(path)
+        np.testing.assert_array_equal(matrix, weights)
+        assert saved_genes == genes
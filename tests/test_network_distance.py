@@ -0,0 +1,30 @@
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'NetworkAnalysis'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from NetworkDistance import current_rows, network_distances
+from FeatureStore import FeatureStore
+
+COLUMNS = ['Filename', 'Cell_Type', 'Network_ID', 'Content_Hash']
+
+
+def test_network_appended_again_keeps_one_row(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.random((4, 45)) < 0.3
+    store = FeatureStore(str(tmp_path / 'store'), 45, COLUMNS)
+    for network_id, vector, content_hash in [('AML1', vectors[0], 'a'), ('AML2', vectors[1], 'b'),
+                                             ('AML1', vectors[2], 'c'), ('BM1', vectors[3], 'd')]:
+        store.append(vector, Filename=f"{network_id}_consensus_network.csv", Cell_Type='Monocyte',
+                     Network_ID=network_id, Content_Hash=content_hash)
+
+    rows, labels = current_rows(FeatureStore(str(tmp_path / 'store')))
+    assert list(rows) == [1, 2, 3]
+    assert labels == ['Monocyte_AML2', 'Monocyte_AML1', 'Monocyte_BM1']
+
+    # Hamming distances of the current rows only, from the new AML1 network
+    hamming = network_distances(store, rows, metrics=['hamming'])['hamming']
+    assert hamming.shape == (3, 3)
+    expected = (vectors[[1, 2, 3]][:, None, :] != vectors[[1, 2, 3]][None, :, :]).sum(axis=2)
+    np.testing.assert_allclose(hamming, expected / 45)
@@ -0,0 +1,80 @@
+import os
+import sys
+import numpy as np
+from scipy.stats import spearmanr
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from NetworkInference import MAX_SQUARED_CORRELATION, aracne, clr, mrnet, spearman_mim
+
+# Small blocks, so that every kernel crosses block boundaries on the 9 genes of the fixture
+N_GENES = 9
+
+
+def fixture_mim():
+    expression = np.random.default_rng(0).lognormal(size=(40, N_GENES))
+    expression[:, 1] += 0.8 * expression[:, 0]
+    expression[:, 2] += 0.5 * expression[:, 1]
+    return expression, spearman_mim(expression, block_size=4)
+
+
+def reference_mim(expression):
+    correlation = spearmanr(expression).correlation
+    mim = -0.5 * np.log(1 - np.minimum(correlation ** 2, MAX_SQUARED_CORRELATION))
+    np.fill_diagonal(mim, 0)
+    return mim
+
+
+def reference_clr(mim):
+    z = np.maximum((mim - mim.mean(axis=1, keepdims=True)) / mim.std(axis=1, keepdims=True), 0)
+    return np.sqrt(z ** 2 + z.T ** 2)
+
+
+def reference_aracne(mim, eps=0):
+    network = mim.copy()
+    n = len(mim)
+    for i in range(n):
+        for j in range(n):
+            for k in range(n):
+                if len({i, j, k}) == 3 and mim[i, j] < min(mim[i, k], mim[j, k]) - eps:
+                    network[i, j] = 0
+    return network
+
+
+def reference_mrnet(mim):
+    n = len(mim)
+    network = np.zeros((n, n))
+    for target in range(n):
+        selected = []
+        while True:
+            scores = {gene: mim[target, gene] - (np.mean([mim[gene, other] for other in selected]) if selected else 0)
+                      for gene in range(n) if gene != target and gene not in selected}
+            gene = max(scores, key=lambda gene: (scores[gene], -gene)) if scores else None
+            if gene is None or scores[gene] <= 0:
+                break
+            network[target, gene] = scores[gene]
+            selected.append(gene)
+    return np.maximum(network, network.T)
+
+
+def test_spearman_mim():
+    expression, mim = fixture_mim()
+    assert mim.dtype == np.float32
+    np.testing.assert_allclose(mim, reference_mim(expression), rtol=1e-4, atol=1e-6)
+
+
+def test_clr():
+    _, mim = fixture_mim()
+    np.testing.assert_allclose(clr(mim, block_size=4), reference_clr(mim.astype(np.float64)), rtol=1e-4, atol=1e-5)
+
+
+def test_aracne():
+    _, mim = fixture_mim()
+    network = aracne(mim, row_block=2, k_block=3, threads=2)
+    np.testing.assert_array_equal(network, reference_aracne(mim))
+    assert 0 < np.count_nonzero(network) < np.count_nonzero(mim)
+
+
+def test_mrnet():
+    _, mim = fixture_mim()
+    np.testing.assert_allclose(mrnet(mim, batch_size=4, threads=2), reference_mrnet(mim.astype(np.float64)),
+                               rtol=1e-4, atol=1e-6)
@@ -0,0 +1,112 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from NetworkStore import (PackedNetwork, PackedNetworkWriter, SparseNetwork, SparseNetworkWriter, aligned_upper_triangle,
+                          gene_permutation, gene_vocabulary, network_files, open_network, save_packed_network,
+                          save_sparse_network)
+
+
+def random_network(n, density=0.3, seed=0):
+    """Symmetric binary adjacency matrix with an empty diagonal, labelled with gene names."""
+    upper = np.triu(np.random.default_rng(seed).random((n, n)) < density, k=1)
+    return pd.DataFrame((upper | upper.T).astype(np.int64), columns=[f"G{i}" for i in range(n)])
+
+
+@pytest.mark.parametrize('n', [1, 2, 9, 37])
+def test_packed_round_trip(tmp_path, n):
+    network = random_network(n)
+    path = str(tmp_path / "AML1_consensus_network.bnet")
+    save_packed_network(network, path)
+
+    packed = open_network(path)
+    assert isinstance(packed, PackedNetwork)
+    assert packed.genes == list(network.columns) and packed.n == n and packed.symmetric
+    assert packed.n_edges == np.triu(network.to_numpy(), k=1).sum()
+    np.testing.assert_array_equal(packed.to_dense(), network.to_numpy())
+    np.testing.assert_array_equal(packed.upper_triangle(), network.to_numpy()[np.triu_indices(n, k=1)])
+    np.testing.assert_array_equal(packed.degree(), network.to_numpy().sum(axis=1))
+    pd.testing.assert_frame_equal(packed.to_dataframe(np.int64), network.set_axis(network.columns, axis=0))
+
+
+def test_writer_flushes_rows_in_small_segments(tmp_path):
+    # Rows written in uneven blocks with a flush every few bits pack the same as one write
+    network = random_network(23, seed=1)
+    path = str(tmp_path / "network.bnet")
+    with PackedNetworkWriter(path, network.columns, flush_bits=5) as writer:
+        for start, stop in [(0, 1), (1, 8), (8, 23)]:
+            writer.write_rows(network.to_numpy()[start:stop])
+    np.testing.assert_array_equal(PackedNetwork(path).to_dense(), network.to_numpy())
+
+
+def test_asymmetric_network_is_not_packed(tmp_path):
+    network = random_network(5).to_numpy().copy()
+    network[0, 1], network[1, 0] = 1, 0
+    with pytest.raises(ValueError):
+        save_packed_network(network, str(tmp_path / "network.bnet"), [f"G{i}" for i in range(5)])
+
+
+@pytest.mark.parametrize('n', [1, 2, 9, 37])
+def test_sparse_round_trip_matches_packed(tmp_path, n):
+    network = random_network(n, seed=n)
+    save_packed_network(network, str(tmp_path / "network.bnet"))
+    save_sparse_network(network, str(tmp_path / "network.npz"))
+
+    packed, sparse = open_network(str(tmp_path / "network.bnet")), open_network(str(tmp_path / "network.npz"))
+    assert isinstance(sparse, SparseNetwork)
+    assert sparse.genes == packed.genes and sparse.n == n and sparse.n_edges == packed.n_edges
+    assert sparse.indices.dtype == np.int32
+    np.testing.assert_array_equal(sparse.to_dense(), network.to_numpy())
+    np.testing.assert_array_equal(sparse.upper_triangle(), packed.upper_triangle())
+    np.testing.assert_array_equal(sparse.edge_positions(), packed.edge_positions())
+    np.testing.assert_array_equal(sparse.degree(), packed.degree())
+
+
+def test_sparse_writer_in_blocks(tmp_path):
+    network = random_network(17, seed=3).to_numpy()
+    path = str(tmp_path / "network.npz")
+    with SparseNetworkWriter(path, [f"G{i}" for i in range(17)]) as writer:
+        for start, stop in [(0, 5), (5, 6), (6, 17)]:
+            writer.write_rows(network[start:stop])
+    np.testing.assert_array_equal(SparseNetwork(path).to_dense(), network)
+
+
+def test_network_files_prefer_sparse_then_packed(tmp_path):
+    network = random_network(4)
+    save_sparse_network(network, str(tmp_path / "AML1_consensus_network.npz"))
+    save_packed_network(network, str(tmp_path / "AML1_consensus_network.bnet"))
+    save_packed_network(network, str(tmp_path / "AML2_consensus_network.bnet"))
+    network.to_csv(tmp_path / "AML2_consensus_network.csv", index=False)
+    network.to_csv(tmp_path / "AML3_consensus_network.csv", index=False)
+    assert [os.path.basename(path) for path in network_files(str(tmp_path), 'consensus_network')] == \
+        ["AML1_consensus_network.npz", "AML2_consensus_network.bnet", "AML3_consensus_network.csv"]
+
+
+def test_aligned_upper_triangle_in_every_format(tmp_path):
+    # Two networks with other gene orders and one extra gene each; the vocabulary is the sorted common genes
+    first = random_network(8, seed=4)
+    second = random_network(8, seed=5).set_axis([f"G{i}" for i in [7, 3, 5, 1, 8, 0, 2, 4]], axis=1)
+    paths = []
+    for name, network in [('AML1', first), ('AML2', second)]:
+        for extension, save in [('bnet', save_packed_network), ('npz', save_sparse_network)]:
+            paths.append(str(tmp_path / f"{name}.{extension}"))
+            save(network, paths[-1])
+        paths.append(str(tmp_path / f"{name}.csv"))
+        network.to_csv(paths[-1], index=False)
+
+    vocabulary = gene_vocabulary(paths)
+    assert list(vocabulary) == [f"G{i}" for i in [0, 1, 2, 3, 4, 5, 7]]
+    for path in paths:
+        network = open_network(path)
+        frame = network.to_dataframe().set_axis(network.genes, axis=0)
+        expected = frame.loc[list(vocabulary), list(vocabulary)].to_numpy()[np.triu_indices(len(vocabulary), k=1)]
+        np.testing.assert_array_equal(aligned_upper_triangle(network, gene_permutation(network.genes, vocabulary)),
+                                      expected)
+
+
+def test_gene_permutation_needs_every_gene():
+    with pytest.raises(KeyError):
+        gene_permutation(['G0', 'G1'], {'G0': 0, 'G2': 1})
@@ -0,0 +1,94 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'InferGRNs'))
+from ThresholdCalibration import DEFAULT_TECHNIQUES, QuantileSketch, calibrate_threshold, null_files, order_statistics
+
+
+def write_null(path, n=10):
+    pd.DataFrame({'edge_weights': np.random.default_rng(0).random(n)}).to_csv(path, index=False)
+
+
+def test_null_files_follow_permutation_threshold_names(tmp_path):
+    # Files as written by PermutationThreshold.R, plus symmetrized copies made outside the repository
+    for method in ['ARACNE', 'CLR', 'MRNET', 'GENIE3']:
+        for i in (1, 2, 10):
+            write_null(tmp_path / f"AML556_imputed_{method}_perm_{i}.csv")
+            write_null(tmp_path / f"AML556_imputed_{method}_perm_{i}_SYM.csv")
+    write_null(tmp_path / "AML999_imputed_ARACNE_perm_1.csv")
+
+    found = {name: files for name, _, files in
+             (null_files(str(tmp_path), 'AML556_imputed', technique) for technique in DEFAULT_TECHNIQUES)}
+    assert sorted(found) == ['ARACNE', 'CLR', 'GENIE_SYM', 'MRNET']
+    for name, method in [('ARACNE', 'ARACNE'), ('CLR', 'CLR'), ('MRNET', 'MRNET'), ('GENIE_SYM', 'GENIE3')]:
+        assert {os.path.basename(file) for file in found[name]} == \
+            {f"AML556_imputed_{method}_perm_{i}.csv" for i in (1, 2, 10)}
+
+    # The symmetrized copies only when the pattern asks for them
+    name, _, files = null_files(str(tmp_path), 'AML556_imputed', 'GENIE_SYM={subject}_GENIE3_perm_*_SYM.csv')
+    assert {os.path.basename(file) for file in files} == \
+        {f"AML556_imputed_GENIE3_perm_{i}_SYM.csv" for i in (1, 2, 10)}
+
+
+def test_null_files_without_matches(tmp_path):
+    assert null_files(str(tmp_path), 'AML556_imputed', 'CLR')[2] == []
+
+
+def null_values(seed=0):
+    """Skewed edge weights with zeros, negatives and ties, like MI and CLR nulls."""
+    rng = np.random.default_rng(seed)
+    values = np.concatenate([rng.lognormal(-2, 1.5, 3000), -rng.exponential(0.1, 500), np.zeros(200),
+                             np.round(rng.random(300), 2)])
+    return rng.permutation(values)
+
+
+@pytest.mark.parametrize('q', [0.0, 0.05, 0.5, 0.95, 0.99, 1.0])
+def test_sketch_quantile_within_relative_accuracy(q):
+    values = null_values()
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for chunk in np.array_split(values, 7):
+        sketch.update(chunk)
+    expected = np.sort(values)[int(round(q * (values.size - 1)))]
+    assert sketch.count == values.size
+    assert abs(sketch.quantile(q) - expected) <= 0.01 * abs(expected)
+
+    # Sketches of parts merge into the sketch of the whole
+    merged = QuantileSketch(relative_accuracy=0.01)
+    for chunk in np.array_split(values, 3):
+        part = QuantileSketch(relative_accuracy=0.01)
+        part.update(chunk)
+        merged.merge(part)
+    assert merged.quantile(q) == sketch.quantile(q)
+
+
+@pytest.mark.parametrize('quantile', [0.5, 0.95, 0.999])
+def test_exact_threshold_matches_numpy(tmp_path, quantile):
+    values = null_values(1)
+    files = []
+    for i, chunk in enumerate(np.array_split(values, 3), 1):
+        if i == 3:
+            files.append(str(tmp_path / f"AML1_imputed_CLR_perm_{i}.npy"))
+            np.save(files[-1], chunk)
+        else:
+            files.append(str(tmp_path / f"AML1_imputed_CLR_perm_{i}.csv"))
+            pd.DataFrame({'edge_weights': chunk}).to_csv(files[-1], index=False)
+
+    threshold, count = calibrate_threshold(files, quantile, exact=True, relative_accuracy=0.01)
+    assert count == values.size
+    assert threshold == pytest.approx(np.quantile(values, quantile), rel=1e-12)
+    estimate, _ = calibrate_threshold(files, quantile, relative_accuracy=0.01)
+    assert abs(estimate - np.quantile(values, quantile)) <= 0.02 * abs(np.quantile(values, quantile))
+
+
+def test_order_statistics_narrow_large_intervals(tmp_path):
+    # With at most 50 values held at once the interval is narrowed by histograms first; ranks 700 and 701
+    # fall among the 200 zeros, and ranks far apart can only be selected from all values between them
+    values = null_values(2)
+    path = str(tmp_path / "AML1_imputed_ARACNE_perm_1.npy")
+    np.save(path, values)
+    for ranks in ([10, 11], [700, 701], [3998, 3999], [10, 1000, 3999]):
+        assert order_statistics([path], ranks, values.min(), values.max(), max_values=50, bins=16) == \
+            [float(value) for value in np.sort(values)[ranks]]